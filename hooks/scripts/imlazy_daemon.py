@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+imlazy Resident Daemon
+
+Optional long-lived process that runs memory-manager.py and state-manager.py
+commands over a Unix domain socket (~/.imlazy/daemon.sock). The scripts are
+loaded once, so their parsed indexes and working state stay in RAM between
+calls. Requests are served one at a time, which also serializes writers.
+
+memory-manager.py and state-manager.py forward their argv here (see
+forward()) before importing anything heavy, and fall back to direct file
+access when no daemon is running. IMLAZY_DAEMON=0 disables forwarding.
+
+Usage:
+  imlazy_daemon.py start [--idle MINUTES]  # Background; exits after MINUTES idle (default 30, 0 = never)
+  imlazy_daemon.py serve [--idle MINUTES]  # Same, in the foreground
+  imlazy_daemon.py stop
+  imlazy_daemon.py status
+"""
+
+import io
+import json
+import os
+import socket
+import sys
+import time
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+
+IMLAZY_HOME = Path.home() / ".imlazy"
+SOCKET_PATH = IMLAZY_HOME / "daemon.sock"
+PID_FILE = IMLAZY_HOME / "daemon.pid"
+SCRIPTS_DIR = Path(__file__).resolve().parent
+SCRIPTS = {
+    "memory": SCRIPTS_DIR / "memory-manager.py",
+    "state": SCRIPTS_DIR / "state-manager.py",
+}
+DEFAULT_IDLE_MINUTES = 30
+START_TIMEOUT = 5  # Seconds to wait for a started daemon to answer
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+def _connect(timeout=None) -> socket.socket:
+    """A connection to the daemon (raises OSError if nobody listens)."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(str(SOCKET_PATH))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _request(message: dict, timeout=None, sock=None) -> dict:
+    """Send one request and read the reply."""
+    with sock or _connect(timeout) as sock:
+        sock.sendall(json.dumps(message, ensure_ascii=False).encode() + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(1 << 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    if not chunks:
+        raise ConnectionError("daemon closed the connection without replying")
+    return json.loads(b"".join(chunks))
+
+
+def forward(script: str, stdin: bool = False):
+    """
+    Run the current command (sys.argv) in the daemon, print its output and
+    exit with its status. Returns without doing anything when no daemon is
+    listening, so the caller carries on with direct file access. `stdin`
+    forwards standard input for commands that read it.
+    """
+    if os.environ.get("IMLAZY_DAEMON") == "0" or not SOCKET_PATH.exists():
+        return
+    message = {
+        "script": script,
+        "argv": sys.argv[1:],
+        "cwd": os.getcwd(),
+        "env": {key: value for key, value in os.environ.items() if key.startswith("IMLAZY_")},
+    }
+    if stdin:
+        message["stdin"] = sys.stdin.read()
+    try:
+        sock = _connect()
+    except OSError:
+        # Stale socket: nothing was sent, so running locally is safe
+        if stdin:
+            sys.stdin = io.StringIO(message["stdin"])
+        return
+
+    try:
+        reply = _request(message, sock=sock)
+    except (OSError, ValueError) as e:
+        print(json.dumps({"error": f"imlazy daemon: {e}"}))
+        sys.exit(1)
+    sys.stdout.write(reply.get("stdout", ""))
+    sys.stderr.write(reply.get("stderr", ""))
+    sys.exit(reply.get("code", 0))
+
+
+# ---------------------------------------------------------------------------
+# Server
+# ---------------------------------------------------------------------------
+
+class Daemon:
+    """Loaded scripts plus the request loop."""
+
+    def __init__(self):
+        self.modules = {}  # script -> (mtime_ns, module)
+        self.started = time.time()
+        self.requests = 0
+
+    def module(self, script: str):
+        """The script loaded as a module, reloaded when its file changes."""
+        import importlib.util
+
+        path = SCRIPTS[script]
+        mtime = path.stat().st_mtime_ns
+        loaded = self.modules.get(script)
+        if loaded is None or loaded[0] != mtime:
+            spec = importlib.util.spec_from_file_location(f"imlazy_{script}", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            loaded = (mtime, module)
+            self.modules[script] = loaded
+        return loaded[1]
+
+    def status(self) -> dict:
+        return {
+            "running": True,
+            "pid": os.getpid(),
+            "socket": str(SOCKET_PATH),
+            "uptime_seconds": round(time.time() - self.started),
+            "requests": self.requests,
+            "loaded": sorted(self.modules),
+        }
+
+    def run(self, message: dict) -> dict:
+        """Run one forwarded command with the client's argv, cwd, env and stdin."""
+        if message.get("script") not in SCRIPTS:
+            return {"stdout": json.dumps({"error": f"Unknown script: {message.get('script')}"}) + "\n",
+                    "code": 1}
+        module = self.module(message["script"])
+
+        saved_env = {key: value for key, value in os.environ.items() if key.startswith("IMLAZY_")}
+        saved_argv, saved_stdin = sys.argv, sys.stdin
+        stdout, stderr = io.StringIO(), io.StringIO()
+        code = 0
+        try:
+            os.chdir(message.get("cwd") or "/")
+            for key in saved_env:
+                del os.environ[key]
+            os.environ.update(message.get("env") or {})
+            sys.argv = [str(SCRIPTS[message["script"]])] + list(message.get("argv") or [])
+            sys.stdin = io.StringIO(message.get("stdin") or "")
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    module.main()
+                except SystemExit as e:
+                    code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        finally:
+            sys.argv, sys.stdin = saved_argv, saved_stdin
+            for key in [key for key in os.environ if key.startswith("IMLAZY_")]:
+                del os.environ[key]
+            os.environ.update(saved_env)
+        self.requests += 1
+        return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "code": code}
+
+    def handle(self, conn) -> bool:
+        """Answer one connection; False once asked to stop."""
+        chunks = []
+        while True:
+            chunk = conn.recv(1 << 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        if not chunks:
+            return True
+
+        try:
+            message = json.loads(b"".join(chunks))
+        except ValueError as e:
+            reply, keep_running = {"error": f"Bad request: {e}"}, True
+        else:
+            keep_running = not message.get("stop")
+            if message.get("ping") or message.get("stop"):
+                reply = self.status()
+            else:
+                try:
+                    reply = self.run(message)
+                except Exception as e:
+                    reply = {"stdout": json.dumps({"error": str(e)}) + "\n", "code": 1}
+        conn.sendall(json.dumps(reply, ensure_ascii=False).encode())
+        return keep_running
+
+
+def _listening() -> bool:
+    try:
+        _request({"ping": True}, timeout=2)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+def serve(idle_minutes: float = DEFAULT_IDLE_MINUTES) -> dict:
+    """Serve requests until stopped or idle for `idle_minutes` (0 = never)."""
+    import signal
+
+    IMLAZY_HOME.mkdir(parents=True, exist_ok=True)
+    if SOCKET_PATH.exists():
+        if _listening():
+            return {"error": "Daemon already running", "socket": str(SOCKET_PATH)}
+        SOCKET_PATH.unlink()
+
+    daemon = Daemon()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)  # Socket only reachable by this user
+    try:
+        server.bind(str(SOCKET_PATH))
+    finally:
+        os.umask(old_umask)
+    server.listen(64)
+    server.settimeout(idle_minutes * 60 if idle_minutes else None)
+    PID_FILE.write_text(str(os.getpid()))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                break
+            with conn:
+                conn.settimeout(None)
+                if not daemon.handle(conn):
+                    break
+    finally:
+        server.close()
+        SOCKET_PATH.unlink(missing_ok=True)
+        PID_FILE.unlink(missing_ok=True)
+    return {"success": True, "served": daemon.requests}
+
+
+def start(idle_minutes: float = DEFAULT_IDLE_MINUTES) -> dict:
+    """Start a background daemon (no-op if one is running)."""
+    import subprocess
+
+    if _listening():
+        return {"success": True, "already_running": True, **_request({"ping": True})}
+    IMLAZY_HOME.mkdir(parents=True, exist_ok=True)
+    env = dict(os.environ, IMLAZY_DAEMON="0")
+    subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), "serve", "--idle", str(idle_minutes)],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        cwd="/", env=env, start_new_session=True
+    )
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        if _listening():
+            return {"success": True, **_request({"ping": True})}
+        time.sleep(0.05)
+    return {"error": "Daemon did not start", "socket": str(SOCKET_PATH)}
+
+
+def stop() -> dict:
+    try:
+        status = _request({"stop": True}, timeout=10)
+    except (OSError, ValueError):
+        return {"success": True, "running": False}
+    return {"success": True, "stopped": status["pid"], "requests": status["requests"]}
+
+
+def status() -> dict:
+    try:
+        return _request({"ping": True}, timeout=2)
+    except (OSError, ValueError):
+        return {"running": False, "socket": str(SOCKET_PATH)}
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(json.dumps({"error": "Usage: imlazy_daemon.py start|serve|stop|status [--idle MINUTES]"}))
+        sys.exit(1)
+
+    cmd = sys.argv[1].lower()
+    idle = DEFAULT_IDLE_MINUTES
+    if "--idle" in sys.argv:
+        idx = sys.argv.index("--idle")
+        if idx + 1 < len(sys.argv):
+            idle = float(sys.argv[idx + 1])
+
+    try:
+        if cmd == "start":
+            result = start(idle)
+        elif cmd == "serve":
+            result = serve(idle)
+        elif cmd == "stop":
+            result = stop()
+        elif cmd == "status":
+            result = status()
+        else:
+            result = {"error": f"Unknown command: {cmd}"}
+
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+
+    except Exception as e:
+        print(json.dumps({"error": str(e)}))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,21 @@ LOGS_DIR="${IMLAZY_HOME}/logs"
 # Ensure log directory exists
 mkdir -p "${LOGS_DIR}"
 
+# Opt-in per-session working state: export the session id as the state
+# namespace for this session's commands (reflection-trigger.py reads it
+# from its own payload)
+if [ "${IMLAZY_SESSION_STATE:-}" = "1" ] && [ -n "${CLAUDE_ENV_FILE:-}" ] && [ ! -t 0 ]; then
+    SESSION_ID="$(python3 -c 'import json, re, sys; print(re.sub(r"[^A-Za-z0-9_-]", "", str(json.load(sys.stdin).get("session_id", ""))))' 2>/dev/null)"
+    if [ -n "${SESSION_ID}" ]; then
+        echo "export IMLAZY_NAMESPACE=${SESSION_ID}" >> "${CLAUDE_ENV_FILE}"
+    fi
+fi
+
+# Opt-in resident daemon for state/memory commands
+if [ "${IMLAZY_DAEMON:-}" = "1" ]; then
+    python3 "${SCRIPT_DIR}/imlazy_daemon.py" start >/dev/null 2>&1 || true
+fi
+
 # Initialize workflow log for this session
 python3 "${SCRIPT_DIR}/workflow-logger.py" --type SESSION --name imlazy --event START --meta "{\"cwd\": \"$(pwd)\"}" --no-console 2>/dev/null
 
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+imlazy Memory Search Benchmark
+
+Measures ranking latency of memory-manager.py over synthetic tier indexes.
+Entries are built in memory (nothing is written to ~/.imlazy) with a
+Zipf-like vocabulary so document frequencies resemble real memories.
+
+Usage:
+  memory-bench.py [--sizes 10000,100000] [--queries N] [--seed N]
+"""
+
+import argparse
+import importlib.util
+import json
+import random
+import time
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+VOCAB_SIZE = 20000
+ENTRY_LENGTH = (20, 80)
+
+
+def load_memory_manager():
+    """Import memory-manager.py (hyphenated, so not importable by name)."""
+    spec = importlib.util.spec_from_file_location("memory_manager", SCRIPT_DIR / "memory-manager.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_vocab(rng: random.Random) -> list:
+    """Distinct pronounceable pseudo-words, most frequent first."""
+    syllables = [c + v for c in "bcdfghklmnprstvz" for v in "aeiou"]
+    vocab = set()
+    while len(vocab) < VOCAB_SIZE:
+        vocab.add("".join(rng.choices(syllables, k=rng.randint(2, 4))))
+    return sorted(vocab, key=lambda word: (len(word), word))
+
+
+def build_index(mm, vocab: list, size: int, rng: random.Random) -> dict:
+    """Build an in-memory tier index of `size` synthetic entries."""
+    weights = [1.0 / (rank + 1) for rank in range(VOCAB_SIZE)]
+    index = mm._empty_index()
+
+    for i in range(size):
+        words = rng.choices(vocab, weights=weights, k=rng.randint(*ENTRY_LENGTH))
+        mm._index_add(index, {
+            "id": f"{i:012x}",
+            "data": {"content": " ".join(words)},
+            "tags": [],
+            "created_at": f"2024-01-01T00:00:{i % 60:02d}"
+        })
+    return index
+
+
+def make_queries(vocab: list, count: int, rng: random.Random) -> list:
+    """Mix of common and rare terms, 2-4 terms per query."""
+    return [
+        [vocab[int(rng.paretovariate(0.7)) % VOCAB_SIZE] for _ in range(rng.randint(2, 4))]
+        for _ in range(count)
+    ]
+
+
+def time_ranker(ranker, index: dict, queries: list) -> dict:
+    """Median and p95 latency of a ranking function in milliseconds."""
+    timings = []
+    for terms in queries:
+        start = time.perf_counter()
+        ranker(index, terms)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "median_ms": round(timings[len(timings) // 2], 3),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="imlazy memory search benchmark")
+    parser.add_argument("--sizes", default="10000,100000", help="Comma-separated entry counts")
+    parser.add_argument("--queries", type=int, default=50, help="Queries per measurement")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    mm = load_memory_manager()
+    numpy_module = mm.np
+    results = {"numpy": numpy_module is not None, "sizes": {}}
+
+    for size in [int(s) for s in args.sizes.split(",")]:
+        rng = random.Random(args.seed)
+        vocab = make_vocab(rng)
+        index = build_index(mm, vocab, size, rng)
+        queries = make_queries(vocab, args.queries, rng)
+
+        measured = {"match": time_ranker(mm._rank_match, index, queries)}
+        mm.np = None
+        measured["bm25_python"] = time_ranker(mm._rank_bm25, index, queries)
+        mm.np = numpy_module
+        if numpy_module is not None:
+            measured["bm25_numpy"] = time_ranker(mm._rank_bm25, index, queries)
+
+        results["sizes"][size] = measured
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,64 +9,3480 @@ Manages the cognitive memory system:
 - Procedural Memory: Learned methods and strategies
 
 Usage:
-  memory-manager.py search TYPE QUERY [--limit N]
-  memory-manager.py store TYPE CONTENT [--tags TAG1,TAG2]
+  memory-manager.py search TYPE QUERY [--limit N] [--rank bm25|match|vector]
+                           [--project current|all|global|HASH] [--no-cache]
+                           [--tags T1,T2] [--since DATE|Nd] [--until DATE|Nd] [--outcome OUTCOME]
+                           [--scoring relevance|balanced|recent[,KEY=N...]]
+  memory-manager.py search all QUERY [--limit N] [--rank ...] [--per-tier N|TYPE=N,...]
+                                     [--project ...] [--tags ...] [--since ...] ...
+  memory-manager.py store TYPE CONTENT [--tags TAG1,TAG2] [--project current|HASH] [--no-dedup]
+  memory-manager.py store TYPE --batch FILE|- [--tags ...] [--project ...] [--no-dedup]
   memory-manager.py recall EPISODE_ID
   memory-manager.py consolidate  # Move working to episodic
-  memory-manager.py stats
-  memory-manager.py prune [--days N]
+  memory-manager.py stats [--verify]
+  memory-manager.py prune [--days N] [--max-entries N] [--max-bytes N]
+                          [--policy lru|lfu|decay] [--half-life DAYS]
+  memory-manager.py reindex [TYPE]  # Rebuild search indexes
+  memory-manager.py compact [TYPE] [--days N]  # Pack cold entries into segments
+  memory-manager.py merge [TYPE] [--shard SHARD]  # Fold index logs into their bases
+  memory-manager.py migrate  # Copy JSON files into the SQLite backend
+  memory-manager.py import [FILE|-] [--type TYPE] [--no-dedup]  # JSONL in
+  memory-manager.py export [TYPE] [--project ...] [--output FILE]  # JSONL out
+
+Storage backend: "files" (one JSON file per entry) or "sqlite" (single
+~/.imlazy/memory.db). SQLite is used once `migrate` has created the
+database; override with IMLAZY_MEMORY_BACKEND=files|sqlite.
+
+Episodic memory is sharded by project: searches read the current project's
+shard plus the global one (entries stored without a project) by default.
+
+When the resident daemon (imlazy_daemon.py) is running, commands run inside
+it with the indexes already in RAM; otherwise they run here directly.
 """
 
-import json
-import os
-import sys
-import hashlib
-from datetime import datetime, timedelta
-from pathlib import Path
-from typing import List, Dict, Optional
+import bisect
+import difflib
+import json
+import os
+import re
+import sys
+import hashlib
+import heapq
+import importlib.util
+import math
+import mmap
+import random
+import shutil
+import sqlite3
+import subprocess
+import threading
+import zlib
+from array import array
+from collections import Counter
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, List, Dict, Optional, Tuple
+
+if __name__ == "__main__":
+    # Hand the command to the resident daemon before the heavy imports
+    from imlazy_daemon import forward
+    forward("memory", stdin="-" in sys.argv[2:] or sys.argv[1:2] == ["import"] and (
+        len(sys.argv) < 3 or sys.argv[2].startswith("--")))
+
+try:
+    import fcntl
+except ImportError:  # Windows: index writes are unlocked
+    fcntl = None
+
+try:
+    import numpy as np
+except ImportError:  # Ranking falls back to plain Python
+    np = None
+
+IMLAZY_HOME = Path.home() / ".imlazy"
+MEMORY_DIRS = {
+    "working": IMLAZY_HOME / "working",
+    "episodic": IMLAZY_HOME / "episodic",
+    "semantic": IMLAZY_HOME / "semantic",
+    "procedural": IMLAZY_HOME / "procedural"
+}
+LONG_TERM_TYPES = ["episodic", "semantic", "procedural"]
+
+# Tiers partitioned by project_hash. A shard is named "episodic" (global:
+# entries without a project) or "episodic/<project_hash>", and has its own
+# entry directory and index files.
+SHARDED_TYPES = ["episodic"]
+PROJECT_RE = re.compile(r"^[\w-]+$")
+ID_RE = re.compile(r"^[\w-]+$")  # Ids name entry files
+
+# Bulk import / batch store: entries per write pass (one index, vector and
+# fingerprint update per shard each)
+IMPORT_BATCH_SIZE = 50000
+
+# Storage backends
+MEMORY_DB = IMLAZY_HOME / "memory.db"
+BACKENDS = ["files", "sqlite"]
+
+# Recalls append to this journal instead of rewriting entries; counts are
+# merged into the backend once it outgrows the limit, and before prune
+ACCESS_JOURNAL = IMLAZY_HOME / "access.jsonl"
+ACCESS_JOURNAL_MAX_BYTES = 64 * 1024
+
+# Compressed segments (files backend): loose entries unused for
+# SEGMENT_COLD_DAYS are packed into append-only segment files of
+# zlib-compressed JSON-line blocks, located through a per-shard offset table
+SEGMENT_DIR = IMLAZY_HOME / "segments"
+SEGMENT_VERSION = 1
+SEGMENT_BLOCK_BYTES = 64 * 1024  # Uncompressed JSON per block
+SEGMENT_MAX_BYTES = 8 * 1024 * 1024  # Start a new segment file past this
+SEGMENT_COLD_DAYS = 14
+SEGMENT_MIN_BATCH = 32  # Automatic compaction waits for this many cold entries
+SEGMENT_BATCH_LEVEL = 6  # zlib level for batches packed in the foreground (compaction uses 9)
+COMPACT_INTERVAL = timedelta(days=1)  # ...and runs at most this often
+
+# Capacity eviction policies for prune
+EVICTION_POLICIES = ["lru", "lfu", "decay"]
+
+# Positional inverted index (term -> {memory id: token positions}) per shard,
+# with tag, outcome and creation-date indexes for search filters. A base
+# generation hashes terms into posting bucket files; stores append to a delta
+# log that a background process merges into a new base once it grows past
+# INDEX_LOG_MAX_BYTES (see _save_base, _IndexUpdate).
+INDEX_DIR = IMLAZY_HOME / "index"
+INDEX_VERSION = 9
+INDEX_BUCKET_POSTINGS = 4096  # (term, memory id) pairs per posting bucket
+INDEX_LOG_MAX_BYTES = 1024 * 1024
+MANIFEST_TOP_TAGS = 20  # Tags listed per tier by stats
+TOKEN_RE = re.compile(r"\w+")
+
+# A query term matches the index terms containing it, found through a
+# gram -> terms index; terms shorter than a gram match by prefix instead.
+# Only the nearest QUERY_EXPANSION_MAX (the term itself, then the shortest
+# prefixed, then the shortest containing) are searched.
+QUERY_GRAM = 3
+QUERY_EXPANSION_MAX = 32
+
+# Query language: [-][field:](term | "phrase"), clauses joined by AND or OR
+QUERY_CLAUSE_RE = re.compile(r'(-?)(?:(\w+):)?(?:"([^"]*)"?|(\S+))')
+
+# Search filters: --since/--until take an ISO date(-time) prefix or an age
+FILTER_TIME_RE = re.compile(r"^\d{4}(-\d{2}(-\d{2}([T ][\d:.]+)?)?)?$")
+FILTER_AGE_RE = re.compile(r"^(\d+)([dh])$")
+
+# Query result cache: one file per search request, valid while the store
+# generation it was computed at is current (stores, prunes and reindexes bump it)
+QUERY_CACHE_DIR = INDEX_DIR / "queries"
+GENERATION_FILE = INDEX_DIR / "generation"
+
+# Ranking
+RANK_MODES = ["bm25", "match", "vector"]
+
+# Score blend: text relevance x recency x usage x outcome. Recency halves
+# every half_life_days since last use (0 = off); usage multiplies by
+# 1 + usage * ln(1 + access_count); outcome weights are raised to `outcome`.
+# The per-entry inputs are precomputed in the index (see _ranking_prior).
+SCORING_PROFILES = {
+    "relevance": {"half_life_days": 0.0, "usage": 0.0, "outcome": 0.0},
+    "balanced": {"half_life_days": 180.0, "usage": 0.2, "outcome": 1.0},
+    "recent": {"half_life_days": 30.0, "usage": 0.2, "outcome": 1.0},
+}
+DEFAULT_SCORING = "balanced"  # Overridden by $IMLAZY_SCORING, then --scoring
+OUTCOME_WEIGHTS = {"success": 1.0, "partial": 0.6, "failure": 0.3}
+EPOCH = datetime(1970, 1, 1)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Offline similarity: feature-hashed character n-gram vectors (float32 rows
+# of a memory-mapped matrix) with random-hyperplane LSH keys (a uint16 per
+# table per row, memory-mapped beside it)
+VECTOR_INDEX_VERSION = 3
+VECTOR_DIM = 256
+VECTOR_NGRAM = 3
+LSH_TABLES = 8
+LSH_BITS = 10
+LSH_SEED = 1729
+LSH_MIN_ENTRIES = 2000  # Below this, score every vector exactly
+# Batches vectorize and fingerprint texts SKETCH_BLOCK at a time, hashing
+# each distinct word once; at most SKETCH_WORD_CACHE words' rows are kept
+SKETCH_BLOCK = 256
+SKETCH_WORD_CACHE = 32768
+
+# Near-duplicate merge on store: 64-bit SimHash of the entry data, looked up
+# through DEDUP_BANDS exact-match band tables. Any fingerprint within
+# DEDUP_MAX_DISTANCE (< DEDUP_BANDS) bits shares at least one band.
+DEDUP_TYPES = ["semantic", "procedural"]
+FINGERPRINT_INDEX_VERSION = 2
+SIMHASH_BITS = 64
+DEDUP_BANDS = 4
+DEDUP_MAX_DISTANCE = 3
+# SimHash bags n-grams, so reordered texts ("A over B" / "B over A") collide;
+# a match must also have token sequences at least this similar
+DEDUP_MIN_SIMILARITY = 0.9
+
+
+def ensure_dirs():
+    """Ensure all memory directories exist."""
+    for path in MEMORY_DIRS.values():
+        path.mkdir(parents=True, exist_ok=True)
+    INDEX_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def generate_id(content: str) -> str:
+    """Generate a unique ID for a memory entry."""
+    timestamp = datetime.now().isoformat()
+    return hashlib.md5(f"{content}{timestamp}".encode()).hexdigest()[:12]
+
+
+def derived_id(*parts: str) -> str:
+    """Stable ID for an entry derived from other records (same parts, same ID)."""
+    return hashlib.md5(":".join(parts).encode()).hexdigest()[:12]
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase index terms."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def _iter_text(value) -> Iterable[str]:
+    """Yield every string/number leaf of a JSON value (keys excluded)."""
+    if isinstance(value, dict):
+        for item in value.values():
+            yield from _iter_text(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _iter_text(item)
+    elif isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        yield str(value)
+
+
+def _entry_text(entry: Dict) -> str:
+    """Searchable text of an entry: its data values and tags."""
+    return " ".join(_iter_text([entry.get("data"), entry.get("tags", [])]))
+
+
+def _entry_fields(entry: Dict) -> List[tuple]:
+    """(field, text) pairs in _entry_text order: each top-level data key, then "tags"."""
+    data = entry.get("data")
+    if isinstance(data, dict):
+        fields = [(key, " ".join(_iter_text(value))) for key, value in data.items()]
+    else:
+        fields = [("data", " ".join(_iter_text(data)))]
+    return fields + [("tags", " ".join(_iter_text(entry.get("tags", []))))]
+
+
+def _entry_positions(entry: Dict) -> tuple:
+    """
+    Token positions of an entry's searchable text: ({term: [positions]},
+    {field: [start, end)}), positions counted across _entry_text.
+    """
+    positions = {}
+    spans = {}
+    offset = 0
+    for field, text in _entry_fields(entry):
+        tokens = tokenize(text)
+        if tokens:
+            spans[field] = [offset, offset + len(tokens)]
+        for i, term in enumerate(tokens, offset):
+            positions.setdefault(term, []).append(i)
+        offset += len(tokens)
+    return positions, spans
+
+
+def _split_shard(shard: str) -> tuple:
+    """("episodic", "1a2b3c4d") for "episodic/1a2b3c4d"; project is None for a tier."""
+    memory_type, _, project = shard.partition("/")
+    return memory_type, project or None
+
+
+def _shard_dir(shard: str) -> Path:
+    memory_type, project = _split_shard(shard)
+    return MEMORY_DIRS[memory_type] / project if project else MEMORY_DIRS[memory_type]
+
+
+def _entry_project(entry: Dict) -> Optional[str]:
+    """An entry's project: set on store, or carried in episode data."""
+    data = entry.get("data")
+    return entry.get("project_hash") or (data.get("project_hash") if isinstance(data, dict) else None) or None
+
+
+def _entry_outcome(entry: Dict) -> Optional[str]:
+    """An episode's outcome ("success", "partial", ...), for search filters."""
+    data = entry.get("data")
+    outcome = data.get("outcome") if isinstance(data, dict) else None
+    return outcome if isinstance(outcome, str) and outcome else None
+
+
+def _entry_shard(entry: Dict) -> str:
+    """The shard an entry belongs to."""
+    project = _entry_project(entry)
+    if entry["type"] in SHARDED_TYPES and project:
+        return f"{entry['type']}/{project}"
+    return entry["type"]
+
+
+def _entry_path(shard: str, memory_id: str) -> Path:
+    return _shard_dir(shard) / f"{memory_id}.json"
+
+
+def _read_entry(shard: str, memory_id: str) -> Optional[Dict]:
+    """Load a single entry (loose file, else packed), or None if missing or unreadable."""
+    try:
+        with open(_entry_path(shard, memory_id), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return _read_packed(shard, memory_id)
+    except (json.JSONDecodeError, IOError):
+        return None
+
+
+def _write_entry(entry: Dict, shard: str = None) -> int:
+    """Write an entry file (into its own shard by default) and return its size in bytes."""
+    payload = json.dumps(entry, indent=2, ensure_ascii=False).encode()
+    path = _entry_path(shard or _entry_shard(entry), entry["id"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(payload)
+    return len(payload)
+
+
+# ---------------------------------------------------------------------------
+# Compressed segments
+# ---------------------------------------------------------------------------
+
+def _segment_path(shard: str, segment: int) -> Path:
+    return SEGMENT_DIR / shard / f"{segment:06d}.seg"
+
+
+def _offsets_path(shard: str) -> Path:
+    return SEGMENT_DIR / shard / "offsets.json"
+
+
+def _empty_offsets() -> Dict:
+    # entries: memory_id -> [segment, block offset, block length, start, end,
+    # size]; start:end is the entry's line in the decompressed block, size
+    # its share of the compressed block. segments: raw bytes written to each
+    # segment file and how many of those belong to deleted/replaced entries.
+    return {"version": SEGMENT_VERSION, "next_segment": 0, "entries": {}, "segments": {}}
+
+
+def _load_offsets(shard: str) -> Dict:
+    """A shard's offset table, cached in-process until the file is replaced."""
+    return _read_cached_index_file(_offsets_path(shard), SEGMENT_VERSION) or _empty_offsets()
+
+
+@contextmanager
+def _updating_offsets(shard: str):
+    """Load a shard's offset table under lock and save it back on exit."""
+    with _index_lock(f"{shard}.segments"), _drop_cached(_offsets_path(shard)):
+        offsets = _read_cached_index_file(_offsets_path(shard), SEGMENT_VERSION) or _empty_offsets()
+        yield offsets
+        _offsets_path(shard).parent.mkdir(parents=True, exist_ok=True)
+        _write_index_file(_offsets_path(shard), offsets)
+
+
+@lru_cache(maxsize=32)
+def _decompress_block(path: str, inode: int, offset: int, length: int) -> bytes:
+    # Blocks never change once written, so (file, offset) identifies one
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return zlib.decompress(f.read(length))
+
+
+def _read_block(shard: str, location: List) -> bytes:
+    segment, offset, length = location[:3]
+    path = _segment_path(shard, segment)
+    return _decompress_block(str(path), path.stat().st_ino, offset, length)
+
+
+def _read_packed(shard: str, memory_id: str) -> Optional[Dict]:
+    """Load a packed entry, or None if the shard's segments don't hold it."""
+    for _ in range(2):  # A segment rewrite may have moved it since the table was read
+        location = _load_offsets(shard)["entries"].get(memory_id)
+        if location is None:
+            return None
+        try:
+            block = _read_block(shard, location)
+        except (IOError, zlib.error):
+            continue
+        return json.loads(block[location[3]:location[4]])
+    return None
+
+
+def _iter_packed(shard: str, skip: set = frozenset()) -> Iterable[tuple]:
+    """Yield (entry, size) for every packed entry, decompressing each block once."""
+    blocks = {}
+    for memory_id, location in _load_offsets(shard)["entries"].items():
+        if memory_id not in skip:
+            blocks.setdefault(tuple(location[:3]), []).append(location)
+
+    for block_key, locations in sorted(blocks.items()):
+        try:
+            block = _read_block(shard, list(block_key))
+        except (IOError, zlib.error):
+            continue
+        for location in locations:
+            yield json.loads(block[location[3]:location[4]]), location[5]
+
+
+def _forget_packed(offsets: Dict, memory_id: str):
+    """Drop an entry from the offset table, counting its bytes as dead."""
+    location = offsets["entries"].pop(memory_id, None)
+    if location is not None:
+        segment = offsets["segments"].get(str(location[0]))
+        if segment is not None:
+            segment["dead"] += location[4] - location[3]
+
+
+def _append_block(shard: str, offsets: Dict, lines: List[tuple], avoid: set, level: int = 9) -> Path:
+    """Compress (memory_id, JSON line) pairs into one block at the end of the current segment."""
+    raw = b"".join(line for _, line in lines)
+    data = zlib.compress(raw, level)
+
+    segment = offsets["next_segment"] - 1
+    path = _segment_path(shard, segment)
+    if segment < 0 or segment in avoid or not path.exists() or path.stat().st_size >= SEGMENT_MAX_BYTES:
+        segment = offsets["next_segment"]
+        offsets["next_segment"] += 1
+        offsets["segments"][str(segment)] = {"raw": 0, "dead": 0}
+        path = _segment_path(shard, segment)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(path, 'ab') as f:
+        offset = f.seek(0, os.SEEK_END)
+        f.write(data)
+    offsets["segments"][str(segment)]["raw"] += len(raw)
+
+    start = 0
+    for memory_id, line in lines:
+        _forget_packed(offsets, memory_id)
+        size = max(1, round(len(line) * len(data) / len(raw)))
+        offsets["entries"][memory_id] = [segment, offset, len(data), start, start + len(line), size]
+        start += len(line)
+    return path
+
+
+def _pack_entries(shard: str, offsets: Dict, entries: List[Dict], avoid: set = frozenset(),
+                  level: int = 9) -> Dict[str, int]:
+    """
+    Append entries to the shard's segments (caller holds the segments lock)
+    and return each entry's packed size. Segments in `avoid` are not
+    appended to; blocks are compressed at zlib `level`.
+    """
+    touched = set()
+    lines, pending = [], 0
+    for entry in entries:
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+        lines.append((entry["id"], line))
+        pending += len(line)
+        if pending >= SEGMENT_BLOCK_BYTES:
+            touched.add(_append_block(shard, offsets, lines, avoid, level))
+            lines, pending = [], 0
+    if lines:
+        touched.add(_append_block(shard, offsets, lines, avoid, level))
+
+    # Blocks must be durable before the table points at them
+    for path in touched:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    return {entry["id"]: offsets["entries"][entry["id"]][5] for entry in entries}
+
+
+def _collect_segments(shard: str, offsets: Dict, rewrite: bool) -> tuple:
+    """
+    Delete segment files holding no live entries; with `rewrite`, first
+    repack the live entries of segments that are mostly dead. Returns the
+    raw bytes reclaimed and the new packed size of each moved entry.
+    """
+    victims = {
+        int(number) for number, segment in offsets["segments"].items()
+        if segment["dead"] >= segment["raw"] or (rewrite and segment["dead"] * 2 > segment["raw"])
+    }
+    if not victims:
+        return 0, {}
+
+    # Read through the in-memory table: it may point at blocks packed by this run
+    moving = [
+        json.loads(_read_block(shard, location)[location[3]:location[4]])
+        for location in offsets["entries"].values() if location[0] in victims
+    ]
+    moved = _pack_entries(shard, offsets, moving, avoid=victims) if moving else {}
+
+    reclaimed = 0
+    for number in victims:
+        reclaimed += offsets["segments"].pop(str(number))["raw"]
+        _segment_path(shard, number).unlink(missing_ok=True)
+    return reclaimed, moved
+
+
+# ---------------------------------------------------------------------------
+# Inverted index
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def _index_lock(name: str):
+    """Serialize read-modify-write of an index file across processes."""
+    lock_path = INDEX_DIR / f"{name}.lock"
+    # Shard index files live in a per-tier subdirectory
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _lock_free(name: str) -> bool:
+    """Whether nobody holds an _index_lock right now."""
+    if fcntl is None:
+        return True
+    lock_path = INDEX_DIR / f"{name}.lock"
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return True
+
+
+def _empty_manifest() -> Dict:
+    return {"count": 0, "size_bytes": 0, "oldest": None, "newest": None, "tags": {}}
+
+
+def _empty_index() -> Dict:
+    # An index held in memory while it is built or merged. postings: term ->
+    # {memory_id: token positions}; the positions count is the term
+    # frequency, the posting size the document frequency and total_length /
+    # len(docs) the average length. Each doc's "fields" maps a field to its
+    # [start, end) position span. manifest: running tier totals.
+    return {"postings": {}, "docs": {}, "total_length": 0, "manifest": _empty_manifest()}
+
+
+def _manifest_add(manifest: Dict, doc: Dict):
+    manifest["count"] += 1
+    manifest["size_bytes"] += doc["size"]
+    created = doc["created_at"]
+    if created:
+        if manifest["oldest"] is None or created < manifest["oldest"]:
+            manifest["oldest"] = created
+        if manifest["newest"] is None or created > manifest["newest"]:
+            manifest["newest"] = created
+    for tag in doc["tags"]:
+        manifest["tags"][tag] = manifest["tags"].get(tag, 0) + 1
+
+
+def _manifest_remove(index: Dict, doc: Dict):
+    manifest = index["manifest"]
+    manifest["count"] -= 1
+    manifest["size_bytes"] -= doc["size"]
+    for tag in doc["tags"]:
+        manifest["tags"][tag] = manifest["tags"].get(tag, 0) - 1
+        if manifest["tags"][tag] <= 0:
+            del manifest["tags"][tag]
+
+    # Only losing a boundary entry needs a rescan of the remaining docs
+    if doc["created_at"] in (manifest["oldest"], manifest["newest"]):
+        created = [d["created_at"] for d in index["docs"].values() if d.get("created_at")]
+        manifest["oldest"] = min(created, default=None)
+        manifest["newest"] = max(created, default=None)
+
+
+def _entry_doc(entry: Dict, size: int = 0) -> tuple:
+    """(index doc, {term: positions}) of an entry; size is its stored bytes."""
+    term_positions, spans = _entry_positions(entry)
+    doc = {
+        "fields": spans,
+        "length": sum(len(positions) for positions in term_positions.values()),
+        "tags": entry.get("tags", []),
+        "created_at": entry.get("created_at"),
+        "outcome": _entry_outcome(entry),
+        "access_count": entry.get("access_count", 0),
+        "last_accessed": entry.get("last_accessed"),
+        "size": size
+    }
+    doc["prior"] = _ranking_prior(doc)
+    return doc, term_positions
+
+
+def _doc_norms(doc: Dict) -> Dict:
+    """The part of a doc that ranking reads for every candidate."""
+    return {"length": doc["length"], "created_at": doc["created_at"], "prior": doc["prior"]}
+
+
+def _index_add(index: Dict, entry: Dict, size: int = 0):
+    """Add a new entry to an in-memory index; size is its stored bytes."""
+    doc, term_positions = _entry_doc(entry, size)
+    for term, positions in term_positions.items():
+        index["postings"].setdefault(term, {})[entry["id"]] = positions
+    index["docs"][entry["id"]] = doc
+    index["total_length"] += doc["length"]
+    _manifest_add(index["manifest"], doc)
+
+
+def _until_bound(until: str) -> str:
+    """Upper bound for created_at <= until, including everything under a date prefix."""
+    return until + "\uffff"
+
+
+def _filter_candidates(index: Dict, filters: Dict) -> Optional[set]:
+    """
+    Ids of a shard matching every filter (see _parse_filters), looked up in
+    the tag, outcome and date indexes; None when nothing is filtered.
+    """
+    matches = [index["tag_postings"].get(tag, {}) for tag in filters.get("tags") or []]
+    if filters.get("outcome"):
+        matches.append(index["outcome_postings"].get(filters["outcome"], {}))
+    if filters.get("since") or filters.get("until"):
+        dates = index["dates"]
+        lo = bisect.bisect_left(dates, [filters["since"]]) if filters.get("since") else 0
+        hi = bisect.bisect_right(dates, [_until_bound(filters["until"])]) if filters.get("until") else len(dates)
+        matches.append({memory_id for _, memory_id in dates[lo:hi]})
+    if not matches:
+        return None
+
+    matches.sort(key=len)
+    candidates = set(matches[0])
+    for match in matches[1:]:
+        candidates = {memory_id for memory_id in candidates if memory_id in match}
+    return candidates
+
+
+def _iter_entry_files(shard: str) -> Iterable[tuple]:
+    """Yield (entry, stored size) for every readable entry of a shard, loose or packed."""
+    loose = set()
+    for file_path in _shard_dir(shard).glob("*.json"):
+        loose.add(file_path.stem)
+        try:
+            with open(file_path, 'r') as f:
+                entry = json.load(f)
+            size = file_path.stat().st_size
+        except (json.JSONDecodeError, IOError):
+            continue
+        entry.setdefault("id", file_path.stem)
+        yield entry, size
+
+    # A loose file shadows an older packed copy of the same entry
+    yield from _iter_packed(shard, skip=loose)
+
+
+def _iter_entries(shard: str) -> Iterable[Dict]:
+    """Yield every readable entry of a shard."""
+    for entry, _ in _iter_entry_files(shard):
+        yield entry
+
+
+def _build_index(shard: str) -> Dict:
+    """Build a shard index from scratch by reading every entry file."""
+    index = _empty_index()
+    for entry, size in _iter_entry_files(shard):
+        _index_add(index, entry, size)
+    return index
+
+
+def _read_index_file(path: Path, version: int) -> Optional[Dict]:
+    """Load an index file, or None if it is missing, corrupt or outdated."""
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return None
+    return data if data.get("version") == version else None
+
+
+def _write_index_file(path: Path, data: Dict):
+    """Atomically replace an index file."""
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        # dumps() runs the C encoder; dump() streams through the Python one
+        f.write(json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+        stat = os.fstat(f.fileno())
+    os.replace(tmp_path, path)
+    _index_file_cache[path] = ((stat.st_ino, stat.st_mtime_ns), data)
+
+
+# path -> ((inode, mtime), parsed file). Every write replaces the file (new
+# inode), so a changed key means another process rewrote it. Lets a resident
+# daemon keep indexes in RAM; a one-shot command parses each file once.
+_index_file_cache = {}
+
+
+def _read_cached_index_file(path: Path, version: int) -> Optional[Dict]:
+    """
+    _read_index_file, cached in-process until the file is replaced. Callers
+    that modify the result must save it (or drop it, see _drop_cached).
+    """
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    key = (stat.st_ino, stat.st_mtime_ns)
+    cached = _index_file_cache.get(path)
+    if cached is None or cached[0] != key:
+        cached = (key, _read_index_file(path, version))
+        _index_file_cache[path] = cached
+    return cached[1]
+
+
+@contextmanager
+def _drop_cached(path: Path):
+    """Forget a cached file whose parsed copy an aborted update may have changed."""
+    try:
+        yield
+    except BaseException:
+        _index_file_cache.pop(path, None)
+        raise
+
+
+def _manifest_path(shard: str) -> Path:
+    return INDEX_DIR / f"{shard}.manifest.json"
+
+
+# ---------------------------------------------------------------------------
+# Index logs
+# ---------------------------------------------------------------------------
+
+def _log_paths(log_path: Path) -> List[Path]:
+    """A log renamed aside to be merged (.merging), then the live log: replay order."""
+    return [log_path.with_suffix(".merging"), log_path]
+
+
+def _append_log(log_path: Path, records: List[Dict]) -> int:
+    """
+    Append records to a log in one write (callers hold its lock) and return
+    the log's size. A new log starts with a random header line, which tells
+    readers it apart from an earlier log that had the same inode.
+    """
+    data = "".join(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+                   for record in records).encode()
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size == 0:
+            data = json.dumps({"log": os.urandom(8).hex()}).encode() + b"\n" + data
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        return os.fstat(fd).st_size
+    finally:
+        os.close(fd)
+
+
+def _log_header(path: Path) -> Optional[bytes]:
+    try:
+        with open(path, 'rb') as f:
+            header = f.readline()
+    except FileNotFoundError:
+        return None
+    return header if header.endswith(b"\n") else None
+
+
+def _read_log(path: Path, state, apply, offset: int = 0) -> tuple:
+    """
+    Fold a log's complete lines past `offset` into `state` with
+    apply(state, record). Returns (header, offset read up to); the header is
+    None for a missing log. A torn last line is left for the next read.
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.readline()
+            if not header.endswith(b"\n"):
+                return None, 0
+            start = max(offset, len(header))
+            f.seek(start)
+            data = f.read()
+    except FileNotFoundError:
+        return None, 0
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+        try:
+            apply(state, json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return header, start + end
+
+
+# log path -> (.merging header, live header, state, offset read). Lets a
+# resident daemon fold in only the lines appended since its last read.
+_log_cache = {}
+
+
+def _replay_logs(log_path: Path, empty, apply):
+    """
+    State folded by apply() from empty() over a log's .merging file, then
+    the live log. Callers must not modify it.
+    """
+    merging, live = _log_paths(log_path)
+    while True:
+        merging_header, live_header = _log_header(merging), _log_header(live)
+        cached = _log_cache.pop(log_path, None)
+        if cached is not None and live_header is not None and cached[:2] == (merging_header, live_header):
+            state, offset = cached[2], cached[3]
+        else:
+            state, offset = empty(), 0
+            _read_log(merging, state, apply)
+        header, offset = _read_log(live, state, apply, offset)
+        # Otherwise the live log was replaced in between: start over
+        if header == live_header:
+            _log_cache[log_path] = (merging_header, header, state, offset)
+            return state
+
+
+def _read_sidecar(path: Path, version: int) -> Optional[Dict]:
+    """
+    A sidecar map (memory_id -> value) as a fresh dict: its base file
+    overlaid with the changes logged since. None if the base is missing or
+    outdated.
+    """
+    while True:
+        base = _read_cached_index_file(path, version)
+        if base is None:
+            return None
+        changes = _replay_logs(path.with_suffix(".log"), dict, dict.update)
+        # A fold replacing the base may have deleted the log in between
+        if _read_cached_index_file(path, version) is base:
+            break
+    entries = dict(base["entries"])
+    for memory_id, value in changes.items():
+        if value is None:
+            entries.pop(memory_id, None)
+        else:
+            entries[memory_id] = value
+    return entries
+
+
+def _write_sidecar(path: Path, version: int, entries: Dict):
+    """Replace a sidecar's base with `entries`, dropping the log folded into it."""
+    _write_index_file(path, {"version": version, "entries": entries})
+    path.with_suffix(".log").unlink(missing_ok=True)
+
+
+def _save_sidecar(path: Path, version: int, entries: Dict, changes: Dict):
+    """
+    Log a sidecar's changes ({memory_id: value, or None to drop it}); a log
+    past INDEX_LOG_MAX_BYTES is folded into the base, `entries` being the
+    current map.
+    """
+    if changes and _append_log(path.with_suffix(".log"), [changes]) > INDEX_LOG_MAX_BYTES:
+        _write_sidecar(path, version, entries)
+
+
+def _fold_sidecar(path: Path, version: int, lock: str) -> bool:
+    """Fold a sidecar's log into its base now; False if there was none."""
+    with _index_lock(lock):
+        if not path.with_suffix(".log").exists():
+            return False
+        entries = _read_sidecar(path, version)
+        if entries is None:
+            return False
+        _write_sidecar(path, version, entries)
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Stored shard indexes
+# ---------------------------------------------------------------------------
+
+def _index_dir(shard: str) -> Path:
+    return INDEX_DIR / f"{shard}.index"
+
+
+def _head_path(shard: str) -> Path:
+    """Names the current base generation and its bucket count."""
+    return _index_dir(shard) / "head.json"
+
+
+def _delta_path(shard: str) -> Path:
+    return _index_dir(shard) / "delta.log"
+
+
+def _base_path(shard: str, head: Dict, name: str) -> Path:
+    return _index_dir(shard) / f"base-{head['base']}" / f"{name}.json"
+
+
+def _bucket(key: str, buckets: int) -> int:
+    return zlib.crc32(key.encode()) % buckets
+
+
+def _bucket_count(pairs: int) -> int:
+    """Buckets (a power of two) holding about INDEX_BUCKET_POSTINGS of `pairs` each."""
+    buckets = 1
+    while buckets * INDEX_BUCKET_POSTINGS < pairs:
+        buckets *= 2
+    return buckets
+
+
+def _save_base(shard: str, index: Dict):
+    """
+    Write an index's postings and docs as a new base generation, then point
+    the head at it. A base holds postings-N / docs-N (terms and ids hashed
+    into buckets), norms (_doc_norms of every doc, one list per field),
+    fields (each doc's field spans), filters (tag, outcome and date indexes),
+    lexicon (sorted terms) and grams-N (gram -> lexicon positions of the
+    terms containing it, hashed into buckets). Generations before the
+    previous one are deleted; a reader may still be on the previous one.
+    """
+    directory = _index_dir(shard)
+    directory.mkdir(parents=True, exist_ok=True)
+    generations = [int(path.name[5:]) for path in directory.glob("base-*") if path.name[5:].isdigit()]
+    base = max(generations, default=0) + 1
+    buckets = _bucket_count(sum(len(posting) for posting in index["postings"].values()))
+
+    lexicon = sorted(index["postings"])
+    term_grams = {}
+    for position, term in enumerate(lexicon):
+        for gram in _term_grams(term):
+            term_grams.setdefault(gram, []).append(position)
+    gram_buckets = _bucket_count(sum(len(positions) for positions in term_grams.values()))
+    grams = [{} for _ in range(gram_buckets)]
+    for gram, positions in term_grams.items():
+        grams[_bucket(gram, gram_buckets)][gram] = positions
+
+    postings = [{} for _ in range(buckets)]
+    for term, posting in index["postings"].items():
+        postings[_bucket(term, buckets)][term] = posting
+    docs = [{} for _ in range(buckets)]
+    norms = {"ids": list(index["docs"]), "length": [], "created_at": [], "prior": []}
+    fields, tag_postings, outcome_postings, dates = {}, {}, {}, []
+    for memory_id, doc in index["docs"].items():
+        docs[_bucket(memory_id, buckets)][memory_id] = doc
+        for key in ("length", "created_at", "prior"):
+            norms[key].append(doc[key])
+        fields[memory_id] = doc["fields"]
+        for tag in doc["tags"]:
+            tag_postings.setdefault(tag, {})[memory_id] = 1
+        if doc["outcome"]:
+            outcome_postings.setdefault(doc["outcome"], {})[memory_id] = 1
+        dates.append([doc["created_at"] or "", memory_id])
+    dates.sort()
+
+    head = {"version": INDEX_VERSION, "base": base, "buckets": buckets, "gram_buckets": gram_buckets}
+    _base_path(shard, head, "").parent.mkdir()
+    for bucket in range(buckets):
+        _write_index_file(_base_path(shard, head, f"postings-{bucket}"),
+                          {"version": INDEX_VERSION, "postings": postings[bucket]})
+        _write_index_file(_base_path(shard, head, f"docs-{bucket}"),
+                          {"version": INDEX_VERSION, "docs": docs[bucket]})
+    for bucket in range(gram_buckets):
+        _write_index_file(_base_path(shard, head, f"grams-{bucket}"),
+                          {"version": INDEX_VERSION, "grams": grams[bucket]})
+    _write_index_file(_base_path(shard, head, "norms"), {"version": INDEX_VERSION, **norms})
+    _write_index_file(_base_path(shard, head, "fields"), {"version": INDEX_VERSION, "fields": fields})
+    _write_index_file(_base_path(shard, head, "filters"), {
+        "version": INDEX_VERSION,
+        "tag_postings": tag_postings,
+        "outcome_postings": outcome_postings,
+        "dates": dates
+    })
+    _write_index_file(_base_path(shard, head, "lexicon"), {"version": INDEX_VERSION, "terms": lexicon})
+    _write_index_file(_head_path(shard), head)
+
+    for generation in generations:
+        if generation < base - 1:
+            shutil.rmtree(directory / f"base-{generation}", ignore_errors=True)
+
+
+def _rebuild_index(shard: str) -> Dict:
+    """
+    Build a shard index from its entry files into a new base, dropping the
+    delta logs it supersedes. Callers hold the shard's merge and index locks.
+    """
+    index = _build_index(shard)
+    _save_base(shard, index)
+    _write_index_file(_manifest_path(shard), {"version": INDEX_VERSION, **index["manifest"]})
+    for path in _log_paths(_delta_path(shard)):
+        path.unlink(missing_ok=True)
+    (INDEX_DIR / f"{shard}.json").unlink(missing_ok=True)  # Single-file index before version 8
+    return index
+
+
+def _empty_delta() -> Dict:
+    # docs: memory_id -> its latest doc in the delta log, with "positions"
+    # ({term: positions}), or None once removed; either way the base copy is
+    # void. updates: memory_id -> fields set on a base doc. postings: term
+    # -> {memory_id: positions} of the docs in `docs`.
+    return {"docs": {}, "updates": {}, "postings": {}}
+
+
+def _delta_apply(delta: Dict, record: Dict):
+    """Fold one delta log record into a delta; replaying a record again changes nothing."""
+    memory_id = record["id"]
+    if "set" in record:
+        doc = delta["docs"].get(memory_id)
+        if doc is not None:
+            doc.update(record["set"])
+        elif memory_id not in delta["docs"]:
+            delta["updates"].setdefault(memory_id, {}).update(record["set"])
+        return
+
+    previous = delta["docs"].get(memory_id)
+    for term in previous["positions"] if previous else ():
+        posting = delta["postings"][term]
+        del posting[memory_id]
+        if not posting:
+            del delta["postings"][term]
+    delta["updates"].pop(memory_id, None)
+    doc = delta["docs"][memory_id] = record["doc"]
+    for term, positions in doc["positions"].items() if doc else ():
+        delta["postings"].setdefault(term, {})[memory_id] = positions
+
+
+def _delta_doc(doc: Dict) -> Dict:
+    """A delta doc without its positions."""
+    return {key: value for key, value in doc.items() if key != "positions"}
+
+
+class _Postings(Mapping):
+    """
+    term -> {memory_id: positions} of a stored shard index. A term's base
+    posting is read from its bucket file on first lookup and overlaid with
+    the delta; iteration yields the lexicon, then terms new in the delta.
+    """
+
+    def __init__(self, shard: str, head: Dict, delta: Dict):
+        self.shard, self.head, self.delta = shard, head, delta
+        self.merged = {}
+        self.terms = None
+
+    def __getitem__(self, term: str) -> Dict:
+        posting = self.merged.get(term)
+        if posting is not None:
+            return posting
+        bucket = _read_cached_index_file(
+            _base_path(self.shard, self.head, f"postings-{_bucket(term, self.head['buckets'])}"), INDEX_VERSION)
+        base = bucket["postings"].get(term) if bucket else None
+        added = self.delta["postings"].get(term)
+        if base is None and added is None:
+            raise KeyError(term)
+        void = self.delta["docs"]
+        posting = {mid: positions for mid, positions in (base or {}).items() if mid not in void}
+        posting.update(added or {})
+        self.merged[term] = posting
+        return posting
+
+    def _lexicon(self) -> List[str]:
+        return (_read_cached_index_file(_base_path(self.shard, self.head, "lexicon"), INDEX_VERSION)
+                or {}).get("terms", [])
+
+    def matching(self, query_term: str) -> List[str]:
+        """Terms a query term matches (see _term_matches), through the gram index."""
+        lexicon = self._lexicon()
+        if len(query_term) < QUERY_GRAM:
+            found = lexicon[bisect.bisect_left(lexicon, query_term):
+                            bisect.bisect_left(lexicon, query_term + "\uffff")]
+        else:
+            positions = None
+            for gram in _term_grams(query_term):
+                bucket = _read_cached_index_file(
+                    _base_path(self.shard, self.head, f"grams-{_bucket(gram, self.head['gram_buckets'])}"),
+                    INDEX_VERSION)
+                hits = bucket["grams"].get(gram, ()) if bucket else ()
+                positions = set(hits) if positions is None else positions.intersection(hits)
+                if not positions:
+                    break
+            found = [lexicon[i] for i in sorted(positions or ()) if query_term in lexicon[i]]
+        seen = set(found)
+        return found + [term for term in self.delta["postings"]
+                        if term not in seen and _term_matches(query_term, term)]
+
+    def __iter__(self):
+        if self.terms is None:
+            lexicon = self._lexicon()
+            added = []
+            for term in self.delta["postings"]:
+                i = bisect.bisect_left(lexicon, term)
+                if i == len(lexicon) or lexicon[i] != term:
+                    added.append(term)
+            self.terms = lexicon + added if added else lexicon
+        return iter(self.terms)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+class _ShardIndex(dict):
+    """
+    A stored shard index as search reads it: "postings" (see _Postings),
+    "docs" (each entry's _doc_norms) and "total_length", the base overlaid
+    with the delta. The filter indexes, "fields" (memory_id -> field spans)
+    and "manifest" load on first use.
+    """
+
+    def __init__(self, shard: str, head: Dict, delta: Dict):
+        norms = _read_cached_index_file(_base_path(shard, head, "norms"), INDEX_VERSION)
+        docs = {
+            memory_id: {"length": length, "created_at": created_at, "prior": prior}
+            for memory_id, length, created_at, prior in zip(
+                norms["ids"], norms["length"], norms["created_at"], norms["prior"])
+        } if norms else {}
+        for memory_id, doc in delta["docs"].items():
+            if doc is None:
+                docs.pop(memory_id, None)
+            else:
+                docs[memory_id] = _doc_norms(doc)
+        for memory_id, changes in delta["updates"].items():
+            if memory_id in docs and "prior" in changes:
+                docs[memory_id] = {**docs[memory_id], "prior": changes["prior"]}
+        super().__init__(postings=_Postings(shard, head, delta), docs=docs,
+                         total_length=sum(doc["length"] for doc in docs.values()))
+        self.shard, self.head, self.delta = shard, head, delta
+
+    def __missing__(self, key: str):
+        if key in ("tag_postings", "outcome_postings", "dates"):
+            self.update(self._filters())
+        elif key == "fields":
+            base = _read_cached_index_file(_base_path(self.shard, self.head, "fields"), INDEX_VERSION)
+            fields = {mid: spans for mid, spans in (base or {}).get("fields", {}).items()
+                      if mid not in self.delta["docs"]}
+            for memory_id, doc in self.delta["docs"].items():
+                if doc is not None:
+                    fields[memory_id] = doc["fields"]
+            self[key] = fields
+        elif key == "manifest":
+            manifest = _read_index_file(_manifest_path(self.shard), INDEX_VERSION)
+            if manifest is None:
+                manifest = _empty_manifest()
+                for doc in self.all_docs().values():
+                    _manifest_add(manifest, doc)
+            self[key] = manifest
+        else:
+            raise KeyError(key)
+        return self[key]
+
+    def _filters(self) -> Dict:
+        base = _read_cached_index_file(_base_path(self.shard, self.head, "filters"), INDEX_VERSION) or {}
+        void = self.delta["docs"]
+        filters = {
+            key: {value: {mid: 1 for mid in posting if mid not in void}
+                  for value, posting in base.get(key, {}).items()}
+            for key in ("tag_postings", "outcome_postings")
+        }
+        dates = [pair for pair in base.get("dates", []) if pair[1] not in void]
+        for memory_id, doc in void.items():
+            if doc is None:
+                continue
+            for tag in doc["tags"]:
+                filters["tag_postings"].setdefault(tag, {})[memory_id] = 1
+            if doc["outcome"]:
+                filters["outcome_postings"].setdefault(doc["outcome"], {})[memory_id] = 1
+            dates.append([doc["created_at"] or "", memory_id])
+        dates.sort()
+        filters["dates"] = dates
+        return filters
+
+    def doc(self, memory_id: str) -> Optional[Dict]:
+        """An entry's full doc, reading only its docs bucket."""
+        if memory_id in self.delta["docs"]:
+            doc = self.delta["docs"][memory_id]
+            return None if doc is None else _delta_doc(doc)
+        bucket = _read_cached_index_file(
+            _base_path(self.shard, self.head, f"docs-{_bucket(memory_id, self.head['buckets'])}"), INDEX_VERSION)
+        doc = bucket["docs"].get(memory_id) if bucket else None
+        if doc is not None and memory_id in self.delta["updates"]:
+            doc = {**doc, **self.delta["updates"][memory_id]}
+        return doc
+
+    def all_docs(self) -> Dict[str, Dict]:
+        """Every entry's full doc."""
+        docs = {}
+        for bucket in range(self.head["buckets"]):
+            docs.update((_read_cached_index_file(_base_path(self.shard, self.head, f"docs-{bucket}"),
+                                                 INDEX_VERSION) or {}).get("docs", {}))
+        for memory_id, doc in self.delta["docs"].items():
+            if doc is None:
+                docs.pop(memory_id, None)
+            else:
+                docs[memory_id] = _delta_doc(doc)
+        for memory_id, changes in self.delta["updates"].items():
+            if memory_id in docs:
+                docs[memory_id] = {**docs[memory_id], **changes}
+        return docs
+
+
+# shard -> base generation last loaded; cached files of older ones are dropped
+_loaded_bases = {}
+
+
+def _load_index(shard: str, locked: bool = False) -> _ShardIndex:
+    """
+    Load a shard index (base plus delta), building it if missing or
+    outdated. `locked`: the caller holds the shard's index lock.
+    """
+    while True:
+        head = _read_cached_index_file(_head_path(shard), INDEX_VERSION)
+        if head is None:
+            if locked:
+                _rebuild_index(shard)
+                continue
+            with _index_lock(f"{shard}.merge"), _index_lock(shard):
+                if _read_index_file(_head_path(shard), INDEX_VERSION) is None:
+                    _rebuild_index(shard)
+            continue
+        delta = _replay_logs(_delta_path(shard), _empty_delta, _delta_apply)
+        # A merge switching bases may have deleted a log in between
+        if _read_cached_index_file(_head_path(shard), INDEX_VERSION) is head:
+            break
+
+    if _loaded_bases.get(shard) != head["base"]:
+        _loaded_bases[shard] = head["base"]
+        stale = str(_index_dir(shard) / "base-")
+        current = str(_index_dir(shard) / f"base-{head['base']}") + os.sep
+        for path in list(_index_file_cache):
+            if str(path).startswith(stale) and not str(path).startswith(current):
+                _index_file_cache.pop(path, None)
+    return _ShardIndex(shard, head, delta)
+
+
+class _IndexUpdate:
+    """
+    Changes to a stored shard index, appended to its delta log by save():
+    each record replaces or removes one entry's doc and postings, or sets
+    fields of its doc, so a store writes only what it changes. Keeps the
+    shard's manifest current. Callers hold the shard's index lock.
+    """
+
+    def __init__(self, shard: str):
+        self.shard = shard
+        self.index = _load_index(shard, locked=True)
+        self.docs = {}  # memory_id -> doc after this update (None: removed)
+        self.records = []
+
+    def doc(self, memory_id: str) -> Optional[Dict]:
+        if memory_id in self.docs:
+            return self.docs[memory_id]
+        return self.index.doc(memory_id)
+
+    def add(self, entry: Dict, size: int = 0):
+        """Add (or replace) an entry; size is its stored bytes."""
+        self._forget(entry["id"])
+        doc, term_positions = _entry_doc(entry, size)
+        _manifest_add(self.index["manifest"], doc)
+        self.index["docs"][entry["id"]] = _doc_norms(doc)
+        self.docs[entry["id"]] = doc
+        self.records.append({"id": entry["id"], "doc": {**doc, "positions": term_positions}})
+
+    def remove(self, memory_id: str):
+        if self._forget(memory_id):
+            self.docs[memory_id] = None
+            self.records.append({"id": memory_id, "doc": None})
+
+    def update(self, memory_id: str, **changes):
+        """Set fields of an indexed entry's doc, recomputing its prior."""
+        doc = self.doc(memory_id)
+        if doc is None:
+            return
+        updated = {**doc, **changes}
+        updated["prior"] = _ranking_prior(updated)
+        self.index["manifest"]["size_bytes"] += updated["size"] - doc["size"]
+        self.index["docs"][memory_id] = _doc_norms(updated)
+        self.docs[memory_id] = updated
+        self.records.append({"id": memory_id, "set": {**changes, "prior": updated["prior"]}})
+
+    def _forget(self, memory_id: str) -> bool:
+        """Take an indexed entry out of the manifest; False if it isn't indexed."""
+        doc = self.doc(memory_id)
+        if doc is None:
+            return False
+        self.index["docs"].pop(memory_id, None)
+        _manifest_remove(self.index, doc)
+        return True
+
+    def save(self):
+        if not self.records:
+            return
+        size = _append_log(_delta_path(self.shard), self.records)
+        _write_index_file(_manifest_path(self.shard), {"version": INDEX_VERSION, **self.index["manifest"]})
+        if size > INDEX_LOG_MAX_BYTES:
+            _request_merge(self.shard)
+
+
+@contextmanager
+def _updating_index(shard: str):
+    """Collect changes to a shard index under its lock and log them on exit."""
+    with _index_lock(shard):
+        update = _IndexUpdate(shard)
+        yield update
+        update.save()
+
+
+def _request_merge(shard: str):
+    """
+    Rename a shard's full delta log aside and merge it in a detached
+    process. Callers hold the shard's index lock.
+    """
+    merging, live = _log_paths(_delta_path(shard))
+    if not merging.exists():
+        os.replace(live, merging)
+    elif not _lock_free(f"{shard}.merge"):
+        return  # Still merging the previous log
+    try:
+        subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve()), "merge", "--shard", shard],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True, env={**os.environ, "IMLAZY_DAEMON": "0"}
+        )
+    except OSError:
+        pass  # Readers replay the .merging log until a later store or `merge` folds it
+
+
+def merge_index(shard: str) -> bool:
+    """
+    Fold a shard's delta log into a new base generation; False if there was
+    nothing to merge. The live log is renamed aside first, so stores keep
+    appending to a fresh one; readers replay both until the head switches.
+    """
+    merging, live = _log_paths(_delta_path(shard))
+    with _index_lock(f"{shard}.merge"):
+        with _index_lock(shard):
+            if not merging.exists():
+                if not live.exists():
+                    return False
+                os.replace(live, merging)
+            head = _read_index_file(_head_path(shard), INDEX_VERSION)
+            if head is None:
+                _rebuild_index(shard)
+                return True
+
+        delta = _empty_delta()
+        _read_log(merging, delta, _delta_apply)
+        void = delta["docs"]
+        index = {"postings": {}, "docs": {}}
+        for bucket in range(head["buckets"]):
+            postings = (_read_index_file(_base_path(shard, head, f"postings-{bucket}"), INDEX_VERSION)
+                        or {}).get("postings", {})
+            for term, posting in postings.items():
+                if void:
+                    posting = {mid: positions for mid, positions in posting.items() if mid not in void}
+                if posting:
+                    index["postings"][term] = posting
+            docs = (_read_index_file(_base_path(shard, head, f"docs-{bucket}"), INDEX_VERSION)
+                    or {}).get("docs", {})
+            for memory_id, doc in docs.items():
+                if memory_id not in void:
+                    index["docs"][memory_id] = {**doc, **delta["updates"].get(memory_id, {})}
+        for memory_id, doc in void.items():
+            if doc is None:
+                continue
+            index["docs"][memory_id] = _delta_doc(doc)
+            for term, positions in doc["positions"].items():
+                index["postings"].setdefault(term, {})[memory_id] = positions
+
+        _save_base(shard, index)
+        merging.unlink()
+    return True
+
+# ---------------------------------------------------------------------------
+# Vector index
+# ---------------------------------------------------------------------------
+
+def _vector_index_path(shard: str) -> Path:
+    return INDEX_DIR / f"{shard}.vectors.json"
+
+
+def _matrix_path(shard: str) -> Path:
+    return INDEX_DIR / f"{shard}.vec"
+
+
+def _word_features(word: str) -> List[str]:
+    """Character n-grams of the padded word, then the padded word itself."""
+    padded = f"#{word}#"
+    return [padded[i:i + VECTOR_NGRAM] for i in range(max(1, len(padded) - VECTOR_NGRAM + 1))] + [padded]
+
+
+def _text_features(text: str) -> Iterable[str]:
+    """_word_features of each word."""
+    for word in tokenize(text):
+        yield from _word_features(word)
+
+
+def text_vector(text: str) -> List[float]:
+    """
+    Unit-length feature-hashed vector of character n-grams.
+
+    Words are padded ("#login#") so prefixes and suffixes get their own
+    grams, and each whole word is a feature too. A sign bit from the hash
+    keeps collisions from only adding up.
+    """
+    vector = [0.0] * VECTOR_DIM
+    for gram in _text_features(text):
+        h = zlib.crc32(gram.encode())
+        vector[h % VECTOR_DIM] += 1.0 if (h >> 16) & 1 else -1.0
+
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else vector
+
+
+def _word_sums(texts: List[str], word_rows, width: int, known: Dict = None) -> "np.ndarray":
+    """
+    Per-text sums, over the text's words, of rows from word_rows (words ->
+    array of `width` columns). text_vector and simhash are such sums, so a
+    batch computes each distinct word's row once instead of hashing every
+    occurrence's features. `known` (word -> row) carries rows across calls.
+    """
+    known = {} if known is None else known
+    sums = np.zeros((len(texts), width), dtype=np.float32)
+    for start in range(0, len(texts), SKETCH_BLOCK):
+        block = texts[start:start + SKETCH_BLOCK]
+        words, ids, lengths = {}, [], []
+        for text in block:
+            tokens = tokenize(text)
+            ids.extend(words.setdefault(word, len(words)) for word in tokens)
+            lengths.append(len(tokens))
+        if not ids:
+            continue
+        missing = [word for word in words if word not in known]
+        if len(known) + len(missing) > SKETCH_WORD_CACHE:
+            known.clear()
+            missing = list(words)
+        if missing:
+            known.update(zip(missing, word_rows(missing).astype(np.float32)))
+        table = np.stack([known[word] for word in words])
+
+        # Word counts per text times the word rows (small integers: exact in float32)
+        owners = np.repeat(np.arange(len(block)), lengths)
+        counts = np.bincount(owners * len(words) + np.asarray(ids), minlength=len(block) * len(words))
+        sums[start:start + len(block)] = counts.reshape(len(block), len(words)).astype(np.float32) @ table
+    return sums
+
+
+def _word_vectors(words: List[str]) -> "np.ndarray":
+    """Each word's unnormalized share of text_vector, one row per word."""
+    features = [_word_features(word) for word in words]
+    hashes = np.fromiter((zlib.crc32(feature.encode()) for word_features in features
+                          for feature in word_features), dtype=np.int64)
+    owners = np.repeat(np.arange(len(words)), [len(word_features) for word_features in features])
+    signs = np.where((hashes >> 16) & 1, 1.0, -1.0)
+    return np.bincount(owners * VECTOR_DIM + hashes % VECTOR_DIM, weights=signs,
+                       minlength=len(words) * VECTOR_DIM).reshape(len(words), VECTOR_DIM)
+
+
+def _text_vectors(texts: List[str], known: Dict = None) -> List:
+    """text_vector of many texts (one float64 NumPy row each when available; see _word_sums)."""
+    if np is None:
+        return [text_vector(text) for text in texts]
+    vectors = _word_sums(texts, _word_vectors, VECTOR_DIM, known).astype(np.float64)
+    norms = np.sqrt((vectors * vectors).sum(axis=1, keepdims=True))
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+_lsh_planes = None
+
+
+def _lsh_hyperplanes():
+    """
+    LSH_TABLES * LSH_BITS fixed random hyperplanes (same in every process),
+    as a NumPy matrix when available.
+    """
+    global _lsh_planes
+    if _lsh_planes is None:
+        rng = random.Random(LSH_SEED)
+        _lsh_planes = [[rng.gauss(0.0, 1.0) for _ in range(VECTOR_DIM)]
+                       for _ in range(LSH_TABLES * LSH_BITS)]
+        if np is not None:
+            _lsh_planes = np.asarray(_lsh_planes)
+    return _lsh_planes
+
+
+def _lsh_keys(vector: List[float]) -> List[int]:
+    """One LSH_BITS-bit bucket key per table (sign of hyperplane projections)."""
+    planes = _lsh_hyperplanes()
+    if np is not None:
+        bits = (planes @ np.asarray(vector)) > 0
+    else:
+        bits = [sum(p * x for p, x in zip(plane, vector)) > 0 for plane in planes]
+
+    keys = []
+    for table in range(LSH_TABLES):
+        key = 0
+        for bit in bits[table * LSH_BITS:(table + 1) * LSH_BITS]:
+            key = (key << 1) | int(bit)
+        keys.append(key)
+    return keys
+
+
+def _lsh_keys_many(vectors) -> List[List[int]]:
+    """_lsh_keys of many vectors (one matrix product with NumPy)."""
+    if np is None:
+        return [_lsh_keys(vector) for vector in vectors]
+    bits = (np.asarray(vectors) @ _lsh_hyperplanes().T) > 0
+    weights = 1 << np.arange(LSH_BITS - 1, -1, -1)
+    return (bits.reshape(len(vectors), LSH_TABLES, LSH_BITS) @ weights).tolist()
+
+
+def _lsh_path(shard: str) -> Path:
+    """LSH_TABLES 16-bit bucket keys per matrix row."""
+    return INDEX_DIR / f"{shard}.lsh"
+
+
+def _vector_index(rows: Dict[str, int]) -> Dict:
+    # rows: memory_id -> matrix row (saved as a sidecar map, see
+    # _read_sidecar); free: rows released by prune for reuse; changes: rows
+    # set or dropped since loading, for _save_sidecar
+    used = set(rows.values())
+    next_row = max(used, default=-1) + 1
+    return {
+        "rows": rows,
+        "free": [row for row in range(next_row) if row not in used],
+        "next_row": next_row,
+        "changes": {}
+    }
+
+
+def _empty_vector_index() -> Dict:
+    return _vector_index({})
+
+
+def _write_vector_rows(shard: str, rows: List[tuple]):
+    """Write (row, float32 vector bytes, LSH keys) triples into the shard's matrix and key files."""
+    fd = os.open(_matrix_path(shard), os.O_RDWR | os.O_CREAT, 0o644)
+    keys_fd = os.open(_lsh_path(shard), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        for row, vector, keys in rows:
+            os.pwrite(fd, vector, row * VECTOR_DIM * 4)
+            os.pwrite(keys_fd, array('H', keys).tobytes(), row * LSH_TABLES * 2)
+    finally:
+        os.close(fd)
+        os.close(keys_fd)
+
+
+def _vector_add(shard: str, vindex: Dict, entry: Dict):
+    """Vectorize an entry and write its matrix row and LSH keys."""
+    _vector_add_many(shard, vindex, [entry])
+
+
+def _vector_add_many(shard: str, vindex: Dict, entries: Iterable[Dict], chunk: int = 1024):
+    """_vector_add for many entries, vectorizing and writing them `chunk` at a time."""
+    entries = iter(entries)
+    known = {}
+    while True:
+        batch = list(islice(entries, chunk))
+        if not batch:
+            break
+        vectors = _text_vectors([_entry_text(entry) for entry in batch], known)
+        rows = []
+        for entry, vector, keys in zip(batch, vectors, _lsh_keys_many(vectors)):
+            memory_id = entry["id"]
+            _vector_remove(vindex, memory_id)
+            if vindex["free"]:
+                row = vindex["free"].pop()
+            else:
+                row = vindex["next_row"]
+                vindex["next_row"] += 1
+            data = array('f', vector) if np is None else vector.astype(np.float32)
+            rows.append((row, data.tobytes(), keys))
+            vindex["rows"][memory_id] = vindex["changes"][memory_id] = row
+        _write_vector_rows(shard, rows)
+
+
+def _vector_remove(vindex: Dict, memory_id: str):
+    """Release an entry's matrix row."""
+    row = vindex["rows"].pop(memory_id, None)
+    if row is None:
+        return
+    vindex["free"].append(row)
+    vindex["changes"][memory_id] = None
+
+
+def _build_vector_index(shard: str) -> Dict:
+    """Re-vectorize every entry into a fresh matrix and save its rows."""
+    vindex = _empty_vector_index()
+    _matrix_path(shard).unlink(missing_ok=True)
+    _lsh_path(shard).unlink(missing_ok=True)
+    _vector_add_many(shard, vindex, get_backend().entries(shard))
+    _write_sidecar(_vector_index_path(shard), VECTOR_INDEX_VERSION, vindex["rows"])
+    vindex["changes"] = {}
+    return vindex
+
+
+def _load_vector_rows(shard: str) -> Dict[str, int]:
+    """A shard's memory_id -> matrix row map, rebuilding the vectors if missing or outdated."""
+    rows = _read_sidecar(_vector_index_path(shard), VECTOR_INDEX_VERSION)
+    if rows is not None:
+        return rows
+
+    with _index_lock(f"{shard}.vectors"):
+        rows = _read_sidecar(_vector_index_path(shard), VECTOR_INDEX_VERSION)
+        if rows is None:
+            rows = _build_vector_index(shard)["rows"]
+    return rows
+
+
+@contextmanager
+def _updating_vectors(shard: str):
+    """Load a shard's vector index under lock and log its row changes on exit."""
+    with _index_lock(f"{shard}.vectors"):
+        rows = _read_sidecar(_vector_index_path(shard), VECTOR_INDEX_VERSION)
+        vindex = _vector_index(rows) if rows is not None else _build_vector_index(shard)
+        yield vindex
+        _save_sidecar(_vector_index_path(shard), VECTOR_INDEX_VERSION, vindex["rows"], vindex["changes"])
+
+
+def _open_matrix(shard: str):
+    """Memory-map a shard's vector matrix read-only (None if empty)."""
+    path = _matrix_path(shard)
+    if not path.exists() or path.stat().st_size == 0:
+        return None
+    if np is not None:
+        return np.memmap(path, dtype=np.float32, mode='r').reshape(-1, VECTOR_DIM)
+    with open(path, 'rb') as f:
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast('f')
+
+
+def _lsh_rows(shard: str, query_keys: List[int]) -> List[int]:
+    """Rows whose LSH key equals a query key, or is one bit away, in some table."""
+    path = _lsh_path(shard)
+    if np is not None:
+        if not path.exists() or path.stat().st_size == 0:
+            return []
+        keys = np.memmap(path, dtype=np.uint16, mode='r').reshape(-1, LSH_TABLES)
+        diff = keys ^ np.asarray(query_keys, dtype=np.uint16)
+        return np.flatnonzero(((diff & (diff - 1)) == 0).any(axis=1)).tolist()
+
+    try:
+        keys = array('H', path.read_bytes())
+    except FileNotFoundError:
+        return []
+    found = []
+    for row in range(len(keys) // LSH_TABLES):
+        for table, query_key in enumerate(query_keys):
+            diff = keys[row * LSH_TABLES + table] ^ query_key
+            if diff & (diff - 1) == 0:
+                found.append(row)
+                break
+    return found
+
+
+def _rank_vector(shard: str, query: str, allowed: set = None) -> Dict[str, float]:
+    """
+    Cosine similarity between the query vector and entry vectors.
+
+    Large shards only score the entries sharing an LSH bucket with the query
+    in some table (probing every bucket one bit away as well); small shards
+    and small `allowed` sets (filtered searches) are scored exhaustively.
+    """
+    rows = _load_vector_rows(shard)
+    query_vector = text_vector(query)
+    if not rows or not any(query_vector):
+        return {}
+
+    if allowed is not None and len(allowed) < LSH_MIN_ENTRIES:
+        candidates = [mid for mid in allowed if mid in rows]
+    elif len(rows) < LSH_MIN_ENTRIES:
+        candidates = list(rows)
+    else:
+        by_row = {row: mid for mid, row in rows.items()}
+        found = (by_row.get(row) for row in _lsh_rows(shard, _lsh_keys(query_vector)))
+        candidates = [mid for mid in found if mid is not None and (allowed is None or mid in allowed)]
+    if not candidates:
+        return {}
+
+    matrix = _open_matrix(shard)
+    if matrix is None:
+        return {}
+    if np is not None:
+        positions = np.fromiter((rows[mid] for mid in candidates), dtype=np.int64, count=len(candidates))
+        similarities = (matrix[positions] @ np.asarray(query_vector, dtype=np.float32)).tolist()
+    else:
+        similarities = []
+        for mid in candidates:
+            start = rows[mid] * VECTOR_DIM
+            similarities.append(sum(a * b for a, b in zip(matrix[start:start + VECTOR_DIM], query_vector)))
+
+    return {mid: sim for mid, sim in zip(candidates, similarities) if sim > 0}
+
+
+# ---------------------------------------------------------------------------
+# Near-duplicate fingerprints
+# ---------------------------------------------------------------------------
+
+def _fingerprint_path(shard: str) -> Path:
+    return INDEX_DIR / f"{shard}.simhash.json"
+
+
+def simhash(text: str) -> int:
+    """
+    SIMHASH_BITS-bit SimHash over the same features as text_vector.
+
+    Each feature votes +weight / -weight on every bit of its hash; a bit is
+    set where the votes are positive. Similar texts differ in few bits.
+    """
+    weights = Counter(_text_features(text))
+    if not weights:
+        return 0
+    hashes = [hashlib.blake2b(feature.encode(), digest_size=SIMHASH_BITS // 8).digest()
+              for feature in weights]
+    if np is not None:
+        # Column 0 is the most significant bit
+        bits = np.unpackbits(np.frombuffer(b"".join(hashes), dtype=np.uint8).reshape(len(hashes), -1), axis=1)
+        totals = np.fromiter(weights.values(), dtype=np.int64) @ (bits.astype(np.int64) * 2 - 1)
+        return int("".join("1" if total > 0 else "0" for total in totals.tolist()), 2)
+
+    totals = [0] * SIMHASH_BITS
+    for digest, weight in zip(hashes, weights.values()):
+        h = int.from_bytes(digest, "big")
+        for bit in range(SIMHASH_BITS):
+            totals[bit] += weight if (h >> bit) & 1 else -weight
+    return sum(1 << bit for bit, total in enumerate(totals) if total > 0)
+
+
+def _word_votes(words: List[str]) -> "np.ndarray":
+    """Each word's share of simhash's bit votes, one row per word (column 0 is the most significant bit)."""
+    features = [_word_features(word) for word in words]
+    digests = b"".join(hashlib.blake2b(feature.encode(), digest_size=SIMHASH_BITS // 8).digest()
+                       for word_features in features for feature in word_features)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, SIMHASH_BITS // 8), axis=1)
+    starts = np.cumsum([0] + [len(word_features) for word_features in features[:-1]])
+    return np.add.reduceat(bits.astype(np.int64) * 2 - 1, starts, axis=0)
+
+
+def _simhashes(texts: List[str]) -> List[int]:
+    """simhash of many texts (in NumPy passes when available)."""
+    if np is None:
+        return [simhash(text) for text in texts]
+    votes = _word_sums(texts, _word_votes, SIMHASH_BITS)
+    return [int.from_bytes(bits.tobytes(), "big") for bits in np.packbits(votes > 0, axis=1)]
+
+
+def _data_text(entry: Dict) -> str:
+    """An entry's data text, which duplicates are judged by (tags are merged, so they don't count)."""
+    return " ".join(_iter_text(entry.get("data")))
+
+
+def _entry_fingerprint(entry: Dict) -> int:
+    """SimHash of an entry's data."""
+    return simhash(_data_text(entry))
+
+
+def _entry_fingerprints(entries: List[Dict]) -> List[int]:
+    """_entry_fingerprint of many entries at once."""
+    return _simhashes([_data_text(entry) for entry in entries])
+
+
+def _similar_wording(entry: Dict, wording: Dict[str, List[str]] = None):
+    """
+    A test of whether a stored entry's data token sequence is similar to
+    `entry`'s (order-sensitive ratio >= DEDUP_MIN_SIMILARITY). `entry` is
+    tokenized and indexed once, and difflib's cheap upper bounds reject most
+    candidates before the full ratio. Candidates' tokens are kept in
+    `wording` (memory_id -> tokens) when given.
+    """
+    tokens = tokenize(_data_text(entry))
+    matcher = difflib.SequenceMatcher(None, autojunk=False)
+    matcher.set_seq2(tokens)
+
+    def similar(candidate: Dict) -> bool:
+        candidate_tokens = (wording or {}).get(candidate["id"])
+        if candidate_tokens is None:
+            candidate_tokens = tokenize(_data_text(candidate))
+            if wording is not None:
+                wording[candidate["id"]] = candidate_tokens
+        if candidate_tokens == tokens:
+            return True
+        matcher.set_seq1(candidate_tokens)
+        return (matcher.real_quick_ratio() >= DEDUP_MIN_SIMILARITY
+                and matcher.quick_ratio() >= DEDUP_MIN_SIMILARITY
+                and matcher.ratio() >= DEDUP_MIN_SIMILARITY)
+    return similar
+
+
+def _band_keys(fingerprint: int) -> List[int]:
+    width = SIMHASH_BITS // DEDUP_BANDS
+    return [(fingerprint >> (band * width)) & ((1 << width) - 1) for band in range(DEDUP_BANDS)]
+
+
+def _fingerprint_index(fingerprints: Dict[str, str]) -> Dict:
+    # fingerprints: memory_id -> fingerprint (hex; saved as a sidecar map,
+    # see _read_sidecar); values: the same as ints; bands: one {band value:
+    # (array of fingerprints, [memory ids])} table per band of the
+    # fingerprint, so a bucket is compared in one NumPy pass; changes:
+    # fingerprints set or dropped since loading, for _save_sidecar
+    values = {memory_id: int(fingerprint, 16) for memory_id, fingerprint in fingerprints.items()}
+    bands = [{} for _ in range(DEDUP_BANDS)]
+    for memory_id, value in values.items():
+        _bucket_add(bands, memory_id, value)
+    return {"fingerprints": fingerprints, "values": values, "bands": bands, "changes": {}}
+
+
+def _empty_fingerprint_index() -> Dict:
+    return _fingerprint_index({})
+
+
+def _bucket_add(bands: List[Dict], memory_id: str, fingerprint: int):
+    for table, key in zip(bands, _band_keys(fingerprint)):
+        bucket = table.get(key)
+        if bucket is None:
+            bucket = table[key] = (array("Q"), [])
+        bucket[0].append(fingerprint)
+        bucket[1].append(memory_id)
+
+
+def _fingerprint_add(findex: Dict, memory_id: str, fingerprint: int):
+    _fingerprint_remove(findex, memory_id)
+    findex["fingerprints"][memory_id] = findex["changes"][memory_id] = f"{fingerprint:x}"
+    findex["values"][memory_id] = fingerprint
+    _bucket_add(findex["bands"], memory_id, fingerprint)
+
+
+def _fingerprint_remove(findex: Dict, memory_id: str):
+    if findex["fingerprints"].pop(memory_id, None) is None:
+        return
+    findex["changes"][memory_id] = None
+    for table, key in zip(findex["bands"], _band_keys(findex["values"].pop(memory_id))):
+        bucket = table.get(key)
+        if bucket is None or memory_id not in bucket[1]:
+            continue
+        position = bucket[1].index(memory_id)
+        del bucket[0][position], bucket[1][position]
+        if not bucket[1]:
+            del table[key]
+
+
+if np is not None:
+    _BYTE_BITS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def _bucket_near(bucket, fingerprint: int) -> List[Tuple[int, str]]:
+    """(distance, id) of a band bucket's fingerprints within DEDUP_MAX_DISTANCE bits."""
+    values, ids = bucket
+    if np is None:
+        distances = ((bin(value ^ fingerprint).count("1"), memory_id) for value, memory_id in zip(values, ids))
+        return [(distance, memory_id) for distance, memory_id in distances if distance <= DEDUP_MAX_DISTANCE]
+    differing = np.frombuffer(values, dtype=np.uint64) ^ np.uint64(fingerprint)
+    distances = _BYTE_BITS[differing.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+    near = np.flatnonzero(distances <= DEDUP_MAX_DISTANCE)
+    return [(distance, ids[position]) for position, distance in zip(near.tolist(), distances[near].tolist())]
+
+
+def _near_duplicates(findex: Dict, fingerprint: int) -> List[str]:
+    """Ids within DEDUP_MAX_DISTANCE bits of a fingerprint, nearest first."""
+    found = set()
+    for table, key in zip(findex["bands"], _band_keys(fingerprint)):
+        bucket = table.get(key)
+        if bucket is not None:
+            found.update(_bucket_near(bucket, fingerprint))
+    return [memory_id for _, memory_id in sorted(found)]
+
+
+def _build_fingerprint_index(shard: str) -> Dict:
+    """Fingerprint every entry and save the fingerprints."""
+    findex = _empty_fingerprint_index()
+    entries = iter(get_backend().entries(shard))
+    while True:
+        batch = list(islice(entries, IMPORT_BATCH_SIZE))
+        if not batch:
+            break
+        for entry, fingerprint in zip(batch, _entry_fingerprints(batch)):
+            if fingerprint:
+                _fingerprint_add(findex, entry["id"], fingerprint)
+    _write_sidecar(_fingerprint_path(shard), FINGERPRINT_INDEX_VERSION, findex["fingerprints"])
+    findex["changes"] = {}
+    return findex
+
+
+@contextmanager
+def _updating_fingerprints(shard: str):
+    """Load a shard's fingerprint index under lock and log its changes on exit."""
+    with _index_lock(f"{shard}.simhash"):
+        fingerprints = _read_sidecar(_fingerprint_path(shard), FINGERPRINT_INDEX_VERSION)
+        if fingerprints is None:
+            findex = _build_fingerprint_index(shard)
+        else:
+            findex = _fingerprint_index(fingerprints)
+        yield findex
+        _save_sidecar(_fingerprint_path(shard), FINGERPRINT_INDEX_VERSION,
+                      findex["fingerprints"], findex["changes"])
+
+
+# ---------------------------------------------------------------------------
+# Ranking
+# ---------------------------------------------------------------------------
+
+def _term_grams(term: str) -> set:
+    return {term[i:i + QUERY_GRAM] for i in range(len(term) - QUERY_GRAM + 1)}
+
+
+def _term_matches(query_term: str, term: str) -> bool:
+    """Whether a query term hits an index term (see QUERY_GRAM)."""
+    return query_term in term if len(query_term) >= QUERY_GRAM else term.startswith(query_term)
+
+
+def _nearest_terms(query_term: str, terms: Iterable[str]) -> List[str]:
+    """The QUERY_EXPANSION_MAX matched terms closest to a query term."""
+    return heapq.nsmallest(QUERY_EXPANSION_MAX, terms, key=lambda term: (
+        term != query_term, not term.startswith(query_term), len(term), term))
+
+
+def _expand_term(postings: Dict, query_term: str) -> List[str]:
+    """Index terms hit by a query term, nearest first (see QUERY_EXPANSION_MAX)."""
+    if isinstance(postings, _Postings):
+        return _nearest_terms(query_term, postings.matching(query_term))
+    return _nearest_terms(query_term, (term for term in postings if _term_matches(query_term, term)))
+
+
+def _rank_match(index: Dict, query_terms: List[str], allowed: set = None) -> Dict[str, float]:
+    """Score = number of query terms occurring in the entry."""
+    postings = index["postings"]
+    scores = {}
+    for query_term in query_terms:
+        matched = set()
+        for term in _expand_term(postings, query_term):
+            matched.update(postings[term])
+        if allowed is not None:
+            matched &= allowed
+        for memory_id in matched:
+            scores[memory_id] = scores.get(memory_id, 0) + 1
+    return scores
+
+
+def _bm25_idf(n_docs: int, doc_freq: int) -> float:
+    return math.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def _rank_bm25(index: Dict, query_terms: List[str], allowed: set = None) -> Dict[str, float]:
+    """
+    Okapi BM25 over the tier index.
+
+    A query term expanded to several index terms contributes its best
+    matching term per entry, so short prefixes are not over-counted.
+    Candidates (only `allowed` ids, if given) are scored in one batch
+    (NumPy arrays when available).
+    """
+    postings = index["postings"]
+    docs = index["docs"]
+    n_docs = len(docs)
+    if not n_docs:
+        return {}
+    avg_length = index["total_length"] / n_docs or 1.0
+
+    expansions = [_expand_term(postings, term) for term in query_terms]
+    candidates = {mid for terms in expansions for term in terms for mid in postings[term]}
+    if allowed is not None:
+        candidates &= allowed
+    candidates = list(candidates)
+    if not candidates:
+        return {}
+
+    if np is not None:
+        scores = _bm25_numpy(index, expansions, candidates, n_docs, avg_length)
+    else:
+        scores = _bm25_python(index, expansions, candidates, n_docs, avg_length)
+    return dict(zip(candidates, scores))
+
+
+def _bm25_numpy(index: Dict, expansions: List[List[str]], candidates: List[str],
+                n_docs: int, avg_length: float) -> List[float]:
+    postings = index["postings"]
+    docs = index["docs"]
+    position = {memory_id: i for i, memory_id in enumerate(candidates)}
+
+    lengths = np.fromiter((docs[mid]["length"] for mid in candidates),
+                          dtype=np.float64, count=len(candidates))
+    norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)
+    scores = np.zeros(len(candidates))
+
+    for terms in expansions:
+        if not terms:
+            continue
+        # All postings of the expanded terms as flat (row, tf, idf) arrays
+        sizes = [len(postings[term]) for term in terms]
+        rows = np.fromiter((position.get(mid, -1) for term in terms for mid in postings[term]),
+                           dtype=np.int64, count=sum(sizes))
+        tfs = np.fromiter((len(positions) for term in terms for positions in postings[term].values()),
+                          dtype=np.float64, count=sum(sizes))
+        idfs = np.repeat([_bm25_idf(n_docs, size) for size in sizes], sizes)
+        if len(candidates) < len(docs):
+            # Postings of filtered-out entries
+            kept = rows >= 0
+            rows, tfs, idfs = rows[kept], tfs[kept], idfs[kept]
+
+        weights = idfs * tfs * (BM25_K1 + 1) / (tfs + norms[rows])
+        best = np.zeros(len(candidates))
+        np.maximum.at(best, rows, weights)
+        scores += best
+
+    return scores.tolist()
+
+
+def _bm25_python(index: Dict, expansions: List[List[str]], candidates: List[str],
+                 n_docs: int, avg_length: float) -> List[float]:
+    postings = index["postings"]
+    docs = index["docs"]
+    norms = {
+        mid: BM25_K1 * (1 - BM25_B + BM25_B * docs[mid]["length"] / avg_length)
+        for mid in candidates
+    }
+    scores = dict.fromkeys(candidates, 0.0)
+
+    for terms in expansions:
+        best = {}
+        for term in terms:
+            posting = postings[term]
+            idf = _bm25_idf(n_docs, len(posting)) * (BM25_K1 + 1)
+            for mid, positions in posting.items():
+                if mid not in norms:
+                    continue
+                tf = len(positions)
+                weight = idf * tf / (tf + norms[mid])
+                if weight > best.get(mid, 0.0):
+                    best[mid] = weight
+        for mid, weight in best.items():
+            scores[mid] += weight
+
+    return [scores[mid] for mid in candidates]
+
+
+RANKERS = {"bm25": _rank_bm25, "match": _rank_match}
+
+
+def _epoch_days(value: Optional[str]) -> float:
+    """Days since 1970-01-01 of an ISO timestamp (naive, like created_at); 0 if unset."""
+    try:
+        return (datetime.fromisoformat(value) - EPOCH).total_seconds() / 86400
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _ranking_prior(doc: Dict) -> List[float]:
+    """
+    Score blend inputs of an entry, computed once when it is indexed:
+    [days since epoch of last use (or creation), ln(1 + access_count),
+    outcome weight].
+    """
+    last_used = max(doc.get("created_at") or "", doc.get("last_accessed") or "")
+    return [_epoch_days(last_used), math.log1p(doc.get("access_count") or 0),
+            OUTCOME_WEIGHTS.get(doc.get("outcome"), 1.0)]
+
+
+def _prior_factor(prior: List[float], scoring: Dict, now_days: float) -> float:
+    """Multiplier of one entry's text score (see SCORING_PROFILES)."""
+    last_used, usage, outcome = prior
+    factor = 1.0
+    if scoring["half_life_days"]:
+        factor *= 0.5 ** (max(now_days - last_used, 0.0) / scoring["half_life_days"])
+    if scoring["usage"]:
+        factor *= 1 + scoring["usage"] * usage
+    if scoring["outcome"]:
+        factor *= outcome ** scoring["outcome"]
+    return factor
+
+
+def _blend_scores(scores: Dict[str, float], prior_of, scoring: Optional[Dict]) -> Dict[str, float]:
+    """
+    Weight text scores by recency, usage and outcome. `prior_of(id)` gives
+    an entry's precomputed prior (None: neutral), so with NumPy this is one
+    vectorized pass and no dates are parsed per query.
+    """
+    if not scores or not scoring or not any(scoring.values()):
+        return scores
+    now_days = _epoch_days(datetime.now().isoformat())
+    neutral = [now_days, 0.0, 1.0]
+    ids = list(scores)
+    priors = [prior_of(memory_id) or neutral for memory_id in ids]
+    if np is None:
+        return {memory_id: scores[memory_id] * _prior_factor(prior, scoring, now_days)
+                for memory_id, prior in zip(ids, priors)}
+
+    table = np.asarray(priors, dtype=np.float64)
+    factor = np.ones(len(ids))
+    if scoring["half_life_days"]:
+        factor *= np.exp2(-np.maximum(now_days - table[:, 0], 0.0) / scoring["half_life_days"])
+    if scoring["usage"]:
+        factor *= 1 + scoring["usage"] * table[:, 1]
+    if scoring["outcome"]:
+        factor *= table[:, 2] ** scoring["outcome"]
+    relevance = np.fromiter((scores[memory_id] for memory_id in ids), dtype=np.float64, count=len(ids))
+    return dict(zip(ids, (relevance * factor).tolist()))
+
+
+def _parse_scoring(value: Optional[str] = None) -> Dict:
+    """
+    A scoring model: a profile name and/or key=value overrides, e.g.
+    "recent" or "balanced,usage=0.5" (default $IMLAZY_SCORING or DEFAULT_SCORING).
+    """
+    scoring = dict(SCORING_PROFILES[DEFAULT_SCORING])
+    for part in filter(None, ",".join(filter(None, [os.environ.get("IMLAZY_SCORING"), value])).split(",")):
+        name, _, number = part.strip().partition("=")
+        if not _:
+            if name not in SCORING_PROFILES:
+                raise ValueError(f"Invalid scoring profile: {name}. Valid: {list(SCORING_PROFILES)}")
+            scoring = dict(SCORING_PROFILES[name])
+        elif name in scoring and number.strip().replace(".", "", 1).isdigit():
+            scoring[name] = float(number)
+        else:
+            raise ValueError(f"Invalid scoring setting: {part}. Keys: {list(scoring)}")
+    return scoring
+
+
+# ---------------------------------------------------------------------------
+# Query language
+# ---------------------------------------------------------------------------
+
+def parse_query(query: str) -> Optional[List[Dict]]:
+    """
+    Parse a structured query into AND-ed items of OR-ed clauses.
+
+    Syntax: `term`, `"exact phrase"`, `field:term` / `field:"phrase"` (a
+    top-level data key, or "tags"), `-clause` to exclude, and `a OR b`.
+    A clause with several words is a phrase; a quoted word matches
+    exactly, a bare one any term containing it. Returns None for a plain
+    query (no operators), which keeps bag-of-words ranking.
+    """
+    items = []
+    structured = False
+    join_or = False
+    for match in QUERY_CLAUSE_RE.finditer(query):
+        negate, field, quoted, bare = match.groups()
+        if bare == "OR" and not negate and not field:
+            join_or = structured = True
+            continue
+        words = tokenize(quoted if quoted is not None else bare)
+        structured = structured or bool(negate or field or quoted is not None)
+        if not words:
+            join_or = False
+            continue
+        clause = {"field": field, "terms": words, "exact": quoted is not None or len(words) > 1}
+        if join_or and items and not negate and not items[-1]["negate"]:
+            items[-1]["clauses"].append(clause)
+        else:
+            items.append({"negate": bool(negate), "clauses": [clause]})
+        join_or = False
+    return items if structured else None
+
+
+def query_terms(query: str) -> List[str]:
+    """Terms a query is scored by: every term of a plain query, else its non-negated clauses'."""
+    plan = parse_query(query)
+    if plan is None:
+        return sorted(set(tokenize(query)))
+    return sorted({term for item in plan if not item["negate"]
+                   for clause in item["clauses"] for term in clause["terms"]})
+
+
+def _clause_hits(postings: Dict, spans: Dict, clause: Dict, expand) -> set:
+    """
+    Ids matching a clause, from positional postings (term -> {id: positions})
+    and field spans (id -> {field: [start, end)}). `expand` maps a bare term
+    to the index terms it matches.
+    """
+    field = clause["field"]
+
+    def in_field(memory_id, start, end):
+        span = spans.get(memory_id, {}).get(field) if field else None
+        return field is None or (span is not None and span[0] <= start and end <= span[1])
+
+    if not clause["exact"]:
+        hits = set()
+        for term in expand(clause["terms"][0]):
+            for memory_id, positions in postings[term].items():
+                if field is None or any(in_field(memory_id, p, p + 1) for p in positions):
+                    hits.add(memory_id)
+        return hits
+
+    # Phrase: intersect the word postings (smallest first), then check positions
+    words = clause["terms"]
+    lists = [postings.get(word, {}) for word in words]
+    order = sorted(range(len(words)), key=lambda i: len(lists[i]))
+    candidates = set(lists[order[0]])
+    for i in order[1:]:
+        candidates = {memory_id for memory_id in candidates if memory_id in lists[i]}
+
+    hits = set()
+    for memory_id in candidates:
+        following = [set(postings_of[memory_id]) for postings_of in lists]
+        for start in lists[0][memory_id]:
+            if all(start + k in following[k] for k in range(1, len(words))) \
+                    and in_field(memory_id, start, start + len(words)):
+                hits.add(memory_id)
+                break
+    return hits
+
+
+def _match_plan(plan: List[Dict], hits, estimate, universe) -> set:
+    """
+    Ids matching a parsed query. Positive items are intersected cheapest
+    first (by `estimate`, stopping once empty); negated ones are subtracted.
+    A query of only negations starts from `universe()`.
+    """
+    positive = sorted((item for item in plan if not item["negate"]),
+                      key=lambda item: sum(estimate(clause) for clause in item["clauses"]))
+    matched = None
+    for item in positive:
+        ids = set().union(*(hits(clause) for clause in item["clauses"]))
+        matched = ids if matched is None else {memory_id for memory_id in matched if memory_id in ids}
+        if not matched:
+            return set()
+    if matched is None:
+        matched = set(universe())
+    for item in plan:
+        if item["negate"]:
+            for clause in item["clauses"]:
+                matched -= hits(clause)
+    return matched
+
+
+def _match_index(index: Dict, plan: List[Dict]) -> set:
+    """Evaluate a parsed query against a shard's positional index."""
+    postings = index["postings"]
+    spans = index["fields"] \
+        if any(clause["field"] for item in plan for clause in item["clauses"]) else {}
+    expansions = {}
+
+    def expand(term):
+        if term not in expansions:
+            expansions[term] = _expand_term(postings, term)
+        return expansions[term]
+
+    def estimate(clause):
+        if clause["exact"]:
+            return min(len(postings.get(word, {})) for word in clause["terms"])
+        return sum(len(postings[term]) for term in expand(clause["terms"][0]))
+
+    return _match_plan(plan, lambda clause: _clause_hits(postings, spans, clause, expand),
+                       estimate, lambda: index["docs"])
+
+
+# ---------------------------------------------------------------------------
+# Storage backends
+# ---------------------------------------------------------------------------
+
+class FileBackend:
+    """One pretty-printed JSON file per entry, searched via index files."""
+
+    name = "files"
+
+    def shards(self, memory_type: str) -> List[str]:
+        """The tier itself plus one shard per project subdirectory."""
+        shards = [memory_type]
+        if memory_type in SHARDED_TYPES:
+            shards += sorted(f"{memory_type}/{path.name}"
+                             for path in MEMORY_DIRS[memory_type].iterdir() if path.is_dir())
+        return shards
+
+    def _locate(self, memory_type: str, memory_id: str) -> Optional[str]:
+        """The shard holding an entry file, if any."""
+        if _entry_path(memory_type, memory_id).exists():
+            return memory_type
+        if memory_type in SHARDED_TYPES:
+            for path in MEMORY_DIRS[memory_type].glob(f"*/{memory_id}.json"):
+                return f"{memory_type}/{path.parent.name}"
+        for shard in self.shards(memory_type):
+            if memory_id in _load_offsets(shard)["entries"]:
+                return shard
+        return None
+
+    def get(self, memory_type: str, memory_id: str) -> Optional[Dict]:
+        shard = self._locate(memory_type, memory_id)
+        return _read_entry(shard, memory_id) if shard else None
+
+    def entries(self, shard: str) -> Iterable[Dict]:
+        return _iter_entries(shard)
+
+    def put(self, entry: Dict):
+        self.put_many([entry])
+
+    def put_many(self, entries: List[Dict]):
+        """
+        Write entries, updating each shard's index once. A shard's share of
+        SEGMENT_MIN_BATCH or more entries is appended to its segments, as
+        compaction would (one compressed block per SEGMENT_BLOCK_BYTES instead
+        of one file per entry); fewer are written as entry files.
+        """
+        by_shard = {}
+        for entry in entries:
+            by_shard.setdefault(_entry_shard(entry), []).append(entry)
+        for shard, shard_entries in by_shard.items():
+            if len(shard_entries) >= SEGMENT_MIN_BATCH:
+                self._pack_batch(shard, shard_entries)
+                continue
+            with _updating_index(shard) as update:
+                for entry in shard_entries:
+                    update.add(entry, _write_entry(entry))
+
+    def _pack_batch(self, shard: str, entries: List[Dict]):
+        """Append entries to the shard's segments and index them (locking as _compact_shard)."""
+        with _index_lock(f"{shard}.segments"), _index_lock(shard):
+            # Loaded first: a missing index is rebuilt without the batch
+            update = _IndexUpdate(shard)
+            offsets = _read_index_file(_offsets_path(shard), SEGMENT_VERSION) or _empty_offsets()
+            sizes = _pack_entries(shard, offsets, entries, level=SEGMENT_BATCH_LEVEL)
+            _offsets_path(shard).parent.mkdir(parents=True, exist_ok=True)
+            _write_index_file(_offsets_path(shard), offsets)
+            for entry in entries:
+                # A loose file of a replaced entry would shadow the packed copy
+                _entry_path(shard, entry["id"]).unlink(missing_ok=True)
+                update.add(entry, sizes[entry["id"]])
+            update.save()
+
+    def apply_access(self, memory_type: str, updates: Dict[str, Dict]):
+        """Add journaled access counts to entries and their index metadata."""
+        by_shard = {}
+        for memory_id, access in updates.items():
+            shard = self._locate(memory_type, memory_id)
+            if shard is not None:
+                by_shard.setdefault(shard, {})[memory_id] = access
+
+        for shard, shard_updates in by_shard.items():
+            with _updating_index(shard) as update:
+                for memory_id, access in shard_updates.items():
+                    entry = _read_entry(shard, memory_id)
+                    if entry is None:
+                        continue
+                    entry["access_count"] = entry.get("access_count", 0) + access["count"]
+                    entry["last_accessed"] = max(entry.get("last_accessed") or "", access["last"])
+                    size = _write_entry(entry, shard)
+
+                    if update.doc(memory_id) is None:
+                        update.add(entry, size)
+                    else:
+                        update.update(memory_id, access_count=entry["access_count"],
+                                      last_accessed=entry["last_accessed"], size=size)
+
+    def search(self, shard: str, query: str, limit: int, rank: str,
+               filters: Dict = None, scoring: Dict = None) -> List[Dict]:
+        index = _load_index(shard)
+        docs = index["docs"]
+        allowed = _filter_candidates(index, filters) if filters else None
+        plan = parse_query(query)
+        if plan is not None:
+            matched = _match_index(index, plan)
+            allowed = matched if allowed is None else allowed & matched
+        terms = query_terms(query)
+        if not terms:
+            # A filter-only search lists the matches, newest first
+            scores = dict.fromkeys(allowed or (), 0.0)
+        elif rank == "vector":
+            scores = _rank_vector(shard, " ".join(terms), allowed)
+        else:
+            scores = RANKERS[rank](index, terms, allowed)
+        if plan is not None:
+            # Matches scoring nothing (e.g. only negations) still rank last
+            for memory_id in allowed:
+                scores.setdefault(memory_id, 0.0)
+        scores = _blend_scores(scores, lambda memory_id: docs.get(memory_id, {}).get("prior"), scoring)
+
+        ranked = sorted(
+            scores.items(),
+            key=lambda item: (item[1], docs.get(item[0], {}).get("created_at") or ""),
+            reverse=True
+        )
+
+        results = []
+        stale = []
+        for memory_id, score in ranked:
+            entry = _read_entry(shard, memory_id)
+            if entry is None:
+                stale.append(memory_id)
+                continue
+            results.append({"id": memory_id, "score": score, "entry": entry})
+            if len(results) >= limit:
+                break
+
+        # Entries deleted behind our back: drop them from the indexes
+        if stale:
+            self._unindex(shard, stale)
+            _drop_sidecars(shard, stale)
+            bump_generation()
+
+        return results
+
+    def metadata(self, shard: str) -> List[Dict]:
+        """Per-entry metadata from the index (no entry file is opened)."""
+        docs = _load_index(shard).all_docs()
+        return [
+            {
+                "id": memory_id,
+                "created_at": doc.get("created_at"),
+                "access_count": doc.get("access_count", 0),
+                "last_accessed": doc.get("last_accessed"),
+                "size": doc.get("size", 0)
+            }
+            for memory_id, doc in docs.items()
+        ]
+
+    def delete(self, shard: str, memory_ids: List[str]):
+        for memory_id in memory_ids:
+            _entry_path(shard, memory_id).unlink(missing_ok=True)
+        self._unpack(shard, memory_ids)
+        self._unindex(shard, memory_ids)
+
+    def _unpack(self, shard: str, memory_ids: List[str]):
+        """Drop entries from the shard's segments, deleting segments left empty."""
+        if not _offsets_path(shard).exists():
+            return
+        with _updating_offsets(shard) as offsets:
+            for memory_id in memory_ids:
+                _forget_packed(offsets, memory_id)
+            _collect_segments(shard, offsets, rewrite=False)
+
+    def compact(self, memory_type: str, cutoff: datetime, min_batch: int = 1) -> Dict:
+        """Pack loose entries last used before `cutoff` into each shard's segments."""
+        totals = {"packed": 0, "reclaimed_bytes": 0}
+        for shard in self.shards(memory_type):
+            result = self._compact_shard(shard, cutoff, min_batch)
+            totals["packed"] += result["packed"]
+            totals["reclaimed_bytes"] += result["reclaimed_bytes"]
+        return totals
+
+    def _compact_shard(self, shard: str, cutoff: datetime, min_batch: int) -> Dict:
+        with _index_lock(f"{shard}.segments"), _index_lock(shard):
+            cold = []
+            for file_path in _shard_dir(shard).glob("*.json"):
+                try:
+                    mtime = file_path.stat().st_mtime_ns
+                    with open(file_path, 'r') as f:
+                        entry = json.load(f)
+                except (json.JSONDecodeError, IOError):
+                    continue
+                entry.setdefault("id", file_path.stem)
+                if _parse_time(entry.get("last_accessed") or entry.get("created_at")) < cutoff:
+                    cold.append((file_path, mtime, entry))
+            if not cold or len(cold) < min_batch:
+                return {"packed": 0, "reclaimed_bytes": 0}
+
+            offsets = _read_index_file(_offsets_path(shard), SEGMENT_VERSION) or _empty_offsets()
+            sizes = _pack_entries(shard, offsets, [entry for _, _, entry in cold])
+            reclaimed, moved = _collect_segments(shard, offsets, rewrite=True)
+            _write_index_file(_offsets_path(shard), offsets)
+
+            update = _IndexUpdate(shard)
+            resized = {}
+            for file_path, mtime, entry in cold:
+                # Rewritten since it was read: the loose file stays authoritative
+                if file_path.stat().st_mtime_ns != mtime:
+                    continue
+                file_path.unlink()
+                resized[entry["id"]] = sizes[entry["id"]]
+            packed = len(resized)
+            # Repacked copies shadowed by a loose file don't change its size
+            resized.update({
+                memory_id: size for memory_id, size in moved.items()
+                if not _entry_path(shard, memory_id).exists()
+            })
+            for memory_id, size in resized.items():
+                update.update(memory_id, size=size)
+            update.save()
+        return {"packed": packed, "reclaimed_bytes": reclaimed}
+
+    def stats(self, memory_type: str) -> Dict:
+        """Tier totals from the shards' manifest files alone."""
+        manifests = []
+        for shard in self.shards(memory_type):
+            manifest = _read_index_file(_manifest_path(shard), INDEX_VERSION)
+            if manifest is None:
+                manifest = _load_index(shard)["manifest"]
+            manifests.append(manifest)
+        return _format_manifest(_merge_manifests(manifests))
+
+    def verify_stats(self, memory_type: str) -> Dict:
+        """Rebuild the tier's indexes (and manifests) from the entry files."""
+        manifests = [_read_index_file(_manifest_path(shard), INDEX_VERSION)
+                     for shard in self.shards(memory_type)]
+        before = None if None in manifests else _format_manifest(_merge_manifests(manifests))
+        self.reindex(memory_type)
+        after = self.stats(memory_type)
+        return {**after, "drift": _manifest_drift(before, after)}
+
+    def reindex(self, memory_type: str) -> Dict:
+        if memory_type in SHARDED_TYPES:
+            self._relocate(memory_type)
+
+        totals = {"entries": 0, "terms": 0}
+        shards = self.shards(memory_type)
+        for shard in shards:
+            with _index_lock(f"{shard}.merge"), _index_lock(shard):
+                index = _rebuild_index(shard)
+            totals["entries"] += len(index["docs"])
+            totals["terms"] += len(index["postings"])
+        if memory_type in SHARDED_TYPES:
+            totals["shards"] = len(shards)
+        return totals
+
+    def _relocate(self, memory_type: str):
+        """Move project entries left in the tier root (stored before sharding) to their shard."""
+        unpacked = []
+        for entry, _ in list(_iter_entry_files(memory_type)):
+            shard = _entry_shard(entry)
+            if shard == memory_type:
+                continue
+            source = _entry_path(memory_type, entry["id"])
+            if source.exists():
+                target = _entry_path(shard, entry["id"])
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(source, target)
+            else:
+                _write_entry(entry, shard)
+                unpacked.append(entry["id"])
+        if unpacked:
+            self._unpack(memory_type, unpacked)
+
+    def _unindex(self, shard: str, memory_ids: List[str]):
+        with _updating_index(shard) as update:
+            for memory_id in memory_ids:
+                update.remove(memory_id)
+
+
+class SQLiteBackend:
+    """
+    All tiers in one WAL-mode SQLite database.
+
+    Metadata lives in indexed columns (type, created_at, access_count,
+    project_hash, outcome) plus a tag table; entry text is indexed by one FTS5
+    table per tier, whose rowids mirror the memories table, so document
+    frequencies stay tier-local as in the file backend's tier indexes.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS memories (
+            id TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            data TEXT NOT NULL,
+            tags TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            access_count INTEGER NOT NULL DEFAULT 0,
+            last_accessed TEXT,
+            project_hash TEXT,
+            duplicate_count INTEGER NOT NULL DEFAULT 0,
+            outcome TEXT,
+            last_used_days REAL,
+            merged_from TEXT,
+            length INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_memories_type_created ON memories(type, created_at);
+        CREATE INDEX IF NOT EXISTS idx_memories_type_access ON memories(type, access_count);
+        CREATE INDEX IF NOT EXISTS idx_memories_type_project ON memories(type, project_hash);
+        CREATE TABLE IF NOT EXISTS memory_tags (
+            tag TEXT NOT NULL,
+            id TEXT NOT NULL,
+            PRIMARY KEY (tag, id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_memory_tags_id ON memory_tags(id);
+
+        -- Running per-tier totals for stats, maintained by triggers
+        CREATE TABLE IF NOT EXISTS memory_manifest (
+            type TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0,
+            size_bytes INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS memory_tag_counts (
+            type TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (type, tag)
+        ) WITHOUT ROWID;
+        CREATE TRIGGER IF NOT EXISTS memories_manifest_insert AFTER INSERT ON memories BEGIN
+            INSERT INTO memory_manifest (type, count, size_bytes)
+            VALUES (NEW.type, 1, LENGTH(NEW.data) + LENGTH(NEW.tags))
+            ON CONFLICT (type) DO UPDATE SET
+                count = count + 1, size_bytes = size_bytes + excluded.size_bytes;
+        END;
+        CREATE TRIGGER IF NOT EXISTS memories_manifest_delete AFTER DELETE ON memories BEGIN
+            UPDATE memory_manifest SET
+                count = count - 1, size_bytes = size_bytes - (LENGTH(OLD.data) + LENGTH(OLD.tags))
+            WHERE type = OLD.type;
+        END;
+        CREATE TRIGGER IF NOT EXISTS memories_manifest_update AFTER UPDATE OF data, tags ON memories BEGIN
+            UPDATE memory_manifest SET size_bytes = size_bytes
+                + (LENGTH(NEW.data) + LENGTH(NEW.tags)) - (LENGTH(OLD.data) + LENGTH(OLD.tags))
+            WHERE type = NEW.type;
+        END;
+        CREATE TRIGGER IF NOT EXISTS memory_tags_count_insert AFTER INSERT ON memory_tags BEGIN
+            INSERT INTO memory_tag_counts (type, tag, count)
+            VALUES ((SELECT type FROM memories WHERE id = NEW.id), NEW.tag, 1)
+            ON CONFLICT (type, tag) DO UPDATE SET count = count + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS memory_tags_count_delete AFTER DELETE ON memory_tags BEGIN
+            UPDATE memory_tag_counts SET count = count - 1
+            WHERE type = (SELECT type FROM memories WHERE id = OLD.id) AND tag = OLD.tag;
+            DELETE FROM memory_tag_counts WHERE count <= 0;
+        END;
+    """ + "".join(f"""
+        -- {memory_type} text, tokenized like tokenize(); vocabularies for term expansion and offsets
+        CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts_{memory_type}
+            USING fts5(body, tokenize="unicode61 remove_diacritics 0 tokenchars '_'");
+        CREATE VIRTUAL TABLE IF NOT EXISTS memory_terms_{memory_type}
+            USING fts5vocab(memory_fts_{memory_type}, 'row');
+        CREATE VIRTUAL TABLE IF NOT EXISTS memory_postings_{memory_type}
+            USING fts5vocab(memory_fts_{memory_type}, 'instance');
+    """ for memory_type in LONG_TERM_TYPES)
+    SCHEMA_VERSION = 6
+
+    COLUMNS = ("id, type, data, tags, created_at, access_count, last_accessed, project_hash,"
+               " duplicate_count, merged_from")
+
+    def __init__(self, path: Path = None):
+        self.path = path or MEMORY_DB
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Connections can't cross threads; `search all` queries from workers
+        self._local = threading.local()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        self.conn.executescript(self.SCHEMA)
+        if version < 1:
+            # Databases from before the manifest tables: backfill them
+            with self.conn:
+                self._recompute_manifest()
+        if version < 2:
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(memories)")}
+            if "duplicate_count" not in columns:
+                self.conn.execute(
+                    "ALTER TABLE memories ADD COLUMN duplicate_count INTEGER NOT NULL DEFAULT 0")
+        if version < 3:
+            # Outcome column for search filters, backfilled from the data
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(memories)")}
+            with self.conn:
+                if "outcome" not in columns:
+                    self.conn.execute("ALTER TABLE memories ADD COLUMN outcome TEXT")
+                self.conn.execute(
+                    "UPDATE memories SET outcome = json_extract(data, '$.outcome')"
+                    " WHERE json_valid(data) AND json_type(data, '$.outcome') = 'text'")
+                self.conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_memories_type_outcome ON memories(type, outcome)")
+        if version < 4:
+            # Precomputed recency input of the score blend
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(memories)")}
+            with self.conn:
+                if "last_used_days" not in columns:
+                    self.conn.execute("ALTER TABLE memories ADD COLUMN last_used_days REAL")
+                rows = self.conn.execute("SELECT id, created_at, last_accessed FROM memories").fetchall()
+                self.conn.executemany(
+                    "UPDATE memories SET last_used_days = ? WHERE id = ?",
+                    [(_ranking_prior({"created_at": created_at, "last_accessed": last_accessed})[0], memory_id)
+                     for memory_id, created_at, last_accessed in rows])
+        if version < 5:
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(memories)")}
+            if "merged_from" not in columns:
+                self.conn.execute("ALTER TABLE memories ADD COLUMN merged_from TEXT")
+        if version < 6:
+            # The shared memory_fts table becomes one table per tier, plus token counts for BM25
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(memories)")}
+            with self.conn:
+                if "length" not in columns:
+                    self.conn.execute("ALTER TABLE memories ADD COLUMN length INTEGER NOT NULL DEFAULT 0")
+                self.conn.execute("DROP TABLE IF EXISTS memory_fts")
+                rows = self.conn.execute(f"SELECT rowid, {self.COLUMNS} FROM memories").fetchall()
+                for rowid, *row in rows:
+                    text = _entry_text(self._to_entry(row))
+                    self._index_text(rowid, row[1], text)
+                    self.conn.execute("UPDATE memories SET length = ? WHERE rowid = ?",
+                                      (len(tokenize(text)), rowid))
+        if version < self.SCHEMA_VERSION:
+            self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            if version:
+                # Results cached under the old schema may rank differently
+                bump_generation()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """This thread's connection, opened on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _priors(self, memory_ids: List[str]) -> Dict[str, List[float]]:
+        """Score blend inputs (see _ranking_prior) from the indexed columns."""
+        priors = {}
+        for start in range(0, len(memory_ids), 500):
+            chunk = memory_ids[start:start + 500]
+            for memory_id, last_used_days, access_count, outcome in self.conn.execute(
+                "SELECT id, last_used_days, access_count, outcome FROM memories"
+                f" WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ):
+                if last_used_days is not None:
+                    priors[memory_id] = [last_used_days, math.log1p(access_count or 0),
+                                         OUTCOME_WEIGHTS.get(outcome, 1.0)]
+        return priors
+
+    @staticmethod
+    def _to_entry(row) -> Dict:
+        (memory_id, memory_type, data, tags, created_at, access_count, last_accessed,
+         project_hash, duplicate_count, merged_from) = row
+        entry = {
+            "id": memory_id,
+            "type": memory_type,
+            "data": json.loads(data),
+            "tags": json.loads(tags),
+            "created_at": created_at,
+            "access_count": access_count,
+            "last_accessed": last_accessed
+        }
+        if project_hash and memory_type in SHARDED_TYPES:
+            entry["project_hash"] = project_hash
+        if duplicate_count:
+            entry["duplicate_count"] = duplicate_count
+        if merged_from:
+            entry["merged_from"] = json.loads(merged_from)
+        return entry
+
+    @staticmethod
+    def _shard_filter(shard: str, alias: str = "") -> tuple:
+        """WHERE clause and parameters selecting one shard's rows."""
+        memory_type, project = _split_shard(shard)
+        if memory_type not in SHARDED_TYPES:
+            return f"{alias}type = ?", (memory_type,)
+        if project is None:
+            return f"{alias}type = ? AND COALESCE({alias}project_hash, '') = ''", (memory_type,)
+        return f"{alias}type = ? AND {alias}project_hash = ?", (memory_type, project)
+
+    @staticmethod
+    def _filter_clause(filters: Dict, alias: str = "") -> tuple:
+        """AND clauses and parameters for search filters (tag table, indexed columns)."""
+        clauses, params = [], []
+        for tag in filters.get("tags") or []:
+            clauses.append(f"{alias}id IN (SELECT id FROM memory_tags WHERE tag = ?)")
+            params.append(tag)
+        if filters.get("since"):
+            clauses.append(f"{alias}created_at >= ?")
+            params.append(filters["since"])
+        if filters.get("until"):
+            clauses.append(f"{alias}created_at <= ?")
+            params.append(_until_bound(filters["until"]))
+        if filters.get("outcome"):
+            clauses.append(f"{alias}outcome = ?")
+            params.append(filters["outcome"])
+        return "".join(f" AND {clause}" for clause in clauses), tuple(params)
+
+    @staticmethod
+    def _table(memory_type: str, kind: str = "fts") -> str:
+        """A tier's FTS5 table ("fts") or vocabulary ("terms", "postings")."""
+        if memory_type not in LONG_TERM_TYPES:
+            raise ValueError(f"Invalid memory type: {memory_type}")
+        return f"memory_{kind}_{memory_type}"
+
+    def _index_text(self, rowid: int, memory_type: str, text: str):
+        """Index an entry's text in its tier's FTS5 table (caller owns the transaction)."""
+        self.conn.execute(f"INSERT INTO {self._table(memory_type)} (rowid, body) VALUES (?, ?)",
+                          (rowid, text))
+
+    def shards(self, memory_type: str) -> List[str]:
+        shards = [memory_type]
+        if memory_type in SHARDED_TYPES:
+            shards += [f"{memory_type}/{project}" for (project,) in self.conn.execute(
+                "SELECT DISTINCT project_hash FROM memories WHERE type = ? AND project_hash != ''"
+                " ORDER BY project_hash", (memory_type,)
+            )]
+        return shards
+
+    def _insert(self, entry: Dict):
+        """Insert or replace an entry (caller owns the transaction)."""
+        self._delete(entry["id"])
+        data = entry.get("data")
+        project_hash = _entry_project(entry)
+        text = _entry_text(entry)
+        cursor = self.conn.execute(
+            "INSERT INTO memories (id, type, data, tags, created_at, access_count, last_accessed,"
+            " project_hash, duplicate_count, outcome, last_used_days, merged_from, length)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (entry["id"], entry["type"], json.dumps(data, ensure_ascii=False),
+             json.dumps(entry.get("tags", []), ensure_ascii=False),
+             entry.get("created_at") or datetime.now().isoformat(),
+             entry.get("access_count", 0), entry.get("last_accessed"), project_hash,
+             entry.get("duplicate_count", 0), _entry_outcome(entry), _ranking_prior(entry)[0],
+             json.dumps(entry["merged_from"]) if entry.get("merged_from") else None,
+             len(tokenize(text)))
+        )
+        self._index_text(cursor.lastrowid, entry["type"], text)
+        self.conn.executemany("INSERT OR IGNORE INTO memory_tags (tag, id) VALUES (?, ?)",
+                              [(tag, entry["id"]) for tag in entry.get("tags", [])])
+
+    def _delete(self, memory_id: str):
+        row = self.conn.execute("SELECT rowid, type FROM memories WHERE id = ?", (memory_id,)).fetchone()
+        if row is None:
+            return
+        rowid, memory_type = row
+        self.conn.execute(f"DELETE FROM {self._table(memory_type)} WHERE rowid = ?", (rowid,))
+        self.conn.execute("DELETE FROM memory_tags WHERE id = ?", (memory_id,))
+        self.conn.execute("DELETE FROM memories WHERE rowid = ?", (rowid,))
+
+    def _fetch(self, memory_ids: List[str]) -> Dict[str, Dict]:
+        entries = {}
+        for start in range(0, len(memory_ids), 500):
+            chunk = memory_ids[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM memories WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for row in rows:
+                entries[row[0]] = self._to_entry(row)
+        return entries
+
+    def get(self, memory_type: str, memory_id: str) -> Optional[Dict]:
+        row = self.conn.execute(
+            f"SELECT {self.COLUMNS} FROM memories WHERE type = ? AND id = ?", (memory_type, memory_id)
+        ).fetchone()
+        return self._to_entry(row) if row else None
+
+    def entries(self, shard: str) -> Iterable[Dict]:
+        where, params = self._shard_filter(shard)
+        rows = self.conn.execute(f"SELECT {self.COLUMNS} FROM memories WHERE {where}", params)
+        for row in rows.fetchall():
+            yield self._to_entry(row)
+
+    def put(self, entry: Dict):
+        self.put_many([entry])
+
+    def put_many(self, entries: List[Dict]):
+        with self.conn:
+            for entry in entries:
+                self._insert(entry)
+
+    def apply_access(self, memory_type: str, updates: Dict[str, Dict]):
+        """Add journaled access counts in one transaction."""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE memories SET access_count = access_count + ?,"
+                " last_accessed = MAX(COALESCE(last_accessed, ''), ?),"
+                " last_used_days = MAX(COALESCE(last_used_days, 0), ?) WHERE type = ? AND id = ?",
+                [(access["count"], access["last"], _epoch_days(access["last"]), memory_type, memory_id)
+                 for memory_id, access in updates.items()]
+            )
+
+    def search(self, shard: str, query: str, limit: int, rank: str,
+               filters: Dict = None, scoring: Dict = None) -> List[Dict]:
+        memory_type = _split_shard(shard)[0]
+        shard_where, shard_params = self._shard_filter(shard, "m.")
+        filter_sql, filter_params = self._filter_clause(filters or {}, "m.")
+        where, params = shard_where + filter_sql, shard_params + filter_params
+        terms = query_terms(query)
+
+        plan = parse_query(query)
+        matched = None
+        if plan is not None:
+            matched = self._match(memory_type, plan, where, params)
+            if not matched:
+                return []
+        # A structured query is ranked within its matches
+        fetch = limit if matched is None else -1
+
+        if not terms:
+            if not filters and matched is None:
+                return []
+            # A filter-only search lists the matches, newest first
+            ranked = self.conn.execute(
+                f"SELECT m.id, 0.0 FROM memories m WHERE {where} ORDER BY m.created_at DESC LIMIT ?",
+                (*params, fetch)
+            ).fetchall()
+        else:
+            allowed = matched
+            if filters and allowed is None:
+                allowed = {memory_id for (memory_id,) in self.conn.execute(
+                    f"SELECT m.id FROM memories m WHERE {where}", params)}
+            if rank == "vector":
+                scores = _rank_vector(shard, " ".join(terms), allowed)
+            else:
+                # Same rankers as the file backend, over the shard's slice of the tier index
+                index = self._index(memory_type, terms, shard_where, shard_params)
+                scores = RANKERS[rank](index, terms, allowed)
+            ranked = self._blend(scores, scoring)
+
+        if matched is not None:
+            ranked = [(memory_id, score) for memory_id, score in ranked if memory_id in matched]
+            scored = {memory_id for memory_id, _ in ranked}
+            # Matches scoring nothing (e.g. only negations) rank last, newest first
+            rest = sorted(self._fetch([mid for mid in matched if mid not in scored]).values(),
+                          key=lambda entry: entry["created_at"], reverse=True)
+            ranked += [(entry["id"], 0.0) for entry in rest]
+        ranked = ranked[:limit]
+
+        entries = self._fetch([memory_id for memory_id, _ in ranked])
+        return [
+            {"id": memory_id, "score": score, "entry": entries[memory_id]}
+            for memory_id, score in ranked if memory_id in entries
+        ]
+
+    def _blend(self, scores: Dict[str, float], scoring: Optional[Dict]) -> List[tuple]:
+        """Scores blended by the entries' priors, best first."""
+        priors = self._priors(list(scores)) if scoring and any(scoring.values()) else {}
+        blended = _blend_scores(scores, priors.get, scoring)
+        return sorted(blended.items(), key=lambda item: item[1], reverse=True)
+
+    def _expand(self, memory_type: str, query_term: str) -> List[str]:
+        """Tier vocabulary terms hit by a query term, by the file backend's rule (_term_matches)."""
+        table = self._table(memory_type, "terms")
+        if len(query_term) < QUERY_GRAM:
+            rows = self.conn.execute(f"SELECT term FROM {table} WHERE term >= ? AND term < ?",
+                                     (query_term, query_term + "\uffff"))
+        else:
+            rows = self.conn.execute(f"SELECT term FROM {table} WHERE instr(term, ?) > 0", (query_term,))
+        return _nearest_terms(query_term, (term for (term,) in rows))
+
+    def _index(self, memory_type: str, query_terms: List[str], where: str, params: tuple) -> Dict:
+        """
+        A shard's slice of the tier index in the file backend's shape
+        (postings of the query terms' expansions, token offsets from the
+        FTS5 instance vocabulary; every entry's length), for RANKERS.
+        """
+        table = self._table(memory_type, "postings")
+        postings = {}
+        for term in {term for query_term in query_terms for term in self._expand(memory_type, query_term)}:
+            posting = {}
+            # CROSS JOIN keeps the vocabulary outermost; it can't be probed by doc
+            for memory_id, offset in self.conn.execute(
+                f"SELECT m.id, v.offset FROM {table} v CROSS JOIN memories m ON m.rowid = v.doc"
+                f" WHERE v.term = ? AND {where}", (term, *params)
+            ):
+                posting.setdefault(memory_id, []).append(offset)
+            if posting:
+                postings[term] = posting
+        docs = {memory_id: {"length": length} for memory_id, length in self.conn.execute(
+            f"SELECT m.id, m.length FROM memories m WHERE {where}", params)}
+        return {"postings": postings, "docs": docs,
+                "total_length": sum(doc["length"] for doc in docs.values())}
+
+    def _match(self, memory_type: str, plan: List[Dict], where: str, params: tuple) -> set:
+        """
+        Evaluate a parsed query with the tier's FTS5 table (a positional
+        index): bare terms as the OR of their expansions (see _expand),
+        phrases as FTS5 phrases. Field-scoped clauses are narrowed by FTS5,
+        then checked against the candidates' field spans.
+        """
+        table = self._table(memory_type)
+        expansions = {}
+
+        def expand(term):
+            if term not in expansions:
+                expansions[term] = self._expand(memory_type, term)
+            return expansions[term]
+
+        def fts_ids(expression):
+            # FTS5 outermost: probed per memories row, it re-runs the MATCH each time
+            return {memory_id for (memory_id,) in self.conn.execute(
+                f"SELECT m.id FROM {table} f CROSS JOIN memories m ON m.rowid = f.rowid"
+                f" WHERE {table} MATCH ? AND {where}", (expression, *params)
+            )}
+
+        def hits(clause):
+            words = clause["terms"]
+            if clause["exact"]:
+                ids = fts_ids(f'"{" ".join(words)}"')
+            else:
+                terms = expand(words[0])
+                ids = fts_ids(" OR ".join(f'"{term}"' for term in terms)) if terms else set()
+            if not clause["field"] or not ids:
+                return ids
+            postings, spans = {}, {}
+            for memory_id, entry in self._fetch(list(ids)).items():
+                positions, spans[memory_id] = _entry_positions(entry)
+                for term, term_positions in positions.items():
+                    postings.setdefault(term, {})[memory_id] = term_positions
+            return _clause_hits(postings, spans, clause,
+                                lambda term: [t for t in expand(term) if t in postings])
+
+        def universe():
+            return [memory_id for (memory_id,) in self.conn.execute(
+                f"SELECT m.id FROM memories m WHERE {where}", params)]
+
+        # FTS5 doesn't expose posting sizes up front; evaluate in query order
+        return _match_plan(plan, hits, lambda clause: 0, universe)
+
+    def metadata(self, shard: str) -> List[Dict]:
+        """Per-entry metadata from the indexed columns (data is not decoded)."""
+        where, params = self._shard_filter(shard)
+        rows = self.conn.execute(
+            "SELECT id, created_at, access_count, last_accessed, LENGTH(data) + LENGTH(tags)"
+            f" FROM memories WHERE {where}", params
+        )
+        return [
+            {"id": memory_id, "created_at": created_at, "access_count": access_count,
+             "last_accessed": last_accessed, "size": size}
+            for memory_id, created_at, access_count, last_accessed, size in rows
+        ]
+
+    def delete(self, shard: str, memory_ids: List[str]):
+        with self.conn:
+            for memory_id in memory_ids:
+                self._delete(memory_id)
+
+    def _recompute_manifest(self, memory_type: str = None):
+        """Rebuild manifest tables from the data (caller owns the transaction)."""
+        where, params = ("WHERE type = ?", (memory_type,)) if memory_type else ("", ())
+        self.conn.execute(f"DELETE FROM memory_manifest {where}", params)
+        self.conn.execute(
+            "INSERT INTO memory_manifest (type, count, size_bytes)"
+            f" SELECT type, COUNT(*), SUM(LENGTH(data) + LENGTH(tags)) FROM memories {where} GROUP BY type",
+            params
+        )
+        self.conn.execute(f"DELETE FROM memory_tag_counts {where}", params)
+        self.conn.execute(
+            "INSERT INTO memory_tag_counts (type, tag, count)"
+            " SELECT m.type, t.tag, COUNT(*) FROM memory_tags t JOIN memories m ON m.id = t.id"
+            f" {where.replace('type', 'm.type')} GROUP BY m.type, t.tag",
+            params
+        )
+
+    def stats(self, memory_type: str) -> Dict:
+        """Tier totals from the manifest tables; oldest/newest via the created_at index."""
+        row = self.conn.execute(
+            "SELECT count, size_bytes FROM memory_manifest WHERE type = ?", (memory_type,)
+        ).fetchone()
+        count, size_bytes = row or (0, 0)
+        oldest = self.conn.execute(
+            "SELECT MIN(created_at) FROM memories WHERE type = ?", (memory_type,)).fetchone()[0]
+        newest = self.conn.execute(
+            "SELECT MAX(created_at) FROM memories WHERE type = ?", (memory_type,)).fetchone()[0]
+        tags = dict(self.conn.execute(
+            "SELECT tag, count FROM memory_tag_counts WHERE type = ?", (memory_type,)))
+        return _format_manifest({"count": count, "size_bytes": size_bytes,
+                                 "oldest": oldest, "newest": newest, "tags": tags})
+
+    def verify_stats(self, memory_type: str) -> Dict:
+        """Recompute the tier's manifest rows from the data."""
+        before = self.stats(memory_type)
+        with self.conn:
+            self._recompute_manifest(memory_type)
+        after = self.stats(memory_type)
+        return {**after, "drift": _manifest_drift(before, after)}
+
+    def compact(self, memory_type: str, cutoff: datetime, min_batch: int = 1) -> Dict:
+        """Rows already live in database pages; there is nothing to pack."""
+        return {"packed": 0, "reclaimed_bytes": 0}
+
+    def reindex(self, memory_type: str) -> Dict:
+        rows = self.conn.execute(f"SELECT {self.COLUMNS} FROM memories WHERE type = ?", (memory_type,))
+        entries = [self._to_entry(row) for row in rows.fetchall()]
+        with self.conn:
+            for entry in entries:
+                self._insert(entry)
+        return {"entries": len(entries)}
+
+
+_backend = None
+
+
+def _backend_name() -> str:
+    return os.environ.get("IMLAZY_MEMORY_BACKEND") or ("sqlite" if MEMORY_DB.exists() else "files")
+
+
+def get_backend():
+    """
+    The configured storage backend (SQLite once migrated, else files),
+    re-checked per call so a resident process follows `migrate` and
+    IMLAZY_MEMORY_BACKEND.
+    """
+    global _backend
+    name = _backend_name()
+    if name not in BACKENDS:
+        raise ValueError(f"Invalid memory backend: {name}. Valid: {BACKENDS}")
+    backend_class = SQLiteBackend if name == "sqlite" else FileBackend
+    if type(_backend) is not backend_class:
+        _backend = backend_class()
+    return _backend
+
+
+def _format_manifest(manifest: Dict) -> Dict:
+    """Stats view of a manifest: totals, date range and the top tags."""
+    top_tags = sorted(manifest["tags"].items(), key=lambda item: (-item[1], item[0]))
+    return {
+        "count": manifest["count"],
+        "size_bytes": manifest["size_bytes"],
+        "oldest": manifest["oldest"],
+        "newest": manifest["newest"],
+        "tags": dict(top_tags[:MANIFEST_TOP_TAGS])
+    }
+
+
+def _merge_manifests(manifests: List[Dict]) -> Dict:
+    """Tier manifest from its shards' manifests."""
+    merged = _empty_manifest()
+    for manifest in manifests:
+        merged["count"] += manifest["count"]
+        merged["size_bytes"] += manifest["size_bytes"]
+        for key, pick in (("oldest", min), ("newest", max)):
+            values = [value for value in (merged[key], manifest[key]) if value]
+            merged[key] = pick(values, default=None)
+        for tag, count in manifest["tags"].items():
+            merged["tags"][tag] = merged["tags"].get(tag, 0) + count
+    return merged
+
+
+def _manifest_drift(before: Optional[Dict], after: Dict) -> Dict:
+    """Fields whose maintained value differed from the recomputed one."""
+    if before is None:
+        return {"manifest": "missing"}
+    return {
+        key: {"manifest": before[key], "actual": after[key]}
+        for key in ("count", "size_bytes", "oldest", "newest", "tags")
+        if before[key] != after[key]
+    }
+
+
+def _drop_sidecars(shard: str, memory_ids: List[str]):
+    """Drop entries from a shard's vector and fingerprint indexes."""
+    with _updating_vectors(shard) as vindex:
+        for memory_id in memory_ids:
+            _vector_remove(vindex, memory_id)
+    if _split_shard(shard)[0] in DEDUP_TYPES:
+        with _updating_fingerprints(shard) as findex:
+            for memory_id in memory_ids:
+                _fingerprint_remove(findex, memory_id)
+
+
+# ---------------------------------------------------------------------------
+# Access journal
+# ---------------------------------------------------------------------------
+
+def _journal_access(memory_type: str, memory_id: str):
+    """Append one access record (a single O_APPEND write, safe to race)."""
+    record = {"type": memory_type, "id": memory_id, "at": datetime.now().isoformat()}
+    fd = os.open(ACCESS_JOURNAL, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(record) + "\n").encode())
+    finally:
+        os.close(fd)
+
+
+def _read_access_journal(path: Path) -> Dict[tuple, Dict]:
+    """Aggregate a journal into {(type, id): {"count", "last"}}."""
+    pending = {}
+    try:
+        f = open(path, 'r')
+    except FileNotFoundError:
+        return pending
+
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Torn final line after a crash
+            access = pending.setdefault((record["type"], record["id"]), {"count": 0, "last": ""})
+            access["count"] += 1
+            access["last"] = max(access["last"], record["at"])
+    return pending
+
+
+def merge_access_journal() -> Dict:
+    """
+    Fold the access journal into the backend.
+
+    The journal is first renamed aside, so recalls keep appending to a
+    fresh file while the merge runs. A merge interrupted by a crash is
+    resumed from the renamed file on the next call.
+    """
+    merging = ACCESS_JOURNAL.with_suffix(".merging")
+    with _index_lock("access"):
+        if not merging.exists():
+            try:
+                os.replace(ACCESS_JOURNAL, merging)
+            except FileNotFoundError:
+                return {"merged": 0}
+
+        by_type = {}
+        for (memory_type, memory_id), access in _read_access_journal(merging).items():
+            by_type.setdefault(memory_type, {})[memory_id] = access
 
-IMLAZY_HOME = Path.home() / ".imlazy"
-MEMORY_DIRS = {
-    "working": IMLAZY_HOME / "working",
-    "episodic": IMLAZY_HOME / "episodic",
-    "semantic": IMLAZY_HOME / "semantic",
-    "procedural": IMLAZY_HOME / "procedural"
-}
+        backend = get_backend()
+        for memory_type, updates in by_type.items():
+            backend.apply_access(memory_type, updates)
+        merging.unlink()
 
+    if by_type:
+        # Access counts and ranking priors changed: cached results are stale
+        bump_generation()
+    return {"merged": sum(access["count"] for updates in by_type.values() for access in updates.values())}
 
-def ensure_dirs():
-    """Ensure all memory directories exist."""
-    for path in MEMORY_DIRS.values():
-        path.mkdir(parents=True, exist_ok=True)
 
+# ---------------------------------------------------------------------------
+# Query result cache
+# ---------------------------------------------------------------------------
+
+def store_generation() -> int:
+    """Counter bumped by every change to the stored entries (0 before the first)."""
+    try:
+        return int(GENERATION_FILE.read_text())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def bump_generation():
+    """Invalidate every cached search result."""
+    with _index_lock("generation"):
+        tmp_path = GENERATION_FILE.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(str(store_generation() + 1))
+        os.replace(tmp_path, GENERATION_FILE)
+    # Stale files would never be served again; don't let them pile up
+    for path in QUERY_CACHE_DIR.glob("*.json"):
+        path.unlink(missing_ok=True)
+
+
+def _query_key(tier: str, query: str, limit: int, rank: str, project: str, **extra) -> Dict:
+    """
+    Cache key of a search request. Term order and case don't change any
+    plain-query ranking, so such a query is its sorted terms (a structured
+    one its parsed form); the project is resolved.
+    """
+    return {
+        "backend": _backend_name(),
+        "tier": tier,
+        "query": parse_query(query) or sorted(tokenize(query)),
+        "limit": limit,
+        "rank": rank,
+        "project": project if project == "all" else _resolve_project(project),
+        **extra
+    }
 
-def generate_id(content: str) -> str:
-    """Generate a unique ID for a memory entry."""
-    timestamp = datetime.now().isoformat()
-    return hashlib.md5(f"{content}{timestamp}".encode()).hexdigest()[:12]
 
+def _cached_search(key: Dict, search) -> List[Dict]:
+    """Results of search() for `key`, from the cache while the store is unchanged."""
+    # Open the backend first: upgrading its schema invalidates the cache.
+    # Read before searching: a store racing the search leaves its result stale
+    get_backend()
+    generation = store_generation()
+    digest = hashlib.md5(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    path = QUERY_CACHE_DIR / f"{digest[:16]}.json"
+    try:
+        with open(path, 'r') as f:
+            cached = json.load(f)
+        if cached.get("generation") == generation and cached.get("key") == key:
+            return cached["results"]
+    except (json.JSONDecodeError, IOError):
+        pass
+
+    results = search()
+    QUERY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    _write_index_file(path, {"generation": generation, "key": key, "results": results})
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Commands
+# ---------------------------------------------------------------------------
+
+@lru_cache(maxsize=None)
+def _state_manager():
+    """state-manager.py as a module (hyphenated, so loaded by path), to read the working state."""
+    spec = importlib.util.spec_from_file_location(
+        "state_manager", Path(__file__).resolve().with_name("state-manager.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_working_state(full: bool = False) -> Optional[Dict]:
+    """
+    The working state as state-manager.py sees it (snapshot plus journal),
+    or None. `full` restores history items spilled to the episode archive.
+    """
+    try:
+        manager = _state_manager()
+        return manager.load_full_state() if full else manager.load_state()
+    except (json.JSONDecodeError, IOError):
+        return None
+
+
+def current_project_hash() -> str:
+    """The working state's project, else the hash of the project root containing the cwd."""
+    project = (load_working_state() or {}).get("project_hash")
+    return project or _state_manager().get_project_hash()
+
+
+def _resolve_project(project: Optional[str]) -> Optional[str]:
+    """Project hash for a --project value ("current" or a hash); None for none."""
+    if project in (None, "", "global"):
+        return None
+    if project == "current":
+        return current_project_hash()
+    if not PROJECT_RE.match(project):
+        raise ValueError(f"Invalid project hash: {project}")
+    return project
+
+
+def _select_shards(memory_type: str, project: str) -> List[str]:
+    """
+    Shards a search reads: for a sharded tier, the global shard plus the
+    chosen project's ("current" by default), or every shard for "all".
+    """
+    if memory_type not in SHARDED_TYPES:
+        return [memory_type]
+    existing = get_backend().shards(memory_type)
+    if project == "all":
+        return existing
+    project_hash = _resolve_project(project)
+    wanted = [memory_type] + ([f"{memory_type}/{project_hash}"] if project_hash else [])
+    return [shard for shard in wanted if shard in existing]
 
-def search_memory(memory_type: str, query: str, limit: int = 5) -> List[Dict]:
+
+def search_memory(memory_type: str, query: str, limit: int = 5, rank: str = "bm25",
+                  project: str = "current", cache: bool = True,
+                  filters: Dict = None, scoring: Dict = None) -> List[Dict]:
     """
     Search memories by type and query.
 
-    Simple keyword matching for now - could be enhanced with embeddings.
+    Query terms are matched against the backend's text index, so only the
+    returned entries are read. `rank` is "bm25" (default), "match" (count
+    of matched terms) or "vector" (offline character n-gram similarity).
+    `project` picks the episodic shards: "current" (default), "global",
+    "all" or a project hash; the global shard is always included.
+    `filters` (see _parse_filters) narrow the candidates through the tag,
+    outcome and date indexes before anything is scored; with an empty
+    query they list the matching entries, newest first.
+    Text scores are blended with recency, usage and outcome per `scoring`
+    (see _parse_scoring; default profile when None).
+    Long-term results are cached until the next store, prune or reindex
+    unless `cache` is False.
     """
     ensure_dirs()
 
     if memory_type not in MEMORY_DIRS:
         return {"error": f"Invalid memory type: {memory_type}"}
 
-    memory_dir = MEMORY_DIRS[memory_type]
-    results = []
+    if rank not in RANK_MODES:
+        return {"error": f"Invalid rank mode: {rank}. Valid: {RANK_MODES}"}
+
+    if memory_type == "working":
+        return _scan_search(query, limit)
+
+    scoring = scoring or _parse_scoring()
+    if not cache:
+        return _rounded(_search_tier(memory_type, query, limit, rank, project, filters, scoring))
+    return _cached_search(
+        _query_key(memory_type, query, limit, rank, project, filters=filters, scoring=scoring),
+        lambda: _rounded(_search_tier(memory_type, query, limit, rank, project, filters, scoring)))
+
+
+def _rounded(results: List[Dict], keys=("score",)) -> List[Dict]:
+    """Results with their scores rounded for output (backends return them unrounded)."""
+    return [{**result, **{key: round(result[key], 4) for key in keys}} for result in results]
+
+
+def _search_tier(memory_type: str, query: str, limit: int, rank: str, project: str,
+                 filters: Dict = None, scoring: Dict = None) -> List[Dict]:
+    """Search the selected shards of a tier and merge their hits."""
+    backend = get_backend()
+    shards = _select_shards(memory_type, project)
+    if len(shards) == 1:
+        return backend.search(shards[0], query, limit, rank, filters, scoring)
+
+    results = [result for shard in shards
+               for result in backend.search(shard, query, limit, rank, filters, scoring)]
+    results.sort(key=lambda result: (result["score"], result["entry"].get("created_at") or ""), reverse=True)
+    return results[:limit]
+
+
+def search_all(query: str, limit: int = 5, rank: str = "bm25",
+               quotas: Dict[str, int] = None, project: str = "current",
+               cache: bool = True, filters: Dict = None, scoring: Dict = None) -> List[Dict]:
+    """
+    Search every long-term tier concurrently and merge into one ranking.
 
-    query_lower = query.lower()
-    query_terms = query_lower.split()
+    Raw scores are not comparable across tiers: BM25 depends on each tier's
+    own statistics, so those are divided by the tier's best score. Match
+    scores become the fraction of query terms matched; vector scores are
+    already cosine similarities. `quotas` caps how many results each tier
+    may contribute (default: up to `limit` each). Cached and filtered like
+    search_memory.
+    """
+    ensure_dirs()
+
+    if rank not in RANK_MODES:
+        return {"error": f"Invalid rank mode: {rank}. Valid: {RANK_MODES}"}
+
+    quotas = quotas or {}
+    unknown = sorted(set(quotas) - set(LONG_TERM_TYPES))
+    if unknown:
+        return {"error": f"Invalid memory type in quotas: {unknown}. Valid: {LONG_TERM_TYPES}"}
+
+    scoring = scoring or _parse_scoring()
+    if not cache:
+        return _search_all(query, limit, rank, quotas, project, filters, scoring)
+    return _cached_search(
+        _query_key("all", query, limit, rank, project, quotas=quotas, filters=filters, scoring=scoring),
+        lambda: _search_all(query, limit, rank, quotas, project, filters, scoring))
+
+
+def _search_all(query: str, limit: int, rank: str, quotas: Dict[str, int], project: str,
+                filters: Dict = None, scoring: Dict = None) -> List[Dict]:
+    get_backend()  # Created once, before the workers share it
+    tiers = [tier for tier in LONG_TERM_TYPES if quotas.get(tier, limit) > 0]
+    with ThreadPoolExecutor(max_workers=max(len(tiers), 1)) as pool:
+        futures = {
+            tier: pool.submit(_search_tier, tier, query, quotas.get(tier, limit), rank, project,
+                              filters, scoring)
+            for tier in tiers
+        }
+        hits = {tier: future.result() for tier, future in futures.items()}
+
+    n_terms = len(query_terms(query)) or 1
+    merged = []
+    for tier, results in hits.items():
+        if not results:
+            continue
+        # Unrounded, so a tier of small BM25 scores doesn't normalize to 0
+        best = max(result["score"] for result in results) or 1
+        for result in results:
+            raw = result["score"]
+            if rank == "bm25":
+                score = raw / best
+            elif rank == "match":
+                score = min(raw / n_terms, 1.0)
+            else:
+                score = raw
+            merged.append({
+                "id": result["id"],
+                "type": tier,
+                "score": score,
+                "raw_score": raw,
+                "entry": result["entry"]
+            })
+
+    merged = _rounded(merged, ("score", "raw_score"))
+    merged.sort(
+        key=lambda item: (item["score"], item["raw_score"], item["entry"].get("created_at") or ""),
+        reverse=True
+    )
+    return merged[:limit]
+
+
+def _parse_quotas(value: Optional[str]) -> Dict[str, int]:
+    """--per-tier value: "N" for every tier, or "episodic=3,semantic=2"."""
+    if not value:
+        return {}
+    if "=" not in value:
+        return {tier: int(value) for tier in LONG_TERM_TYPES}
+    quotas = {}
+    for part in value.split(","):
+        tier, _, count = part.partition("=")
+        quotas[tier.strip()] = int(count)
+    return quotas
+
+
+def _parse_filters(tags: Optional[str] = None, since: Optional[str] = None,
+                   until: Optional[str] = None, outcome: Optional[str] = None) -> Optional[Dict]:
+    """
+    Search filters from CLI values: comma-separated tags (all required),
+    since/until as an ISO date(-time) prefix or an age ("7d", "12h"; until
+    is inclusive), and an episode outcome. None when nothing is set.
+    """
+    filters = {}
+    if tags:
+        filters["tags"] = sorted({tag.strip() for tag in tags.split(",") if tag.strip()})
+    for name, value in [("since", since), ("until", until)]:
+        if not value:
+            continue
+        age = FILTER_AGE_RE.match(value)
+        if age:
+            delta = timedelta(days=int(age.group(1))) if age.group(2) == "d" else timedelta(hours=int(age.group(1)))
+            # Minute precision keeps repeated relative filters cacheable
+            filters[name] = (datetime.now() - delta).isoformat(timespec="minutes")
+        elif FILTER_TIME_RE.match(value):
+            filters[name] = value.replace(" ", "T")
+        else:
+            raise ValueError(f"Invalid --{name} value: {value} (use YYYY-MM-DD[THH:MM] or Nd/Nh)")
+    if outcome:
+        filters["outcome"] = outcome
+    return filters or None
+
+
+def _scan_search(query: str, limit: int) -> List[Dict]:
+    """
+    Unindexed substring search over working memory: the state of every
+    namespace (snapshot plus journal), each with its namespace as id.
+    """
+    results = []
+    query_terms = query.lower().split()
+    manager = _state_manager()
+    load_working_state()  # Adopts a pre-namespace state.json
 
-    for file_path in memory_dir.glob("*.json"):
+    for file_path in manager.NAMESPACES_DIR.glob("*/state.json"):
         try:
-            with open(file_path, 'r') as f:
-                entry = json.load(f)
+            entry = manager.load_state(file_path.parent.name)
+            if entry is None:
+                continue
 
             # Score based on keyword matches
             searchable = json.dumps(entry, ensure_ascii=False).lower()
@@ -74,7 +3490,7 @@ def search_memory(memory_type: str, query: str, limit: int = 5) -> List[Dict]:
 
             if score > 0:
                 results.append({
-                    "id": file_path.stem,
+                    "id": file_path.parent.name,
                     "score": score,
                     "entry": entry
                 })
@@ -86,7 +3502,8 @@ def search_memory(memory_type: str, query: str, limit: int = 5) -> List[Dict]:
     return results[:limit]
 
 
-def store_memory(memory_type: str, content: str, tags: List[str] = None) -> Dict:
+def store_memory(memory_type: str, content: str, tags: List[str] = None,
+                 project: Optional[str] = None, dedup: bool = True) -> Dict:
     """
     Store a new memory entry.
 
@@ -102,54 +3519,210 @@ def store_memory(memory_type: str, content: str, tags: List[str] = None) -> Dict
     if memory_type == "working":
         return {"error": "Use state-manager.py for working memory"}
 
-    # Parse content if it's JSON
-    try:
-        if content.startswith('{') or content.startswith('['):
-            content_data = json.loads(content)
-        else:
-            content_data = {"content": content}
-    except json.JSONDecodeError:
-        content_data = {"content": content}
-
     memory_id = generate_id(content)
+    entry = _new_entry(memory_id, memory_type, _parse_content(content), tags,
+                       _resolve_project(project))
+
+    shard = _entry_shard(entry)
+    fingerprint = _entry_fingerprint(entry) if dedup and memory_type in DEDUP_TYPES else 0
+    if fingerprint:
+        # Held until the new entry is registered, so racing stores of the
+        # same text still merge
+        with _updating_fingerprints(shard) as findex:
+            duplicate = _find_duplicate(findex, memory_type, fingerprint, entry)
+            if duplicate is not None:
+                result = _merge_duplicate(duplicate, entry)
+                _fingerprint_add(findex, duplicate["id"], _entry_fingerprint(duplicate))
+                return result
+            _put_entry(entry)
+            _fingerprint_add(findex, memory_id, fingerprint)
+    else:
+        _put_entry(entry)
+
+    result = {"success": True, "id": memory_id, "type": memory_type}
+    if shard != memory_type:
+        result["project_hash"] = _split_shard(shard)[1]
+    return result
+
+
+def _new_entry(memory_id: str, memory_type: str, data, tags: List[str] = None,
+               project_hash: Optional[str] = None) -> Dict:
+    """A new, never-accessed entry (project_hash only applies to sharded tiers)."""
     entry = {
         "id": memory_id,
         "type": memory_type,
-        "data": content_data,
+        "data": data,
         "tags": tags or [],
         "created_at": datetime.now().isoformat(),
         "access_count": 0,
         "last_accessed": None
     }
+    if project_hash and memory_type in SHARDED_TYPES:
+        entry["project_hash"] = project_hash
+    return entry
+
+
+def _parse_content(content: str):
+    """Entry data from store content: parsed if it's JSON, else wrapped."""
+    try:
+        if content.startswith('{') or content.startswith('['):
+            return json.loads(content)
+    except json.JSONDecodeError:
+        pass
+    return {"content": content}
 
-    file_path = MEMORY_DIRS[memory_type] / f"{memory_id}.json"
-    with open(file_path, 'w') as f:
-        json.dump(entry, f, indent=2, ensure_ascii=False)
 
-    return {"success": True, "id": memory_id, "type": memory_type}
+def _put_entry(entry: Dict):
+    """Write an entry to the backend and its vector index."""
+    _put_entries(_entry_shard(entry), [entry])
 
 
-def recall_memory(memory_id: str) -> Dict:
-    """Recall a specific memory by ID and update access stats."""
-    ensure_dirs()
+def _put_entries(shard: str, entries: List[Dict]):
+    """Write a shard's entries to the backend and its vector index in one pass."""
+    # Vectors are locked first, so a missing index is rebuilt without them
+    with _updating_vectors(shard) as vindex:
+        get_backend().put_many(entries)
+        _vector_add_many(shard, vindex, entries)
+    bump_generation()
 
-    for memory_type, memory_dir in MEMORY_DIRS.items():
-        if memory_type == "working":
+
+def _find_duplicate(findex: Dict, memory_type: str, fingerprint: int, entry: Dict,
+                    pending: Dict[str, Dict] = None,
+                    wording: Dict[str, List[str]] = None) -> Optional[Dict]:
+    """
+    The nearest near-duplicate of `entry` (from `pending`, entries of the
+    batch being written, or the backend) whose wording is confirmed
+    similar, dropping fingerprints of deleted entries. `wording` caches
+    candidates' tokens across a batch (see _similar_wording).
+    """
+    backend = get_backend()
+    similar = None
+    for memory_id in _near_duplicates(findex, fingerprint):
+        candidate = (pending or {}).get(memory_id) or backend.get(memory_type, memory_id)
+        if candidate is None:
+            _fingerprint_remove(findex, memory_id)
             continue
+        similar = similar or _similar_wording(entry, wording)
+        if similar(candidate):
+            return candidate
+    return None
 
-        file_path = memory_dir / f"{memory_id}.json"
-        if file_path.exists():
-            with open(file_path, 'r') as f:
-                entry = json.load(f)
 
-            # Update access stats
-            entry["access_count"] = entry.get("access_count", 0) + 1
-            entry["last_accessed"] = datetime.now().isoformat()
+def _fold_duplicate(existing: Dict, entry: Dict):
+    """
+    Count a near-duplicate against the stored entry and union the tags.
+    Wording that still differs is replaced by the newer entry's data.
+    """
+    existing["tags"] = existing.get("tags", []) + [
+        tag for tag in entry["tags"] if tag not in existing.get("tags", [])
+    ]
+    existing["duplicate_count"] = existing.get("duplicate_count", 0) + 1 + entry.get("duplicate_count", 0)
+    if entry.get("data") != existing.get("data"):
+        existing["data"] = entry["data"]
+
+
+def _merge_duplicate(existing: Dict, entry: Dict) -> Dict:
+    """Fold a near-duplicate into the stored entry and write it back."""
+    _fold_duplicate(existing, entry)
+    _put_entry(existing)
+    return {
+        "success": True,
+        "id": existing["id"],
+        "type": existing["type"],
+        "merged": True,
+        "duplicate_count": existing["duplicate_count"]
+    }
+
+
+def store_batch(entries: Iterable[Dict], dedup: bool = True, idempotent: bool = False) -> Dict:
+    """
+    Store prepared entries, IMPORT_BATCH_SIZE at a time.
+
+    Each batch writes its entries, then updates every touched shard's text,
+    vector and fingerprint index once. Near-duplicates merge as in
+    store_memory, including duplicates within the batch; an entry whose id
+    is already stored replaces it instead.
+
+    With `idempotent` (entries under derived ids), a merged entry's id is
+    recorded in the target's `merged_from`, and an entry already recorded
+    there is not merged again, so re-running the same batch changes nothing.
+    """
+    stored, merged = Counter(), Counter()
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            _store_batch(batch, dedup, stored, merged, idempotent)
+            batch = []
+    if batch:
+        _store_batch(batch, dedup, stored, merged, idempotent)
+    return {"stored": dict(stored), "merged": dict(merged)}
+
 
-            with open(file_path, 'w') as f:
-                json.dump(entry, f, indent=2, ensure_ascii=False)
+def _store_batch(batch: List[Dict], dedup: bool, stored: Counter, merged: Counter,
+                 idempotent: bool = False):
+    by_shard = {}
+    for entry in batch:
+        by_shard.setdefault(_entry_shard(entry), {})[entry["id"]] = entry
 
-            return entry
+    backend = get_backend()
+    for shard, entries in by_shard.items():
+        memory_type = _split_shard(shard)[0]
+        if not (dedup and memory_type in DEDUP_TYPES):
+            _put_entries(shard, list(entries.values()))
+            stored[memory_type] += len(entries)
+            continue
+
+        with _updating_fingerprints(shard) as findex:
+            pending, wording = {}, {}
+            fingerprints = _entry_fingerprints(list(entries.values()))
+            for entry, fingerprint in zip(entries.values(), fingerprints):
+                replacing = entry["id"] in findex["fingerprints"]
+                duplicate = None
+                if fingerprint and not replacing:
+                    duplicate = _find_duplicate(findex, memory_type, fingerprint, entry, pending, wording)
+                if duplicate is None:
+                    pending[entry["id"]] = entry
+                    if fingerprint:
+                        _fingerprint_add(findex, entry["id"], fingerprint)
+                    stored[memory_type] += 1
+                else:
+                    merged[memory_type] += 1
+                    if idempotent:
+                        if entry["id"] in duplicate.get("merged_from", []):
+                            continue  # Folded in by an earlier, interrupted run
+                        duplicate["merged_from"] = duplicate.get("merged_from", []) + [entry["id"]]
+                    _fold_duplicate(duplicate, entry)
+                    wording.pop(duplicate["id"], None)
+                    _fingerprint_add(findex, duplicate["id"], _entry_fingerprint(duplicate))
+                    pending[duplicate["id"]] = duplicate
+            _put_entries(shard, list(pending.values()))
+
+
+def recall_memory(memory_id: str) -> Dict:
+    """
+    Recall a specific memory by ID and record the access.
+
+    The entry itself is only read; the access goes to the journal and the
+    returned stats include accesses not merged yet.
+    """
+    ensure_dirs()
+
+    backend = get_backend()
+    for memory_type in LONG_TERM_TYPES:
+        entry = backend.get(memory_type, memory_id)
+        if entry is None:
+            continue
+
+        _journal_access(memory_type, memory_id)
+        pending = _read_access_journal(ACCESS_JOURNAL).get((memory_type, memory_id))
+        if pending:
+            entry["access_count"] = entry.get("access_count", 0) + pending["count"]
+            entry["last_accessed"] = pending["last"]
+
+        if ACCESS_JOURNAL.stat().st_size > ACCESS_JOURNAL_MAX_BYTES:
+            merge_access_journal()
+        return entry
 
     return {"error": f"Memory not found: {memory_id}"}
 
@@ -160,20 +3733,44 @@ def consolidate_working() -> Dict:
 
     Called when an episode completes successfully.
     Extracts key learnings and stores them.
+
+    The episode and its procedural learnings are written as one batch
+    (store_batch) under IDs derived from the episode_id. The episode entry
+    goes last and marks the episode consolidated: a retry after success is a
+    no-op, and a retry after a crash rewrites the same entries in place
+    (learnings merged into existing entries are recorded in their
+    `merged_from`, so they are not merged twice).
     """
     ensure_dirs()
 
-    state_file = MEMORY_DIRS["working"] / "state.json"
-    if not state_file.exists():
+    state = load_working_state(full=True)
+    if state is None:
         return {"error": "No working memory to consolidate"}
 
-    with open(state_file, 'r') as f:
-        state = json.load(f)
-
     # Only consolidate if there's meaningful content
     if not state.get("user_query") or not state.get("selected_solution"):
         return {"error": "Working memory incomplete, nothing to consolidate"}
 
+    episode_id = state["episode_id"]
+    episodic_id = derived_id("episode", episode_id)
+    if get_backend().get("episodic", episodic_id) is not None:
+        return {
+            "success": True,
+            "episodic_id": episodic_id,
+            "already_consolidated": True,
+            "message": "Episode already consolidated"
+        }
+
+    # Extract any procedural learnings
+    entries = []
+    for number, critique in enumerate(state.get("critiques") or []):
+        if isinstance(critique, dict) and critique.get("correction"):
+            entries.append(_new_entry(derived_id("learning", episode_id, str(number)), "procedural", {
+                "learning": critique["correction"],
+                "context": critique.get("root_cause", ""),
+                "source_episode": episode_id
+            }, ["learning", "correction"]))
+
     # Create episodic entry
     episode = {
         "user_query": state["user_query"],
@@ -183,25 +3780,21 @@ def consolidate_working() -> Dict:
         "critiques": state.get("critiques", []),
         "test_results": state.get("test_results", {}),
         "outcome": "success" if not state.get("error_log") else "partial",
-        "episode_id": state["episode_id"],
+        "episode_id": episode_id,
         "project_hash": state["project_hash"]
     }
+    entries.append(_new_entry(episodic_id, "episodic", episode, ["episode"],
+                              _resolve_project(state.get("project_hash") or None)))
 
-    result = store_memory("episodic", json.dumps(episode), tags=["episode"])
+    result = store_batch(entries, idempotent=True)
 
-    # Extract any procedural learnings
-    if state.get("critiques"):
-        for critique in state["critiques"]:
-            if isinstance(critique, dict) and critique.get("correction"):
-                store_memory("procedural", json.dumps({
-                    "learning": critique["correction"],
-                    "context": critique.get("root_cause", ""),
-                    "source_episode": state["episode_id"]
-                }), tags=["learning", "correction"])
+    _auto_compact()
 
     return {
         "success": True,
-        "episodic_id": result["id"],
+        "episodic_id": episodic_id,
+        "learnings": result["stored"].get("procedural", 0),
+        "merged": result["merged"].get("procedural", 0),
         "message": "Working memory consolidated to episodic"
     }
 
@@ -215,24 +3808,36 @@ def _summarize_trace(trace: List) -> List[str]:
     return summary[-10:]  # Keep last 10 transitions
 
 
-def get_stats() -> Dict:
-    """Get statistics about the memory system."""
+def get_stats(verify: bool = False) -> Dict:
+    """
+    Get statistics about the memory system.
+
+    Long-term tiers are read from their maintained manifests; `verify`
+    recomputes those from the stored entries and reports any drift.
+    """
     ensure_dirs()
 
+    backend = get_backend()
     stats = {
         "memory_home": str(IMLAZY_HOME),
+        "backend": backend.name,
         "types": {}
     }
 
-    for memory_type, memory_dir in MEMORY_DIRS.items():
-        files = list(memory_dir.glob("*.json"))
-        total_size = sum(f.stat().st_size for f in files)
-
-        stats["types"][memory_type] = {
-            "count": len(files),
-            "size_bytes": total_size,
-            "size_human": _human_size(total_size)
-        }
+    for memory_type in MEMORY_DIRS:
+        if memory_type == "working":
+            # One state.json per namespace; size covers journals and archives too
+            files = [path for path in MEMORY_DIRS[memory_type].rglob("*") if path.is_file()]
+            tier = {"count": sum(1 for path in files if path.name == "state.json"),
+                    "size_bytes": sum(f.stat().st_size for f in files)}
+        elif verify:
+            tier = backend.verify_stats(memory_type)
+        else:
+            tier = backend.stats(memory_type)
+        tier["size_human"] = _human_size(tier["size_bytes"])
+        if memory_type in SHARDED_TYPES:
+            tier["projects"] = len(backend.shards(memory_type)) - 1
+        stats["types"][memory_type] = tier
 
     return stats
 
@@ -246,31 +3851,374 @@ def _human_size(size_bytes: int) -> str:
     return f"{size_bytes:.1f} TB"
 
 
-def prune_old(days: int = 30) -> Dict:
-    """Prune memories older than specified days with zero access."""
+def _parse_time(value: Optional[str]) -> datetime:
+    try:
+        return datetime.fromisoformat(value) if value else datetime(2000, 1, 1)
+    except ValueError:
+        return datetime(2000, 1, 1)
+
+
+def _retention_key(meta: Dict, policy: str, half_life_days: float, now: datetime):
+    """Sort key where lower means evicted first."""
+    last_used = _parse_time(meta["last_accessed"] or meta["created_at"])
+    if policy == "lru":
+        return (last_used,)
+    if policy == "lfu":
+        return (meta["access_count"], last_used)
+    # decay: usage that fades with a half-life since last use
+    age_days = max((now - last_used).total_seconds() / 86400, 0.0)
+    return ((1 + meta["access_count"]) * 0.5 ** (age_days / half_life_days), last_used)
+
+
+def _select_evictions(metadata: List[Dict], max_entries: Optional[int], max_bytes: Optional[int],
+                      policy: str, half_life_days: float) -> List[str]:
+    """Ids to evict, in policy order, until the tier fits its quotas."""
+    now = datetime.now()
+    order = sorted(metadata, key=lambda meta: _retention_key(meta, policy, half_life_days, now))
+
+    count = len(order)
+    total_bytes = sum(meta["size"] for meta in order)
+    evicted = []
+    for meta in order:
+        over_count = max_entries is not None and count > max_entries
+        over_bytes = max_bytes is not None and total_bytes > max_bytes
+        if not (over_count or over_bytes):
+            break
+        evicted.append(meta["id"])
+        count -= 1
+        total_bytes -= meta["size"]
+    return evicted
+
+
+def prune_old(days: Optional[int] = 30, max_entries: Optional[int] = None,
+              max_bytes: Optional[int] = None, policy: str = "lru",
+              half_life_days: float = 30) -> Dict:
+    """
+    Prune memories older than `days` with zero access, then evict by policy
+    until each tier holds at most `max_entries` entries / `max_bytes` bytes.
+
+    Decisions use the backend's metadata (index or indexed columns), never
+    the entries themselves. Pass days=None to skip the age rule.
+    """
     ensure_dirs()
 
-    cutoff = datetime.now() - timedelta(days=days)
+    if policy not in EVICTION_POLICIES:
+        return {"error": f"Invalid eviction policy: {policy}. Valid: {EVICTION_POLICIES}"}
+
+    # Pending accesses must count before deciding what is unused
+    merge_access_journal()
+
+    backend = get_backend()
+    cutoff = datetime.now() - timedelta(days=days) if days is not None else None
     pruned = {"episodic": 0, "semantic": 0, "procedural": 0}
+    evicted = {"episodic": 0, "semantic": 0, "procedural": 0}
+
+    for memory_type in LONG_TERM_TYPES:
+        # Quotas apply to the whole tier, across its project shards
+        shard_of = {}
+        metadata = []
+        for shard in backend.shards(memory_type):
+            for meta in backend.metadata(shard):
+                shard_of[meta["id"]] = shard
+                metadata.append(meta)
+
+        # Prune if old and never accessed
+        expired = set()
+        if cutoff is not None:
+            expired = {
+                meta["id"] for meta in metadata
+                if _parse_time(meta["created_at"]) < cutoff and meta["access_count"] == 0
+            }
+        remaining = [meta for meta in metadata if meta["id"] not in expired]
+
+        over_quota = []
+        if max_entries is not None or max_bytes is not None:
+            over_quota = _select_evictions(remaining, max_entries, max_bytes, policy, half_life_days)
+
+        by_shard = {}
+        for memory_id in list(expired) + over_quota:
+            by_shard.setdefault(shard_of[memory_id], []).append(memory_id)
+        for shard, removed in by_shard.items():
+            backend.delete(shard, removed)
+            _drop_sidecars(shard, removed)
+        pruned[memory_type] = len(expired)
+        evicted[memory_type] = len(over_quota)
+
+    if any(pruned.values()) or any(evicted.values()):
+        bump_generation()
+    _auto_compact()
+
+    result = {"pruned": pruned, "cutoff_days": days}
+    if max_entries is not None or max_bytes is not None:
+        result.update({
+            "evicted": evicted,
+            "policy": policy,
+            "max_entries": max_entries,
+            "max_bytes": max_bytes
+        })
+    return result
+
+
+def reindex(memory_type: Optional[str] = None) -> Dict:
+    """Rebuild the text and vector indexes of one or all tiers."""
+    ensure_dirs()
+
+    if memory_type is not None and memory_type not in LONG_TERM_TYPES:
+        return {"error": f"Invalid memory type: {memory_type}"}
+
+    merge_access_journal()
+
+    backend = get_backend()
+    indexed = {}
+    for tier in [memory_type] if memory_type else LONG_TERM_TYPES:
+        indexed[tier] = backend.reindex(tier)
+        indexed[tier]["vectors"] = 0
+        for shard in backend.shards(tier):
+            with _index_lock(f"{shard}.vectors"):
+                vindex = _build_vector_index(shard)
+            indexed[tier]["vectors"] += len(vindex["rows"])
+            if tier in DEDUP_TYPES:
+                with _index_lock(f"{shard}.simhash"):
+                    findex = _build_fingerprint_index(shard)
+                indexed[tier]["fingerprints"] = indexed[tier].get("fingerprints", 0) + len(findex["fingerprints"])
+
+    bump_generation()
+    return {"success": True, "backend": get_backend().name, "indexed": indexed}
+
+
+def compact_memory(memory_type: Optional[str] = None, days: float = SEGMENT_COLD_DAYS,
+                   min_batch: int = 1) -> Dict:
+    """
+    Pack loose entries unused for `days` into compressed segments.
+
+    Packed entries stay readable by every command; a recall or merge that
+    rewrites one writes it back out as a loose file. Segments that become
+    mostly dead are rewritten. Only the files backend stores loose entries.
+    """
+    ensure_dirs()
+
+    if memory_type is not None and memory_type not in LONG_TERM_TYPES:
+        return {"error": f"Invalid memory type: {memory_type}"}
+
+    # Recency must include recalls still in the journal
+    merge_access_journal()
 
-    for memory_type in ["episodic", "semantic", "procedural"]:
-        memory_dir = MEMORY_DIRS[memory_type]
-        for file_path in memory_dir.glob("*.json"):
+    backend = get_backend()
+    cutoff = datetime.now() - timedelta(days=days)
+    compacted = {
+        tier: backend.compact(tier, cutoff, min_batch)
+        for tier in ([memory_type] if memory_type else LONG_TERM_TYPES)
+    }
+    (INDEX_DIR / "compact.stamp").touch()
+    return {"success": True, "backend": backend.name, "cold_days": days, "compacted": compacted}
+
+
+def _auto_compact():
+    """Compact cold tiers at most once per COMPACT_INTERVAL."""
+    if get_backend().name != "files":
+        return
+    try:
+        last = datetime.fromtimestamp((INDEX_DIR / "compact.stamp").stat().st_mtime)
+        if datetime.now() - last < COMPACT_INTERVAL:
+            return
+    except FileNotFoundError:
+        pass
+    compact_memory(min_batch=SEGMENT_MIN_BATCH)
+
+
+def merge_index_logs(memory_type: Optional[str] = None, shard: Optional[str] = None) -> Dict:
+    """
+    Fold the text index delta logs and vector / fingerprint change logs of
+    one shard, one tier or every tier into their bases. Stores start this
+    in the background once a log grows past INDEX_LOG_MAX_BYTES.
+    """
+    ensure_dirs()
+
+    if shard is not None:
+        memory_type, project = _split_shard(shard)
+        if project is not None and not PROJECT_RE.match(project):
+            return {"error": f"Invalid shard: {shard}"}
+    if memory_type is not None and memory_type not in LONG_TERM_TYPES:
+        return {"error": f"Invalid memory type: {memory_type}"}
+
+    backend = get_backend()
+    merged = []
+    for tier in [memory_type] if memory_type else LONG_TERM_TYPES:
+        for name in [shard] if shard else backend.shards(tier):
+            folded = backend.name == "files" and merge_index(name)
+            folded = _fold_sidecar(_vector_index_path(name), VECTOR_INDEX_VERSION, f"{name}.vectors") or folded
+            if tier in DEDUP_TYPES:
+                folded = _fold_sidecar(_fingerprint_path(name), FINGERPRINT_INDEX_VERSION,
+                                       f"{name}.simhash") or folded
+            if folded:
+                merged.append(name)
+    return {"success": True, "backend": backend.name, "merged": merged}
+
+
+def migrate_memory() -> Dict:
+    """
+    One-shot copy of the JSON file layout into the SQLite database.
+
+    Ids are kept, so the vector index stays valid. Re-running replaces
+    entries already migrated. The JSON files are left in place; once the
+    database exists it becomes the default backend.
+    """
+    ensure_dirs()
+    merge_access_journal()
+
+    files = FileBackend()
+    database = SQLiteBackend()
+    migrated = {}
+
+    with database.conn:
+        for memory_type in LONG_TERM_TYPES:
+            migrated[memory_type] = 0
+            for shard in files.shards(memory_type):
+                for entry in files.entries(shard):
+                    entry.setdefault("type", memory_type)
+                    database._insert(entry)
+                    migrated[memory_type] += 1
+
+    bump_generation()
+    return {"success": True, "database": str(database.path), "migrated": migrated}
+
+
+def _read_jsonl(source: str) -> Iterable[tuple]:
+    """Yield (line number, value or None if unparsable) from a JSONL file or stdin ("-")."""
+    f = sys.stdin if source == "-" else open(source, 'r')
+    try:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
             try:
-                with open(file_path, 'r') as f:
-                    entry = json.load(f)
+                yield number, json.loads(line)
+            except json.JSONDecodeError:
+                yield number, None
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _import_entry(record, default_type: Optional[str], number: int) -> Optional[Dict]:
+    """
+    An entry from an import record: an exported entry, or a minimal
+    {"type", "content" or "data", "tags"} object. None if it is invalid.
+    """
+    if not isinstance(record, dict):
+        return None
+    memory_type = record.get("type") or default_type
+    tags = record.get("tags") or []
+    if memory_type not in LONG_TERM_TYPES or not isinstance(tags, list):
+        return None
+
+    if "data" in record:
+        data = record["data"]
+    elif "content" in record:
+        content = record["content"]
+        data = _parse_content(content) if isinstance(content, str) else content
+    else:
+        return None
+
+    memory_id = record.get("id") or generate_id(f"{number}:{json.dumps(data, sort_keys=True)}")
+    if not isinstance(memory_id, str) or not ID_RE.match(memory_id):
+        return None
 
-                created = datetime.fromisoformat(entry.get("created_at", "2000-01-01"))
-                access_count = entry.get("access_count", 0)
+    entry = {
+        "id": memory_id,
+        "type": memory_type,
+        "data": data,
+        "tags": [str(tag) for tag in tags],
+        "created_at": record.get("created_at") or datetime.now().isoformat(),
+        "access_count": int(record.get("access_count") or 0),
+        "last_accessed": record.get("last_accessed")
+    }
+    project = record.get("project_hash")
+    if memory_type in SHARDED_TYPES and isinstance(project, str) and PROJECT_RE.match(project):
+        entry["project_hash"] = project
+    if record.get("duplicate_count"):
+        entry["duplicate_count"] = int(record["duplicate_count"])
+    if isinstance(record.get("merged_from"), list):
+        entry["merged_from"] = [str(merged_id) for merged_id in record["merged_from"]]
+    return entry
+
+
+def import_memory(source: str = "-", default_type: Optional[str] = None,
+                  dedup: bool = True) -> Dict:
+    """
+    Stream JSONL records into the store in batches (see store_batch).
+
+    Records are exported entries (ids and stats are kept, so an export
+    re-imports as-is) or {"type", "content"/"data", "tags"} objects.
+    Invalid lines are skipped and reported.
+    """
+    if default_type is not None and default_type not in LONG_TERM_TYPES:
+        return {"error": f"Invalid memory type: {default_type}"}
+    return _import_records(_read_jsonl(source), default_type, {}, dedup)
+
+
+def store_memory_batch(memory_type: str, source: str, tags: List[str] = None,
+                       project: Optional[str] = None, dedup: bool = True) -> Dict:
+    """Batch `store`: one content per JSONL line (a JSON value, or a string parsed like CONTENT)."""
+    if memory_type not in LONG_TERM_TYPES:
+        return {"error": f"Invalid memory type: {memory_type}"}
+
+    defaults = {"tags": tags or []}
+    project_hash = _resolve_project(project)
+    if project_hash:
+        defaults["project_hash"] = project_hash
+    records = ((number, None if value is None else {"content": value})
+               for number, value in _read_jsonl(source))
+    return _import_records(records, memory_type, defaults, dedup)
+
+
+def _import_records(records: Iterable[tuple], default_type: Optional[str],
+                    defaults: Dict, dedup: bool) -> Dict:
+    ensure_dirs()
+    skipped = []
 
-                # Prune if old and never accessed
-                if created < cutoff and access_count == 0:
-                    file_path.unlink()
-                    pruned[memory_type] += 1
-            except (json.JSONDecodeError, IOError, ValueError):
+    def entries():
+        for number, record in records:
+            if isinstance(record, dict):
+                record = {**defaults, **record}
+            entry = _import_entry(record, default_type, number)
+            if entry is None:
+                skipped.append(number)
                 continue
+            yield entry
 
-    return {"pruned": pruned, "cutoff_days": days}
+    result = store_batch(entries(), dedup)
+    return {"success": True, **result, "skipped": len(skipped), "skipped_lines": skipped[:20]}
+
+
+def export_memory(memory_type: Optional[str] = None, project: str = "all", output=None) -> Dict:
+    """Write entries as JSONL (one full entry per line) to `output` (a file object)."""
+    ensure_dirs()
+
+    if memory_type is not None and memory_type not in LONG_TERM_TYPES:
+        return {"error": f"Invalid memory type: {memory_type}"}
+
+    # Exported access counts include recalls still in the journal
+    merge_access_journal()
+
+    backend = get_backend()
+    exported = {}
+    for tier in [memory_type] if memory_type else LONG_TERM_TYPES:
+        exported[tier] = 0
+        for shard in _select_shards(tier, project):
+            for entry in backend.entries(shard):
+                output.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                exported[tier] += 1
+    return {"success": True, "exported": exported}
+
+
+def _option(name: str, default=None):
+    """Value following a --flag in argv, or default."""
+    if name in sys.argv:
+        idx = sys.argv.index(name)
+        if idx + 1 < len(sys.argv):
+            return sys.argv[idx + 1]
+    return default
 
 
 def main():
@@ -283,7 +4231,7 @@ def main():
     try:
         if cmd == "search":
             if len(sys.argv) < 4:
-                result = {"error": "Usage: memory-manager.py search TYPE QUERY [--limit N]"}
+                result = {"error": "Usage: memory-manager.py search TYPE|all QUERY [--limit N] [--rank bm25|match|vector] [--per-tier N|TYPE=N,...] [--project current|all|global|HASH] [--tags T1,T2] [--since DATE|Nd] [--until DATE|Nd] [--outcome OUTCOME] [--scoring PROFILE|KEY=N,...] [--no-cache]"}
             else:
                 memory_type = sys.argv[2]
                 query = sys.argv[3]
@@ -292,11 +4240,26 @@ def main():
                     idx = sys.argv.index("--limit")
                     if idx + 1 < len(sys.argv):
                         limit = int(sys.argv[idx + 1])
-                result = search_memory(memory_type, query, limit)
+                rank = "bm25"
+                if "--rank" in sys.argv:
+                    idx = sys.argv.index("--rank")
+                    if idx + 1 < len(sys.argv):
+                        rank = sys.argv[idx + 1]
+                project = _option("--project", "current")
+                cache = "--no-cache" not in sys.argv
+                filters = _parse_filters(_option("--tags"), _option("--since"),
+                                         _option("--until"), _option("--outcome"))
+                scoring = _parse_scoring(_option("--scoring"))
+                if memory_type == "all":
+                    result = search_all(query, limit, rank, _parse_quotas(_option("--per-tier")),
+                                        project, cache, filters, scoring)
+                else:
+                    result = search_memory(memory_type, query, limit, rank, project, cache,
+                                           filters, scoring)
 
         elif cmd == "store":
             if len(sys.argv) < 4:
-                result = {"error": "Usage: memory-manager.py store TYPE CONTENT [--tags TAG1,TAG2]"}
+                result = {"error": "Usage: memory-manager.py store TYPE CONTENT [--tags TAG1,TAG2] [--project current|HASH]"}
             else:
                 memory_type = sys.argv[2]
                 content = sys.argv[3]
@@ -305,7 +4268,12 @@ def main():
                     idx = sys.argv.index("--tags")
                     if idx + 1 < len(sys.argv):
                         tags = sys.argv[idx + 1].split(",")
-                result = store_memory(memory_type, content, tags)
+                if "--batch" in sys.argv:
+                    result = store_memory_batch(memory_type, _option("--batch", "-"), tags,
+                                                _option("--project"), dedup="--no-dedup" not in sys.argv)
+                else:
+                    result = store_memory(memory_type, content, tags, _option("--project"),
+                                          dedup="--no-dedup" not in sys.argv)
 
         elif cmd == "recall":
             if len(sys.argv) < 3:
@@ -317,15 +4285,53 @@ def main():
             result = consolidate_working()
 
         elif cmd == "stats":
-            result = get_stats()
+            result = get_stats(verify="--verify" in sys.argv)
 
         elif cmd == "prune":
-            days = 30
-            if "--days" in sys.argv:
-                idx = sys.argv.index("--days")
-                if idx + 1 < len(sys.argv):
-                    days = int(sys.argv[idx + 1])
-            result = prune_old(days)
+            max_entries = _option("--max-entries")
+            max_bytes = _option("--max-bytes")
+            days = _option("--days")
+            # Quota-only runs skip the age rule unless --days is given too
+            if days is None and max_entries is None and max_bytes is None:
+                days = 30
+            result = prune_old(
+                days=int(days) if days is not None else None,
+                max_entries=int(max_entries) if max_entries is not None else None,
+                max_bytes=int(max_bytes) if max_bytes is not None else None,
+                policy=_option("--policy", "lru"),
+                half_life_days=float(_option("--half-life", 30))
+            )
+
+        elif cmd == "reindex":
+            result = reindex(sys.argv[2] if len(sys.argv) > 2 else None)
+
+        elif cmd == "compact":
+            memory_type = sys.argv[2] if len(sys.argv) > 2 and not sys.argv[2].startswith("--") else None
+            result = compact_memory(memory_type, float(_option("--days", SEGMENT_COLD_DAYS)))
+
+        elif cmd == "merge":
+            memory_type = sys.argv[2] if len(sys.argv) > 2 and not sys.argv[2].startswith("--") else None
+            result = merge_index_logs(memory_type, _option("--shard"))
+
+        elif cmd == "migrate":
+            result = migrate_memory()
+
+        elif cmd == "import":
+            source = sys.argv[2] if len(sys.argv) > 2 and not sys.argv[2].startswith("--") else "-"
+            result = import_memory(source, _option("--type"), dedup="--no-dedup" not in sys.argv)
+
+        elif cmd == "export":
+            memory_type = sys.argv[2] if len(sys.argv) > 2 and not sys.argv[2].startswith("--") else None
+            project = _option("--project", "all")
+            output_path = _option("--output")
+            if output_path is None:
+                # Entries go to stdout, so the summary goes to stderr
+                result = export_memory(memory_type, project, sys.stdout)
+                print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+                return
+            with open(output_path, 'w') as output:
+                result = export_memory(memory_type, project, output)
+            result["output"] = output_path
 
         else:
             result = {"error": f"Unknown command: {cmd}"}
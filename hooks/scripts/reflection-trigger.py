@@ -15,13 +15,13 @@ Usage (in hooks.json):
   }
 """
 
+import importlib.util
 import json
 import os
 import sys
 from pathlib import Path
 
-IMLAZY_HOME = Path.home() / ".imlazy"
-STATE_FILE = IMLAZY_HOME / "working" / "state.json"
+SCRIPT_DIR = Path(__file__).resolve().parent
 
 # Patterns that indicate test failures
 FAILURE_PATTERNS = [
@@ -51,18 +51,35 @@ SUCCESS_PATTERNS = [
 ]
 
 
-def load_state():
-    """Load current cognitive state."""
-    if STATE_FILE.exists():
-        with open(STATE_FILE, 'r') as f:
-            return json.load(f)
-    return None
+def load_state_manager():
+    """Import state-manager.py (hyphenated, so not importable by name)."""
+    spec = importlib.util.spec_from_file_location("state_manager", SCRIPT_DIR / "state-manager.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
 
+state_manager = load_state_manager()
 
-def save_state(state):
-    """Save cognitive state."""
-    with open(STATE_FILE, 'w') as f:
-        json.dump(state, f, indent=2, ensure_ascii=False)
+
+def select_namespace(payload: dict):
+    """
+    Point state_manager at the working state of the session that ran the
+    tool: IMLAZY_NAMESPACE if set, the payload's session id with
+    IMLAZY_SESSION_STATE=1, else the hash of the project containing the
+    payload's cwd.
+    """
+    if os.environ.get("IMLAZY_NAMESPACE"):
+        return
+    if os.environ.get("IMLAZY_SESSION_STATE") == "1" and payload.get("session_id"):
+        os.environ["IMLAZY_NAMESPACE"] = str(payload["session_id"])
+    elif payload.get("cwd"):
+        os.environ["IMLAZY_NAMESPACE"] = state_manager.get_project_hash(payload["cwd"])
+
+
+def load_state():
+    """Load current cognitive state (snapshot plus journal)."""
+    return state_manager.load_state()
 
 
 def check_for_failures(output: str) -> bool:
@@ -111,11 +128,8 @@ def record_failure(state: dict, failure_info: dict, tool_result: str):
         "from_node": state.get("current_node", "unknown")
     }
 
-    if "error_log" not in state:
-        state["error_log"] = []
-
-    state["error_log"].append(error_entry)
-    save_state(state)
+    # One journal append, retried if an agent write lands first (no lost updates)
+    state_manager.update_value("error_log", error_entry)
 
 
 def main():
@@ -134,6 +148,12 @@ def main():
         print(json.dumps({"status": "skip", "reason": "No tool output"}))
         return
 
+    try:
+        payload = json.loads(tool_result)
+    except json.JSONDecodeError:
+        payload = None
+    select_namespace(payload if isinstance(payload, dict) else {})
+
     state = load_state()
     if not state:
         # No active cognitive state
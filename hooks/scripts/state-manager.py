@@ -11,21 +11,94 @@ Usage:
   state-manager.py set KEY VALUE
   state-manager.py update KEY VALUE  # For appending to lists
   state-manager.py transition NODE
+  state-manager.py batch [FILE|-]  # Ops from JSON/JSONL, applied atomically (alias: apply)
   state-manager.py reset
-  state-manager.py dump
+  state-manager.py dump [--full]  # --full: include archived history items
+  state-manager.py episodes  # Registry of episodes across namespaces
+  state-manager.py checkpoints  # Checkpoints of this episode (one per transition)
+  state-manager.py rollback N  # Restore checkpoint N (as a new transition)
+  state-manager.py diff A B  # Keys that differ between checkpoints A and B
+  state-manager.py watch [--keys K1,K2] [--once] [--timeout SECONDS] [--poll]
+                         # Stream change/transition events as JSON lines
+
+Every command takes --namespace NS (or IMLAZY_NAMESPACE=NS). The default
+namespace is the hash of the project root (git top level, or a directory
+with a registered episode) containing the cwd, so sessions in different
+repos keep separate states under working/ns/<namespace>/.
+
+Each committed change bumps the state's `version`. Writers stage their ops
+without holding a lock and commit only if the version is still the one
+they read, retrying on a conflict. set/update/transition/batch take
+--expect-version N to fail instead when the state has moved past N.
+
+Storage: state.json is a snapshot; each set/update/transition/batch appends
+one record of its ops to state.journal, replayed on load. A transition (or
+a journal past JOURNAL_MAX_BYTES) folds the journal into a new snapshot.
+History lists (HISTORY_LIMITS) keep their newest items inline; older ones
+spill to the episode's archive when a snapshot is written.
+
+Commands run inside the resident daemon (imlazy_daemon.py) when it is
+running, with the state kept in RAM; otherwise they run here directly.
 """
 
 import json
 import os
+import random
+import re
 import sys
+import time
 import uuid
 import hashlib
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows: state writes are unlocked
+    fcntl = None
+
+
+OPTIONS = ("--namespace", "--expect-version")  # Options taking a value, valid for any command
+
+
+def split_options(argv):
+    """argv without OPTIONS pairs, and {option: value}."""
+    args, options = [], {}
+    argv = iter(argv)
+    for arg in argv:
+        if arg in OPTIONS:
+            options[arg] = next(argv, None)
+        else:
+            args.append(arg)
+    return args, options
+
+
+if __name__ == "__main__":
+    _args = split_options(sys.argv[1:])[0]
+    if _args[:1] != ["watch"]:  # A stream can't go through the daemon
+        from imlazy_daemon import forward
+        forward("state", stdin=_args[:1] in (["batch"], ["apply"]) and _args[1:2] in ([], ["-"]))
+
 IMLAZY_HOME = Path.home() / ".imlazy"
 WORKING_DIR = IMLAZY_HOME / "working"
-STATE_FILE = WORKING_DIR / "state.json"
+NAMESPACES_DIR = WORKING_DIR / "ns"  # ns/<namespace>/state.json, state.journal, archive/
+REGISTRY_FILE = WORKING_DIR / "registry.json"
+REGISTRY_LOCK = WORKING_DIR / "registry.lock"
+LEGACY_STATE_FILE = WORKING_DIR / "state.json"  # Before namespaces
+JOURNAL_MAX_BYTES = 256 * 1024  # Compact into a new snapshot past this size
+CAS_RETRIES = 8  # Attempts per write before giving up on a contended state
+WATCH_POLL_SECONDS = 0.2  # `watch` interval where inotify is unavailable
+
+# Never captured by checkpoints nor undone by a rollback: episode metadata,
+# plus the append-only histories and retry counter, so what a failed attempt
+# taught (and how many attempts were made) survives going back
+CHECKPOINT_SKIP = {"episode_id", "project_hash", "created_at", "updated_at", "version",
+                   "history_archived", "retry_count", "thought_trace", "error_log", "critiques"}
+
+# Items kept inline per history list (0 = unbounded). Older items spill to
+# archive/<episode_id>.jsonl; override with IMLAZY_HISTORY_LIMITS=KEY=N,...
+HISTORY_LIMITS = {"thought_trace": 50, "error_log": 20, "critiques": 20}
 
 DEFAULT_STATE = {
     # Task
@@ -63,7 +136,9 @@ DEFAULT_STATE = {
     "episode_id": "",
     "project_hash": "",
     "created_at": "",
-    "updated_at": ""
+    "updated_at": "",
+    "version": 0,  # Bumped by every committed change
+    "history_archived": {}  # History list -> items moved to the archive
 }
 
 VALID_NODES = ["PLANNER", "REASONER", "CODER", "VERIFIER", "REFLECTOR", "CONSOLIDATOR"]
@@ -77,43 +152,407 @@ def ensure_dirs():
     (IMLAZY_HOME / "procedural").mkdir(exist_ok=True)
 
 
+def _path_hash(path):
+    return hashlib.md5(str(path).encode()).hexdigest()[:8]
+
+
+# (path, registry file key) -> project root, so repeated lookups cost a stat
+_root_cache = {}
+
+
+def project_root(path=None):
+    """
+    The project directory containing `path` (default: the cwd): the nearest
+    ancestor that is a git top level or whose hash already names a registered
+    episode, else `path` itself. Subdirectories of a project thus share its
+    state and memory shard.
+    """
+    path = Path(path or os.getcwd()).resolve()
+    key = (path, _file_key(REGISTRY_FILE))
+    if key not in _root_cache:
+        registry = read_registry()
+        known = set(registry) | {entry.get("project_hash") for entry in registry.values()}
+        _root_cache[key] = next(
+            (directory for directory in (path, *path.parents)
+             if (directory / ".git").exists() or _path_hash(directory) in known),
+            path)
+    return _root_cache[key]
+
+
 def get_project_hash(project_path=None):
-    """Generate a hash for the current project."""
-    if project_path is None:
-        project_path = os.getcwd()
-    return hashlib.md5(project_path.encode()).hexdigest()[:8]
+    """Generate a hash for the project containing `project_path` (default: the cwd)."""
+    return _path_hash(project_root(project_path))
+
+
+def namespace():
+    """The working-state namespace: IMLAZY_NAMESPACE, else the project's hash."""
+    name = os.environ.get("IMLAZY_NAMESPACE") or get_project_hash()
+    return re.sub(r"[^A-Za-z0-9_-]", "_", name)[:64]
+
+
+def namespace_dir(name=None):
+    """Directory holding a namespace's state files (the current one by default)."""
+    return NAMESPACES_DIR / (name or namespace())
 
 
-def load_state():
-    """Load current state from file."""
-    if STATE_FILE.exists():
-        with open(STATE_FILE, 'r') as f:
+def state_file(name=None):
+    return namespace_dir(name) / "state.json"
+
+
+def journal_file(name=None):
+    return namespace_dir(name) / "state.journal"
+
+
+@contextmanager
+def _lock(path, exclusive):
+    if fcntl is None:
+        yield
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _state_lock(exclusive, name=None):
+    """Shared lock for loads, exclusive for journal appends and snapshots (per namespace)."""
+    return _lock(namespace_dir(name) / "state.lock", exclusive)
+
+
+def _adopt_legacy_state(directory):
+    """Move a pre-namespace working/state.json (and its journal and archive) into its project's namespace."""
+    try:
+        with open(LEGACY_STATE_FILE, 'r') as f:
+            legacy = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+    if legacy.get("project_hash") != directory.name:
+        return
+    directory.mkdir(parents=True, exist_ok=True)
+    archive = WORKING_DIR / "archive" / f"{legacy.get('episode_id') or 'unknown'}.jsonl"
+    moves = [(archive, directory / "archive" / archive.name),
+             (WORKING_DIR / "state.journal", directory / "state.journal"),
+             (LEGACY_STATE_FILE, directory / "state.json")]  # Last: it marks the move done
+    for source, target in moves:
+        try:
+            if source.exists():
+                target.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(source, target)
+        except FileNotFoundError:
+            pass  # Nothing to move, or a concurrent load moved it first
+    _register(legacy)
+
+
+def _register(state):
+    """Record the namespace's episode in the registry (REGISTRY_FILE) of active episodes."""
+    with _lock(REGISTRY_LOCK, exclusive=True):
+        registry = read_registry()
+        registry[namespace()] = {
+            "episode_id": state.get("episode_id"),
+            "project_hash": state.get("project_hash"),
+            "cwd": str(project_root()),
+            "current_node": state.get("current_node"),
+            "created_at": state.get("created_at"),
+            "updated_at": state.get("updated_at"),
+        }
+        tmp_path = REGISTRY_FILE.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(registry, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, REGISTRY_FILE)
+
+
+def read_registry():
+    try:
+        with open(REGISTRY_FILE, 'r') as f:
             return json.load(f)
-    return None
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def list_episodes():
+    """Registered episodes, newest first, skipping namespaces whose state is gone."""
+    current = namespace()
+    _adopt_legacy_state(namespace_dir(current))
+    episodes = [
+        {"namespace": name, "current": name == current, **entry}
+        for name, entry in read_registry().items()
+        if (namespace_dir(name) / "state.json").exists()
+    ]
+    episodes.sort(key=lambda episode: episode.get("updated_at") or "", reverse=True)
+    return {"namespace": current, "count": len(episodes), "episodes": episodes}
+
+
+# Per namespace directory: ((snapshot key, journal key), state) of the last
+# load or write, so a resident daemon only re-reads after another process
+# changed the files
+_state_cache = {}
+
+
+def _file_key(path):
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
 
+def _files_key(name=None):
+    return (_file_key(state_file(name)), _file_key(journal_file(name)))
 
-def save_state(state):
-    """Save state to file."""
+
+def _read_state(name=None):
+    """The snapshot with the journal replayed onto it (call under the lock)."""
+    with open(state_file(name), 'r') as f:
+        state = json.load(f)
+    try:
+        with open(journal_file(name), 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Torn line of an interrupted append
+                for operation in record["ops"]:
+                    apply_op(state, operation)
+                state["updated_at"] = record["at"]
+                state["version"] = record.get("v", state.get("version", 0) + 1)
+    except FileNotFoundError:
+        pass
+    return state
+
+
+def load_state(name=None):
+    """Load a namespace's (by default the current one's) state: snapshot plus journal."""
+    directory = namespace_dir(name)
+    if not (directory / "state.json").exists():
+        if name is None:
+            _adopt_legacy_state(directory)
+        if not (directory / "state.json").exists():
+            return None
+    with _state_lock(exclusive=False, name=name):
+        key = _files_key(name)
+        if key[0] is None:
+            return None
+        cached = _state_cache.get(directory)
+        if cached is None or cached[0] != key:
+            cached = _state_cache[directory] = (key, _read_state(name))
+    return cached[1]
+
+
+def history_limits():
+    """HISTORY_LIMITS with the IMLAZY_HISTORY_LIMITS overrides applied."""
+    limits = dict(HISTORY_LIMITS)
+    for part in filter(None, os.environ.get("IMLAZY_HISTORY_LIMITS", "").split(",")):
+        key, _, number = part.partition("=")
+        limits[key.strip()] = int(number)
+    return limits
+
+
+def archive_path(state):
+    return namespace_dir() / "archive" / f"{state.get('episode_id') or 'unknown'}.jsonl"
+
+
+def _spill_history(state):
+    """Move history items beyond their limit from `state` to the episode archive."""
+    archived = state.setdefault("history_archived", {})
+    lines = []
+    for key, limit in history_limits().items():
+        items = state.get(key)
+        if not limit or not isinstance(items, list) or len(items) <= limit:
+            continue
+        spill = len(items) - limit
+        start = archived.get(key, 0)
+        # Numbered, so items re-spilled after a crash before the snapshot dedupe
+        lines += [json.dumps({"key": key, "n": start + i, "item": item}, ensure_ascii=False)
+                  for i, item in enumerate(items[:spill])]
+        state[key] = items[spill:]
+        archived[key] = start + spill
+    if lines:
+        archive_path(state).parent.mkdir(parents=True, exist_ok=True)
+        with open(archive_path(state), 'a') as f:
+            f.write("\n" + "\n".join(lines) + "\n")
+
+
+def read_archive(state):
+    """The episode's archived history items, oldest first, per list."""
+    archived = state.get("history_archived") or {}
+    found = {}
+    try:
+        with open(archive_path(state), 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record["n"] < archived.get(record["key"], 0):
+                    found.setdefault(record["key"], {})[record["n"]] = record["item"]
+    except FileNotFoundError:
+        pass
+    return {key: [items[n] for n in sorted(items)] for key, items in found.items()}
+
+
+def load_full_state():
+    """The state with archived history items restored in front of the inline ones."""
+    state = load_state()
+    if state is None or not any((state.get("history_archived") or {}).values()):
+        return state
+    full = dict(state)
+    for key, items in read_archive(state).items():
+        full[key] = items + list(state.get(key) or [])
+    return full
+
+
+def checkpoint_path(state):
+    return namespace_dir() / "checkpoints" / f"{state.get('episode_id') or 'unknown'}.jsonl"
+
+
+def _digest(value):
+    return hashlib.md5(json.dumps(value, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def _checkpoint(state):
+    """
+    Append a checkpoint of `state` holding only the keys changed since the
+    previous one (call under the lock). A sidecar .head.json keeps the last
+    checkpoint's number and per-key digests, so nothing else is re-read.
+    """
+    path = checkpoint_path(state)
+    head_path = path.with_suffix(".head.json")
+    try:
+        with open(head_path, 'r') as f:
+            head = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        head = {"n": -1, "digests": {}}
+
+    digests = {key: _digest(value) for key, value in state.items() if key not in CHECKPOINT_SKIP}
+    record = {
+        "n": head["n"] + 1,
+        "at": state.get("updated_at"),
+        "node": state.get("current_node"),
+        "version": state.get("version", 0),
+        "set": {key: state[key] for key, digest in digests.items()
+                if head["digests"].get(key) != digest},
+        "unset": [key for key in head["digests"] if key not in digests],
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    tmp_path = head_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump({"n": record["n"], "digests": digests}, f)
+    os.replace(tmp_path, head_path)
+
+
+def read_checkpoints(state):
+    """The episode's checkpoint records by number (a re-written number keeps its last record)."""
+    records = {}
+    try:
+        with open(checkpoint_path(state), 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[record["n"]] = record
+    except FileNotFoundError:
+        pass
+    return [records[n] for n in sorted(records)]
+
+
+def checkpoint_state(records, n):
+    """The checkpointed keys as of checkpoint `n`: the deltas up to it, folded."""
+    state = {}
+    for record in records:
+        if record["n"] > n:
+            break
+        state.update(record["set"])
+        for key in record["unset"]:
+            state.pop(key, None)
+    return state
+
+
+def _write_snapshot(state):
+    """Atomically replace the snapshot and drop the journal it now contains (call under the lock)."""
+    _spill_history(state)
+    path = state_file()
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    journal_file().unlink(missing_ok=True)
+    _register(state)
+
+
+def save_state(state, checkpoint=False):
+    """Save the whole state as a new snapshot (and checkpoint it if `checkpoint`)."""
     ensure_dirs()
     state["updated_at"] = datetime.now().isoformat()
-    with open(STATE_FILE, 'w') as f:
-        json.dump(state, f, indent=2, ensure_ascii=False)
+    with _state_lock(exclusive=True):
+        _write_snapshot(state)
+        if checkpoint:
+            _checkpoint(state)
+        _state_cache[namespace_dir()] = (_files_key(), state)
+
+
+def commit(state, operations, base_version):
+    """
+    Persist ops already applied to `state` as one journal record (a few
+    hundred bytes), or fold the journal into a new snapshot at a transition
+    or once it outgrows JOURNAL_MAX_BYTES.
+
+    Compare-and-swap: `state` was staged from `base_version`, and nothing is
+    written (returns False) if another writer committed since. The lock is
+    held only for that check and the append.
+    """
+    ensure_dirs()
+    directory = namespace_dir()
+    now = datetime.now().isoformat()
+
+    with _state_lock(exclusive=True):
+        cached = _state_cache.get(directory)
+        if cached is None or cached[0] != _files_key():
+            # Changed on disk since our load: fine if only compacted
+            if _read_state().get("version", 0) != base_version:
+                _state_cache.pop(directory, None)
+                return False
+
+        state["updated_at"] = now
+        state["version"] = base_version + 1
+        line = json.dumps({"at": now, "v": state["version"], "ops": operations},
+                          ensure_ascii=False) + "\n"
+        fd = os.open(journal_file(), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b"\n":
+                line = "\n" + line  # Start after a torn line, not inside it
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+        if any(operation["op"] == "transition" for operation in operations):
+            _write_snapshot(state)
+            _checkpoint(state)
+        elif journal_file().stat().st_size > JOURNAL_MAX_BYTES:
+            _write_snapshot(state)
+        _state_cache[directory] = (_files_key(), state)
+    return True
 
 
 def init_state(project_hash=None):
     """Initialize a new cognitive state."""
     ensure_dirs()
 
-    state = DEFAULT_STATE.copy()
-    state["problem_reflection"] = DEFAULT_STATE["problem_reflection"].copy()
-    state["test_results"] = {k: list(v) for k, v in DEFAULT_STATE["test_results"].items()}
+    # Deep copy: a resident daemon must not append into DEFAULT_STATE's lists
+    state = json.loads(json.dumps(DEFAULT_STATE))
 
     state["episode_id"] = str(uuid.uuid4())[:8]
     state["project_hash"] = project_hash or get_project_hash()
     state["created_at"] = datetime.now().isoformat()
     state["updated_at"] = state["created_at"]
 
-    save_state(state)
+    save_state(state, checkpoint=True)  # Checkpoint 0: the episode as PLANNER starts it
     return state
 
 
@@ -138,56 +577,38 @@ def get_value(key=None):
     return {"key": key, "value": value}
 
 
-def set_value(key, value):
-    """Set a value in state."""
-    state = load_state()
-    if state is None:
-        return {"error": "No active state. Run 'init' first."}
-
-    # Parse JSON value if it looks like JSON
+def parse_value(value):
+    """Parse a CLI value as JSON if it looks like a JSON list or object."""
     if isinstance(value, str):
         try:
             if value.startswith('[') or value.startswith('{'):
                 value = json.loads(value)
         except json.JSONDecodeError:
             pass
+    return value
+
 
-    # Support nested keys
+def _parent(state, key):
+    """The dict holding a (possibly nested) key, created as needed, and its last part."""
     keys = key.split(".")
     target = state
     for k in keys[:-1]:
         if k not in target:
             target[k] = {}
         target = target[k]
+    return target, keys[-1]
 
-    target[keys[-1]] = value
-    save_state(state)
-    return {"success": True, "key": key, "value": value}
-
-
-def update_value(key, value):
-    """Append a value to a list in state."""
-    state = load_state()
-    if state is None:
-        return {"error": "No active state. Run 'init' first."}
 
-    # Parse JSON value if it looks like JSON
-    if isinstance(value, str):
-        try:
-            if value.startswith('[') or value.startswith('{'):
-                value = json.loads(value)
-        except json.JSONDecodeError:
-            pass
+def apply_set(state, key, value):
+    """Set a value in a loaded state."""
+    target, final_key = _parent(state, key)
+    target[final_key] = value
+    return {"success": True, "key": key, "value": value}
 
-    # Support nested keys
-    keys = key.split(".")
-    target = state
-    for k in keys[:-1]:
-        if k not in target:
-            target[k] = {}
-        target = target[k]
 
-    final_key = keys[-1]
+def apply_update(state, key, value):
+    """Append a value to a list in a loaded state."""
+    target, final_key = _parent(state, key)
     if final_key not in target:
         target[final_key] = []
 
@@ -195,17 +616,24 @@ def update_value(key, value):
         return {"error": f"Key {key} is not a list"}
 
     target[final_key].append(value)
-    save_state(state)
     return {"success": True, "key": key, "appended": value}
 
 
-def transition_node(node):
-    """Transition to a new node in the workflow."""
-    state = load_state()
-    if state is None:
-        return {"error": "No active state. Run 'init' first."}
+def apply_unset(state, key):
+    """Remove a (possibly nested) key from a loaded state."""
+    *keys, final_key = key.split(".")
+    target = state
+    for k in keys:  # Read-only walk: a missing key must not leave empty dicts behind
+        target = target.get(k) if isinstance(target, dict) else None
+    if not isinstance(target, dict) or final_key not in target:
+        return {"error": f"Key not found: {key}"}
+    del target[final_key]
+    return {"success": True, "key": key, "removed": True}
 
-    node = node.upper()
+
+def apply_transition(state, node, timestamp=None):
+    """Move a loaded state to a new node."""
+    node = str(node).upper()
     if node not in VALID_NODES:
         return {"error": f"Invalid node: {node}. Valid: {VALID_NODES}"}
 
@@ -217,14 +645,113 @@ def transition_node(node):
         "type": "transition",
         "from": prev_node,
         "to": node,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": timestamp or datetime.now().isoformat()
     }
     state["thought_trace"].append(transition)
 
-    save_state(state)
     return {"success": True, "from": prev_node, "to": node}
 
 
+# op name -> (apply function, argument fields)
+OPERATIONS = {
+    "set": (apply_set, ("key", "value")),
+    "update": (apply_update, ("key", "value")),
+    "unset": (apply_unset, ("key",)),
+    "transition": (apply_transition, ("node", "timestamp")),
+}
+
+
+def apply_op(state, operation):
+    """Apply one op dict ({"op": NAME, ...fields}) to a loaded state."""
+    name = operation.get("op") if isinstance(operation, dict) else None
+    if name not in OPERATIONS:
+        return {"error": f"Invalid op: {name}. Valid: {list(OPERATIONS)}"}
+    apply, fields = OPERATIONS[name]
+    missing = [field for field in fields if field not in operation]
+    if missing:
+        return {"error": f"Op {name} needs {', '.join(missing)}"}
+    return apply(state, *(operation[field] for field in fields))
+
+
+def set_value(key, value, expect_version=None):
+    """Set a value in state."""
+    return _single({"op": "set", "key": key, "value": parse_value(value)}, expect_version)
+
+
+def update_value(key, value, expect_version=None):
+    """Append a value to a list in state."""
+    return _single({"op": "update", "key": key, "value": parse_value(value)}, expect_version)
+
+
+def transition_node(node, expect_version=None):
+    """Transition to a new node in the workflow."""
+    return _single({"op": "transition", "node": node}, expect_version)
+
+
+def _single(operation, expect_version=None):
+    result = apply_batch([operation], expect_version)
+    if "success" in result:
+        return {**result["results"][0], "version": result["version"]}
+    return result["results"][0] if "results" in result else result
+
+
+def read_operations(text):
+    """Operations from a JSON array or JSONL (one object per line)."""
+    text = text.strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def apply_batch(operations, expect_version=None):
+    """
+    Apply set/update/transition operations with one load and one save.
+    All or nothing: if any operation fails, the state is left untouched.
+    Values are taken as given (already JSON), unlike CLI `set`/`update`.
+
+    Optimistic: the ops are staged on the loaded state and committed only
+    if no other writer got in between; otherwise they are re-staged on the
+    fresh state, up to CAS_RETRIES times. With `expect_version`, a state at
+    any other version is a conflict error instead.
+    """
+    # Transitions are journaled with their time, so replay is deterministic
+    operations = [
+        {**operation, "node": str(operation.get("node", "")).upper(),
+         "timestamp": operation.get("timestamp") or datetime.now().isoformat()}
+        if isinstance(operation, dict) and operation.get("op") == "transition" else operation
+        for operation in operations
+    ]
+
+    for attempt in range(CAS_RETRIES):
+        state = load_state()
+        if state is None:
+            return {"error": "No active state. Run 'init' first."}
+        version = state.get("version", 0)
+        if expect_version is not None and version != expect_version:
+            return {"error": "Version conflict", "expected": expect_version, "version": version}
+
+        # Staged on a copy: a failed op may already have changed it (e.g. made
+        # intermediate dicts), and the loaded state is the daemon's cache
+        staged = json.loads(json.dumps(state))
+        results = []
+        for index, operation in enumerate(operations):
+            result = apply_op(staged, operation)
+            results.append(result)
+            if "error" in result:
+                return {"error": f"Operation {index} failed; nothing was applied",
+                        "failed": index, "results": results}
+
+        if commit(staged, operations, version):
+            return {"success": True, "applied": len(results), "results": results,
+                    "version": staged["version"]}
+        if expect_version is not None:
+            return {"error": "Version conflict", "expected": expect_version,
+                    "version": (load_state() or {}).get("version")}
+        time.sleep(random.uniform(0, 0.002 * (attempt + 1)))  # Back off from the other writer
+
+    return {"error": f"State kept changing; gave up after {CAS_RETRIES} attempts"}
+
+
 def reset_state():
     """Reset state for a new episode while preserving project context."""
     state = load_state()
@@ -232,15 +759,214 @@ def reset_state():
     return init_state(project_hash)
 
 
-def dump_state():
-    """Dump current state as formatted JSON."""
+def list_checkpoints():
+    """The episode's checkpoints with the keys each one recorded."""
+    state = load_state()
+    if state is None:
+        return {"error": "No active state"}
+    checkpoints = [
+        {"n": record["n"], "at": record["at"], "node": record["node"], "version": record["version"],
+         "changed": sorted(record["set"]) + sorted(record["unset"])}
+        for record in read_checkpoints(state)
+    ]
+    return {"episode_id": state["episode_id"], "count": len(checkpoints), "checkpoints": checkpoints}
+
+
+def rollback(n, expect_version=None):
+    """
+    Restore the state to checkpoint `n` as one batch (so through the usual
+    compare-and-swap), ending in a transition to its node that records a
+    new checkpoint. CHECKPOINT_SKIP keys are left as they are.
+    """
+    state = load_state()
+    if state is None:
+        return {"error": "No active state"}
+    records = read_checkpoints(state)
+    if not any(record["n"] == n for record in records):
+        return {"error": f"No checkpoint {n}. Run 'checkpoints' to list them."}
+    target = checkpoint_state(records, n)
+
+    operations = [{"op": "set", "key": key, "value": value}
+                  for key, value in target.items()
+                  if key != "current_node" and state.get(key) != value]
+    operations += [{"op": "unset", "key": key}
+                   for key in state if key not in target and key not in CHECKPOINT_SKIP]
+    operations += [
+        {"op": "update", "key": "thought_trace",
+         "value": {"type": "rollback", "checkpoint": n, "timestamp": datetime.now().isoformat()}},
+        {"op": "transition", "node": target["current_node"]},
+    ]
+    result = apply_batch(operations, expect_version)
+    if "error" in result:
+        return result
+    return {"success": True, "checkpoint": n, "node": target["current_node"],
+            "restored": sorted(op["key"] for op in operations[:-2]), "version": result["version"]}
+
+
+def diff_checkpoints(a, b):
+    """Keys whose values differ between checkpoints `a` and `b`, with both values."""
     state = load_state()
+    if state is None:
+        return {"error": "No active state"}
+    records = read_checkpoints(state)
+    numbers = {record["n"] for record in records}
+    missing = [n for n in (a, b) if n not in numbers]
+    if missing:
+        return {"error": f"No checkpoint {missing[0]}. Run 'checkpoints' to list them."}
+    old, new = checkpoint_state(records, a), checkpoint_state(records, b)
+    changes = {key: {"a": old.get(key), "b": new.get(key)}
+               for key in sorted(set(old) | set(new)) if old.get(key) != new.get(key)}
+    return {"a": a, "b": b, "changed": len(changes), "diff": changes}
+
+
+# inotify(7) events that mean the state files changed: journal appends,
+# snapshot renames, and files created or deleted by init/compaction
+IN_MODIFY, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x2, 0x80, 0x100, 0x200
+
+
+def _inotify(directory):
+    """A non-blocking inotify fd watching `directory`, or None off Linux or on failure."""
+    if not sys.platform.startswith("linux"):
+        return None
+    import ctypes
+    import ctypes.util
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, str(directory).encode(),
+                              IN_MODIFY | IN_MOVED_TO | IN_CREATE | IN_DELETE) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _appended(old, new, key):
+    """Items appended to list `key` between two states (allowing for items spilled to the archive), or None."""
+    before, after = old.get(key), new.get(key)
+    if not isinstance(before, list) or not isinstance(after, list):
+        return None
+    spilled = 0
+    if old.get("episode_id") == new.get("episode_id"):
+        spilled = ((new.get("history_archived") or {}).get(key, 0)
+                   - (old.get("history_archived") or {}).get(key, 0))
+    if spilled > len(before):
+        # Some appended items went straight to the archive with the rest
+        archived = read_archive(new).get(key, [])
+        return archived[len(archived) - (spilled - len(before)):] + after
+    kept = before[spilled:]
+    return after[len(kept):] if after[:len(kept)] == kept else None
+
+
+def state_events(old, new, keys=None):
+    """
+    Events turning `old` into `new` (either may be None): a new episode, one
+    per transition, and one change per top-level key (list keys that only
+    grew report the appended items). `keys` limits them to those keys;
+    transitions count as current_node.
+    """
+    if new is None:
+        return []
+    old = old or {}
+    stamp = {"version": new.get("version", 0), "at": new.get("updated_at")}
+    events = []
+    if old.get("episode_id") != new.get("episode_id"):
+        events.append({"event": "episode", "episode_id": new.get("episode_id"), **stamp})
+
+    if not keys or "current_node" in keys:
+        # Every transition leaves an entry in thought_trace, so changes
+        # coalesced into one read (or back to the same node) are all reported
+        trace = _appended(old, new, "thought_trace")
+        if trace is not None:
+            transitions = [(item.get("from"), item.get("to")) for item in trace
+                           if isinstance(item, dict) and item.get("type") == "transition"]
+        elif old.get("current_node") != new.get("current_node"):
+            transitions = [(old.get("current_node"), new.get("current_node"))]
+        else:
+            transitions = []
+        events += [{"event": "transition", "from": before, "to": after, **stamp}
+                   for before, after in transitions]
+
+    for key in sorted(new.keys() | old.keys()):
+        if key in ("updated_at", "version", "current_node") or (keys and key not in keys):
+            continue
+        if old.get(key) == new.get(key):
+            continue
+        appended = _appended(old, new, key)
+        if appended is not None:
+            events.append({"event": "change", "key": key, "appended": appended, **stamp})
+        else:
+            events.append({"event": "change", "key": key, "value": new.get(key), **stamp})
+    return events
+
+
+def watch(keys=None, once=False, timeout=None, poll=False):
+    """
+    Print state events as JSON lines until `timeout` seconds pass (or, with
+    `once`, after the first change). Blocks in inotify on Linux, so a
+    change is reported as soon as it is written; elsewhere (or with `poll`)
+    it stats the state files every WATCH_POLL_SECONDS.
+    """
+    import select
+
+    directory = namespace_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    fd = None if poll else _inotify(directory)
+    deadline = time.monotonic() + timeout if timeout else None
+    print(json.dumps({"event": "watching", "namespace": namespace(),
+                      "mode": "poll" if fd is None else "inotify"}), flush=True)
+
+    state, key = load_state(), _files_key()
+    try:
+        while True:
+            wait = None if deadline is None else deadline - time.monotonic()
+            if wait is not None and wait <= 0:
+                return
+            if fd is None:
+                time.sleep(WATCH_POLL_SECONDS if wait is None else min(wait, WATCH_POLL_SECONDS))
+                if _files_key() == key:
+                    continue
+            else:
+                if not select.select([fd], [], [], wait)[0]:
+                    continue
+                while True:  # Drain; the events themselves carry nothing we need
+                    try:
+                        if not os.read(fd, 65536):
+                            break
+                    except BlockingIOError:
+                        break
+            key = _files_key()
+            new = load_state()
+            events = state_events(state, new, keys)
+            state = new
+            for event in events:
+                print(json.dumps(event, ensure_ascii=False), flush=True)
+            if once and events:
+                return
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+def dump_state(full=False):
+    """Dump current state as formatted JSON (with archived history if `full`)."""
+    state = load_full_state() if full else load_state()
     if state is None:
         return {"error": "No active state"}
     return state
 
 
 def main():
+    args, options = split_options(sys.argv[1:])
+    sys.argv[1:] = args
+    if options.get("--namespace"):
+        os.environ["IMLAZY_NAMESPACE"] = options["--namespace"]
+    expect = options.get("--expect-version")
+    expect = int(expect) if expect is not None else None
     if len(sys.argv) < 2:
         print(json.dumps({"error": "Usage: state-manager.py <command> [args]"}))
         sys.exit(1)
@@ -260,21 +986,57 @@ def main():
             if len(sys.argv) < 4:
                 result = {"error": "Usage: state-manager.py set KEY VALUE"}
             else:
-                result = set_value(sys.argv[2], sys.argv[3])
+                result = set_value(sys.argv[2], sys.argv[3], expect)
         elif cmd == "update":
             if len(sys.argv) < 4:
                 result = {"error": "Usage: state-manager.py update KEY VALUE"}
             else:
-                result = update_value(sys.argv[2], sys.argv[3])
+                result = update_value(sys.argv[2], sys.argv[3], expect)
         elif cmd == "transition":
             if len(sys.argv) < 3:
                 result = {"error": "Usage: state-manager.py transition NODE"}
             else:
-                result = transition_node(sys.argv[2])
+                result = transition_node(sys.argv[2], expect)
+        elif cmd in ("batch", "apply"):
+            source = sys.argv[2] if len(sys.argv) > 2 else "-"
+            if source == "-":
+                text = sys.stdin.read()
+            else:
+                with open(source, 'r') as f:
+                    text = f.read()
+            result = apply_batch(read_operations(text), expect)
         elif cmd == "reset":
             result = reset_state()
         elif cmd == "dump":
-            result = dump_state()
+            result = dump_state(full="--full" in sys.argv)
+        elif cmd == "episodes":
+            result = list_episodes()
+        elif cmd == "checkpoints":
+            result = list_checkpoints()
+        elif cmd == "rollback":
+            if len(sys.argv) < 3:
+                result = {"error": "Usage: state-manager.py rollback N"}
+            else:
+                result = rollback(int(sys.argv[2]), expect)
+        elif cmd == "watch":
+            keys = None
+            if "--keys" in sys.argv:
+                idx = sys.argv.index("--keys")
+                keys = set(filter(None, sys.argv[idx + 1].split(","))) if idx + 1 < len(sys.argv) else None
+            timeout = None
+            if "--timeout" in sys.argv:
+                idx = sys.argv.index("--timeout")
+                timeout = float(sys.argv[idx + 1]) if idx + 1 < len(sys.argv) else None
+            try:
+                watch(keys, once="--once" in sys.argv, timeout=timeout, poll="--poll" in sys.argv)
+            except KeyboardInterrupt:
+                pass
+            return
+        elif cmd == "diff":
+            if len(sys.argv) < 4:
+                result = {"error": "Usage: state-manager.py diff A B"}
+            else:
+                result = diff_checkpoints(int(sys.argv[2]), int(sys.argv[3]))
         else:
             result = {"error": f"Unknown command: {cmd}"}
 